@@ -1,5 +1,11 @@
 # app.py
+import copy
+import hashlib
 import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 import numpy as np
 import pandas as pd
 import streamlit as st
@@ -7,12 +13,40 @@ import plotly.express as px
 import plotly.graph_objects as go
 
 from model5 import (
+    ENGINE_VERSION,
     HierarchicalAgent,
     MultiAgentWorld,
     ActionBases,
     StateDynamicsCoeffs,
     EscalationCoeffs,
+    RecordingSpec,
 )
+from result_cache import ResultCache, config_hash
+from registry import ExperimentRegistry
+from ensembles import antithetic_pairs, compare_frames, rao_blackwell_estimate, run_pooled
+from synthetic import generate_scenario
+from dyads import bloc_labels_from_W, block_pairs, dyad_tensor_from_df, pair_matrix, top_k_pairs
+from lod import DEFAULT_POINT_BUDGET, lttb, minmax_bins, mode_bins, window_slice
+from surrogate import train_emulator
+
+# تنظیمات به‌روزرسانی بیزی ضرایب تشدید (همان پیش‌فرض‌های MultiAgentWorld)؛
+# صریح نگه داشته می‌شوند چون جزء کلید کش نتایج هستند.
+BAYES_SETTINGS = dict(bayes_update_every=10, bayes_window=2000, bayes_min_samples=200)
+
+CHECKPOINT_EVERY = 5
+# فاصله نقطه‌های بازگشت (fork کپی-هنگام-نوشتن) در اجرای تکی؛ شاخه‌های «چه می‌شد اگر» از این گام‌ها شروع می‌شوند
+STEADY_WINDOW = 20
+# طول هر پنجره در تشخیص حالت پایا (دو پنجره پیاپی مقایسه می‌شوند)
+
+EMULATOR_INPUTS = {"rho": ("rho_c", 0.0, 1.0), "d": ("d_c", 0.0, 1.0), "f": ("f_c", 0.0, 1.0),
+                   "chi": ("chi_c", 0.1, 3.0), "beta": ("beta_c", 0.1, 10.0)}
+# ورودی‌های شبیه‌ساز جایگزین: کلید پیکربندی → (فیلد AgentArrays، بازه کامل اسلایدر)
+EMULATOR_REPLICAS = 4
+# تعداد تکرار Monte Carlo برای هر نقطه آموزش
+
+RESULT_CACHE_DIR = os.environ.get("SIM_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".sim_cache"))
+RESULT_CACHE_MAX_MB = int(os.environ.get("SIM_CACHE_MAX_MB", "512"))
+REGISTRY_DIR = os.environ.get("SIM_REGISTRY_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".sim_registry"))
 
 # ==============================================
 # Tooltip texts (دو خطی و خیلی ساده)
@@ -25,6 +59,10 @@ TOOLTIPS = {
     "seed": "عدد ثابت برای تصادفی‌سازی.\nSeed یکسان → نتیجه یکسان.",
     "steps": "تعداد گام‌های زمانی شبیه‌سازی.\nعدد بزرگ‌تر یعنی دوره طولانی‌تر.",
     "num_runs": "تعداد دفعات تکرار شبیه‌سازی.\nبرای رفع خطای تصادفی، نتایجِ چند اجرا با هم میانگین گرفته می‌شوند.",
+    "mean_field": "یک اجرای قطعی که به جای نمونه‌گیری، امید ریاضی را جلو می‌برد.\nپوشش = سهم گام‌هایی که خطا کمتر از ۲ خطای استاندارد میانگین است.",
+    "large_world": "جهان مصنوعی با صدها تا هزاران کشور و شبکه رقابت تُنُک.\nفقط خلاصه‌های کلی و بلوکی ثبت و نمایش داده می‌شود.",
+    "lw_degree": "تعداد همسایه (متحد/رقیب) هر کشور در شبکه تعاملات.\nهزینه هر گام با N×همسایه رشد می‌کند، نه N².",
+    "lw_blocs": "تعداد بلوک‌ها؛ متحدان از بلوک خود و رقبا از بلوک‌های دیگرند.\nنمودارهای بلوکی به ازای همین گروه‌ها رسم می‌شوند.",
 
     # سفارشی
     "custom_n": "تعداد کشورهای سناریوی دستی را مشخص می‌کند.\nبین ۲ تا ۵ کشور قابل انتخاب است.",
@@ -77,6 +115,21 @@ TOOLTIPS = {
     "section_filter": "فقط این بخش‌ها در جدول تغییرات بیاید.\nبرای خلاصه‌تر شدن نمایش.",
     "run_btn": "شبیه‌سازی را با تنظیمات فعلی اجرا می‌کند.\nنتیجه‌ها پایین صفحه نمایش داده می‌شود.",
     "reset_btn": "مقادیر سفارشی را به حالت پیش‌فرض برمی‌گرداند.\nبرای شروع دوباره از این دکمه استفاده کن.",
+    "lod_budget": "حداکثر تعداد نقطه افقی هر نمودار.\nافق‌های طولانی با حفظ شکل سری‌ها به این تعداد کاهش می‌یابند.",
+    "lod_window": "بازه زمانی نمایش نمودارها (زوم).\nبازه کوچک‌تر یعنی جزئیات بیشتر با همان بودجه نقاط.",
+    "branch_t": "گامی که شاخه از آن جدا می‌شود.\nتا این گام همان اجرای اصلی است و دوباره شبیه‌سازی نمی‌شود.",
+    "branch_run": "از وضعیت ذخیره‌شده در این گام، با دکترین تازه همین کشور ادامه می‌دهد.\nاعداد تصادفی با اجرای اصلی یکسان است تا فقط اثر تغییر دیده شود.",
+    "steady_tol": "حداکثر تغییر میانگین تنش، منابع و احتمال اقدام‌ها بین دو پنجره پیاپی.\nکمتر از این یعنی «حالت پایا»؛ کوچک‌تر = دقیق‌تر ولی دیرتر.",
+    "variance_reduction": "تکرارها با موتور vectorized و اعداد تصادفی جدا برای هر نوع تصمیم اجرا می‌شوند.\nدو تنظیم با یک Seed همان اعداد تصادفی را می‌گیرند؛ ستون‌های _RB امید تشدید را ثبت می‌کنند.",
+    "antithetic": "هر تکرار زوج یک قرینه دارد (همه اعداد تصادفی u → 1-u).\nخطای میانگین با همان تعداد اجرا کمتر می‌شود.",
+    "pooled": "تکرارها هم‌گام اجرا می‌شوند و ضرایب تشدید (α/η) با داده همه آن‌ها یک بار برازش می‌شود.\nضرایب زودتر پایدار می‌شوند؛ پرش از حالت پایا در این حالت انجام نمی‌شود.",
+    "fast_forward": "بعد از تشخیص حالت پایا، باقی گام‌ها شبیه‌سازی نمی‌شوند: منابع با فرمول بسته و بقیه خروجی‌ها از پنجره پایا نمونه‌گیری می‌شوند.\nبرای افق‌های بلند سریع‌تر است؛ خطا هم‌اندازه آستانه است.",
+    "record_stride": "فقط هر k گام یک ردیف خلاصه ذخیره می‌شود؛ شبیه‌سازی همه گام‌ها را اجرا می‌کند.\nبرای افق‌های خیلی بلند حافظه و حجم کش را k برابر کم می‌کند.",
+    "record_memory": "برآورد حجم خروجی‌ای که اجرا در حافظه نگه می‌دارد (تاریخچه، ماتریس‌های دوتایی، خلاصه).\nبا تعداد کشورها به توان دو رشد می‌کند.",
+    "emulator": "بعد از آموزش، با هر تغییر اسلایدرهای ρ، d، f، χ و β پیش‌بینی فوری نشان داده می‌شود.\nیک اجرای واقعی هم در پس‌زمینه انجام و با پیش‌بینی مقایسه می‌شود.",
+    "emulator_train": "تعداد ترکیب‌های پارامتری که برای آموزش شبیه‌سازی می‌شوند.\nبیشتر = دقیق‌تر ولی آموزش کندتر.",
+    "registry_filter": "شرط روی پارامترها یا معیارهای خلاصه، جدا با ویرگول؛ مثل rho > 0.5 یا rho[A] >= 0.3.\nهمه اجراها (حتی نشست‌های قبلی) این‌جا می‌مانند و اجرای دوباره همان تنظیمات از همین دفتر خوانده می‌شود.",
+    "use_cache": "اگر همین تنظیمات قبلاً اجرا شده باشد، نتیجه ذخیره‌شده فوراً نمایش داده می‌شود.\nبرای نمونه‌گیری تازه (بدون Seed) خاموشش کن.",
 
 }
 
@@ -497,36 +550,149 @@ def build_agents_from_configs(agent_cfgs):
         )
     return agents
 
-def run_simulation(agent_cfgs, W, steps, test_mode, seed, doctrine_update_every: int):
-    set_seed_if_needed(test_mode, seed)
-    agents = build_agents_from_configs(agent_cfgs)
-    meta = {
-        "initial": {ag.name: ag.snapshot() for ag in agents},
-        "final": {},
-        "doctrine_update_every": int(doctrine_update_every),
-    }
-
-    world = MultiAgentWorld(
-        agents=agents, interaction_W=W, esc_coeffs=EscalationCoeffs(),
-        doctrine_update_every=int(doctrine_update_every),
-    )
-    for t in range(int(steps)):
-        world.step(t)
+@st.cache_resource
+def get_random_lock():
+    # موتور loop از np.random سراسری می‌کشد: هر اجرا (از seed تا پایان) یا شاخه در این قفل انجام می‌شود
+    # تا اجرای تأیید پس‌زمینه و اجراهای نشست‌های دیگر وسط آن وضعیت np.random را عوض نکنند
+    return threading.RLock()
+
+def run_simulation(agent_cfgs, W, steps, test_mode, seed, doctrine_update_every: int, checkpoint_every: int = 0, steady=None):
+    with get_random_lock():
+        set_seed_if_needed(test_mode, seed)
+        agents = build_agents_from_configs(agent_cfgs)
+        meta = {
+            "initial": {ag.name: ag.snapshot() for ag in agents},
+            "final": {},
+            "doctrine_update_every": int(doctrine_update_every),
+        }
+
+        world = MultiAgentWorld(
+            agents=agents, interaction_W=W, esc_coeffs=EscalationCoeffs(),
+            doctrine_update_every=int(doctrine_update_every), **BAYES_SETTINGS, **steady_kwargs(steady),
+        )
+        checkpoints = {}
+        for t in range(int(steps)):
+            if checkpoint_every > 0 and t % checkpoint_every == 0:
+                # وضعیت قبل از گام t (شامل وضعیت np.random) برای شاخه‌های «چه می‌شد اگر»
+                checkpoints[t] = world.fork()
+            world.step(t)
+            if (steady or {}).get("fast_forward") and world.steady.steady and t + 1 < int(steps):
+                world.fast_forward(int(steps) - t - 1, t + 1)
+                break
 
     meta["final"] = {ag.name: ag.snapshot() for ag in agents}
+    if checkpoints:
+        meta["checkpoints"] = checkpoints
+    if world.steady is not None:
+        meta["steady_events"] = world.steady.to_frame()
     df = pd.DataFrame(world.history)
     return df, meta
 
-def run_multiple_simulations(agent_cfgs, W, steps, test_mode, seed, doctrine_update_every, num_runs):
+def steady_kwargs(steady):
+    # تنظیمات تشخیص حالت پایا برای MultiAgentWorld ({"tol", "fast_forward"} از نوار کناری)
+    if not steady or float(steady.get("tol", 0.0)) <= 0:
+        return {}
+    return dict(steady_tol=float(steady["tol"]), steady_window=STEADY_WINDOW)
+
+def run_branch(checkpoint, t0, steps, modifications):
+    # شاخه از نقطه بازگشت؛ پیشوند [0, t0) دوباره شبیه‌سازی نمی‌شود و خود نقطه بازگشت دست‌نخورده می‌ماند
+    with get_random_lock():
+        world = checkpoint.fork(modifications).resume_random()
+        world.run(int(steps) - int(t0), int(t0))
+    return pd.DataFrame(world.history)
+
+def run_mean_field(agent_cfgs, W, steps, doctrine_update_every: int, steady=None):
+    # یک اجرای قطعی «امید ریاضی» (بدون تصادف) که میانگین Monte Carlo را تقریب می‌زند
+    world = MultiAgentWorld(
+        agents=build_agents_from_configs(agent_cfgs), interaction_W=W, esc_coeffs=EscalationCoeffs(),
+        doctrine_update_every=int(doctrine_update_every), engine="mean_field", **BAYES_SETTINGS, **steady_kwargs(steady),
+    )
+    world.run(int(steps), fast_forward=bool((steady or {}).get("fast_forward")) and world.steady is not None)
+    return pd.DataFrame(world.history)
+
+def cached_mean_field(agent_cfgs, W, steps, test_mode, seed, doctrine_update_every, num_runs, steady=None, ensemble=None):
+    # فقط وقتی مقایسه خواسته شود اجرا می‌شود؛ جدا از نتیجه شبیه‌سازی (و نه در دفتر آزمایش‌ها) کش می‌شود
+    key = config_hash(dict(mean_field=simulation_cache_key(agent_cfgs, W, steps, test_mode, seed, doctrine_update_every,
+                                                            num_runs, steady, ensemble)))
+    return get_result_cache().get_or_compute(key, lambda: run_mean_field(agent_cfgs, W, steps, doctrine_update_every, steady))
+
+def run_replicas(agent_cfgs, W, steps, test_mode, seed, doctrine_update_every, num_runs, steady=None, engine="vectorized",
+                 antithetic=False, pooled=False):
+    # همه تکرارها با هم ساخته و اجرا می‌شوند.
+    # - vectorized: جریان‌های تصادفی نام‌دار (RandomStreams) به‌جای np.random سراسری؛ تکرار k با Seed پایه + k،
+    #   پس دو پیکربندی با یک Seed برای هر تصمیم همان اعداد تصادفی را می‌گیرند (CRN). با antithetic تکرارهای
+    #   فرد قرینه (u → 1-u) تکرار زوج قبلی‌اند.
+    # - pooled: تکرارها هم‌گام (run_pooled) با یک پنجره بیزی مشترک؛ α/η در هر گام به‌روزرسانی یک بار برای
+    #   همه برازش می‌شود (پرش از حالت پایا در این حالت انجام نمی‌شود).
+    fast_forward = bool((steady or {}).get("fast_forward")) and not pooled
+    if engine == "vectorized":
+        base = int(seed) if is_seeded(test_mode, seed) else int(np.random.SeedSequence().generate_state(1)[0])
+        streams = [dict(seed=base + k, antithetic=twin) for k, twin in
+                   ((i // 2, bool(i % 2)) if antithetic else (i, False) for i in range(int(num_runs)))]
+        recording = RecordingSpec("agent")
+    else:
+        streams, recording = [{}] * int(num_runs), None
+    with get_random_lock():
+        set_seed_if_needed(test_mode, seed)
+        worlds, metas = [], []
+        for kwargs in streams:
+            agents = build_agents_from_configs(agent_cfgs)
+            metas.append({"initial": {ag.name: ag.snapshot() for ag in agents}, "doctrine_update_every": int(doctrine_update_every)})
+            worlds.append(MultiAgentWorld(
+                agents=agents, interaction_W=W, esc_coeffs=EscalationCoeffs(), engine=engine, recording=recording,
+                doctrine_update_every=int(doctrine_update_every), **BAYES_SETTINGS, **steady_kwargs(steady), **kwargs,
+            ))
+        store = None
+        if pooled:
+            worlds, store = run_pooled(worlds, int(steps))
+        else:
+            for world in worlds:
+                world.run(int(steps), fast_forward=fast_forward and world.steady is not None)
+
     dfs = []
-    metas = []
-    for i in range(num_runs):
-        run_seed = seed + i if (test_mode and seed is not None) else None
-        df, meta = run_simulation(agent_cfgs, W, steps, test_mode, run_seed, doctrine_update_every)
+    for world, meta in zip(worlds, metas):
+        meta["final"] = {ag.name: ag.snapshot() for ag in world.agents}
+        if world.steady is not None:
+            meta["steady_events"] = world.steady.to_frame()
+        if store is not None:
+            meta["pooled_fits"] = store.n_fits
+        df = pd.DataFrame(world.history)
+        if engine == "vectorized":
+            # ستون‌های Rao-Blackwell (امید ψ_ij به‌جای Y نمونه‌گیری‌شده) از خروجی خلاصه کنار history
+            summary = world.summary.to_frame()
+            df = df.merge(summary[["Time"] + [c for c in summary.columns if c.endswith("_RB")]], on="Time", how="left")
         dfs.append(df)
-        metas.append(meta)
+    return dfs, metas
+
+def variance_reduction_rows(dfs, antithetic):
+    # کاهش واریانس به‌دست‌آمده برای میانگین Global_Escalation (ضریب = واریانس ساده / واریانس روش)
+    rows = []
+    if len(dfs) > 1 and "Global_Escalation_RB" in dfs[0].columns:
+        rows.append(rao_blackwell_estimate(dfs, "Global_Escalation"))
+    pairs = len(dfs) // 2
+    if antithetic and pairs > 1:
+        rows.append(antithetic_pairs(dfs[0:2 * pairs:2], dfs[1:2 * pairs:2], "Global_Escalation"))
+    return pd.DataFrame(rows)
 
+def run_multiple_simulations(agent_cfgs, W, steps, test_mode, seed, doctrine_update_every, num_runs, steady=None,
+                             ensemble=None):
+    # ensemble: None = اجراهای مستقل موتور loop؛ {"engine", "antithetic", "pooled"} = run_replicas (فقط برای بیش از یک تکرار)
+    if ensemble and num_runs > 1:
+        dfs, metas = run_replicas(agent_cfgs, W, steps, test_mode, seed, doctrine_update_every, num_runs, steady, **ensemble)
+    else:
+        dfs = []
+        metas = []
+        for i in range(num_runs):
+            run_seed = seed + i if (test_mode and seed is not None) else None
+            df, meta = run_simulation(agent_cfgs, W, steps, test_mode, run_seed, doctrine_update_every,
+                                      checkpoint_every=CHECKPOINT_EVERY if num_runs == 1 else 0, steady=steady)
+            dfs.append(df)
+            metas.append(meta)
+
+    countries = [c["name"] for c in agent_cfgs]
     if num_runs == 1:
+        metas[0]["graph_frames"] = graph_frame_arrays(dfs[0], countries)
+        metas[0]["tensors"] = dyad_tensor_arrays(dfs[0], countries)
         return dfs[0], metas[0], dfs
 
     # Average DFs
@@ -567,8 +733,226 @@ def run_multiple_simulations(agent_cfgs, W, steps, test_mode, seed, doctrine_upd
                 else:
                     avg_meta[state][c][k] = v
 
+    avg_meta["tensors"] = dyad_tensor_arrays(df_avg, countries)
+    if ensemble:
+        avg_meta["variance_reduction"] = variance_reduction_rows(dfs, bool(ensemble.get("antithetic")))
+        if "pooled_fits" in metas[0]:
+            avg_meta["pooled_fits"] = metas[0]["pooled_fits"]
+    events = [m["steady_events"].assign(run=i + 1) for i, m in enumerate(metas) if "steady_events" in m]
+    if events:
+        avg_meta["steady_events"] = pd.concat(events, ignore_index=True)
     return df_avg, avg_meta, dfs
 
+@st.cache_resource
+def get_result_cache():
+    # یک نمونه مشترک برای همه کاربران/نشست‌ها (cache_resource کپی نمی‌کند).
+    return ResultCache(directory=RESULT_CACHE_DIR, max_memory_items=32, max_disk_bytes=RESULT_CACHE_MAX_MB * 1024 * 1024)
+
+@st.cache_resource
+def get_registry():
+    # دفتر آزمایش‌های مشترک (فهرست SQLite + فایل‌های ستونی)؛ برخلاف کش چیزی از آن حذف نمی‌شود
+    return ExperimentRegistry(REGISTRY_DIR)
+
+def is_seeded(test_mode, seed):
+    # فقط اجرای با Seed تکرارپذیر است و می‌تواند از نتیجه ذخیره‌شده جواب داده شود
+    return bool(test_mode) and seed is not None
+
+def simulation_config(agent_cfgs, W, steps, test_mode, seed, doctrine_update_every, num_runs, steady=None, ensemble=None):
+    config = dict(
+        agents=agent_cfgs, W=W, steps=int(steps),
+        seed=int(seed) if is_seeded(test_mode, seed) else None,
+        runs=int(num_runs), doctrine_update_every=int(doctrine_update_every),
+        bayes=BAYES_SETTINGS, steady=steady, engine=ENGINE_VERSION,
+    )
+    if ensemble:
+        # فقط وقتی روشی انتخاب شده؛ کلید اجراهای مستقل مثل قبل می‌ماند
+        config["ensemble"] = ensemble
+    return config
+
+def simulation_cache_key(agent_cfgs, W, steps, test_mode, seed, doctrine_update_every, num_runs, steady=None, ensemble=None):
+    return config_hash(simulation_config(agent_cfgs, W, steps, test_mode, seed, doctrine_update_every, num_runs, steady, ensemble))
+
+def registered_run(registry, key, compute, pack, unpack, lookup: bool = True, **labels):
+    # نتیجه ثبت‌شده در دفتر آزمایش‌ها (از نشست‌های قبلی، حتی اگر از کش حذف شده باشد) یا اجرا و ثبت آن.
+    # pack: نتیجه → (DataFrameها، meta، معیارها)؛ unpack: عکس آن. labels: ستون‌های فهرست (config، kind، ...)
+    if lookup:
+        hit = registry.load(key)
+        if hit is not None:
+            return unpack(*hit)
+    t = time.perf_counter()
+    result = compute()
+    elapsed = time.perf_counter() - t
+    try:
+        frames, meta, metrics = pack(result)
+        registry.record(key, frames=frames, meta=meta, metrics=metrics, elapsed=elapsed, engine=ENGINE_VERSION, **labels)
+    except Exception:
+        # ثبت کمکی است: خطای دیسک نباید نتیجه اجرا را از بین ببرد
+        pass
+    return result
+
+def pack_simulations(result, countries):
+    # همه اجراها در یک جدول ستونی با ستون Run؛ میانگین فقط وقتی بیش از یک اجرا هست
+    # نقطه‌های بازگشت ثبت نمی‌شوند (rebuild_checkpoints)
+    df_avg, meta, dfs = result
+    frames = {"runs": pd.concat([d.assign(Run=i) for i, d in enumerate(dfs)], ignore_index=True)}
+    if len(dfs) > 1:
+        frames["mean"] = df_avg
+    meta = {k: v for k, v in meta.items() if k != "checkpoints"}
+    return frames, meta, run_summary(df_avg, countries).to_dict()
+
+def unpack_simulations(frames, meta):
+    # ستون‌هایی که فقط در بعضی اجراها بودند در بقیه تماماً NaN شده‌اند
+    dfs = [g.drop(columns="Run").dropna(axis=1, how="all").reset_index(drop=True)
+           for _, g in frames["runs"].groupby("Run", sort=True)]
+    return frames.get("mean", dfs[0]), meta, dfs
+
+def registered_run_multiple_simulations(registry, lookup, scenario, agent_cfgs, W, steps, test_mode, seed,
+                                        doctrine_update_every, num_runs, steady=None, ensemble=None):
+    # اجرای بدون Seed ثبت می‌شود (برای پرس‌وجو) ولی هرگز از دفتر جواب داده نمی‌شود
+    config = simulation_config(agent_cfgs, W, steps, test_mode, seed, doctrine_update_every, num_runs, steady, ensemble)
+    return registered_run(
+        registry, config_hash(config),
+        lambda: run_multiple_simulations(agent_cfgs, W, steps, test_mode, seed, doctrine_update_every, num_runs, steady,
+                                         ensemble),
+        lambda result: pack_simulations(result, [c["name"] for c in agent_cfgs]), unpack_simulations,
+        lookup=lookup and config["seed"] is not None,
+        config=config, kind="simulation", scenario=scenario, seed=config["seed"], n_runs=num_runs, steps=steps,
+    )
+
+def cached_run_multiple_simulations(agent_cfgs, W, steps, test_mode, seed, doctrine_update_every, num_runs, use_cache: bool = True,
+                                    steady=None, scenario=None, ensemble=None):
+    # کش (حافظه/دیسک) → دفتر آزمایش‌ها → شبیه‌سازی؛ بدون کش هم اجرا در دفتر ثبت می‌شود.
+    # اجرای بدون Seed هر بار نمونه تازه است: نه از کش خوانده و نه در آن نوشته می‌شود
+    args = (agent_cfgs, W, steps, test_mode, seed, doctrine_update_every, num_runs, steady, ensemble)
+    if not use_cache or not is_seeded(test_mode, seed):
+        return registered_run_multiple_simulations(get_registry(), False, scenario, *args)
+    key = simulation_cache_key(*args)
+    registry = get_registry()
+    return cached_simulations(get_result_cache(), key, lambda: registered_run_multiple_simulations(registry, True, scenario, *args))
+
+def cached_simulations(cache, key, compute):
+    # نقطه‌های بازگشت (جهان‌های fork‌شده، تقریباً همه حجم نتیجه) در کش نوشته نمی‌شوند و فقط به
+    # همین فراخوان برمی‌گردند؛ نتیجه‌ای که از کش یا دفتر می‌آید آن‌ها را با rebuild_checkpoints می‌سازد
+    checkpoints = {}
+
+    def run():
+        df, meta, dfs = compute()
+        checkpoints.update(meta.pop("checkpoints", None) or {})
+        return df, meta, dfs
+
+    df, meta, dfs = cache.get_or_compute(key, run)
+    if checkpoints:
+        meta = dict(meta, checkpoints=checkpoints)
+    return df, meta, dfs
+
+def rebuild_checkpoints(agent_cfgs, W, steps, test_mode, seed, doctrine_update_every, num_runs, steady=None, ensemble=None):
+    # همان اجرای تکی با همان Seed (همان مسیر)، این بار با fork هر CHECKPOINT_EVERY گام
+    _, meta = run_simulation(agent_cfgs, W, steps, test_mode, seed, doctrine_update_every,
+                             checkpoint_every=CHECKPOINT_EVERY, steady=steady)
+    return meta["checkpoints"]
+
+def emulator_cache_key(agent_cfgs, W, steps, doctrine_update_every, n_design):
+    # همه چیز جز ورودی‌های شبیه‌ساز جایگزین (آن‌ها محورهای طرح آزمایش‌اند، نه بخشی از کلید)
+    fixed = [{k: v for k, v in c.items() if k not in EMULATOR_INPUTS} for c in agent_cfgs]
+    return config_hash(dict(
+        emulator=fixed, W=W, steps=int(steps), doctrine_update_every=int(doctrine_update_every),
+        design=int(n_design), replicas=EMULATOR_REPLICAS, engine=ENGINE_VERSION,
+    ))
+
+def emulator_point(agent_cfgs):
+    # بردار ورودی به همان ترتیب برچسب‌های DesignSpace (اول پارامتر، بعد کشور)
+    return np.array([float(c[k]) for k in EMULATOR_INPUTS for c in agent_cfgs])
+
+def train_scenario_emulator(agent_cfgs, W, steps, doctrine_update_every, n_design):
+    world = MultiAgentWorld(
+        agents=build_agents_from_configs(agent_cfgs), interaction_W=W, esc_coeffs=EscalationCoeffs(),
+        doctrine_update_every=int(doctrine_update_every), engine="vectorized",
+    )
+    bounds = {f: (lo, hi) for f, lo, hi in EMULATOR_INPUTS.values()}
+    return train_emulator(world, list(bounds), bounds, n_design=int(n_design), replicas=EMULATOR_REPLICAS,
+                          steps=int(steps), seed=0, n_test=max(32, int(n_design) // 8))
+
+def run_summary(df, countries):
+    # همان خلاصه‌های شبیه‌ساز جایگزین از history یک اجرا (تنش/منابع از ردیف آخر)
+    y = df[[c for c in df.columns if c.startswith("Y_")]]
+    out = {"Escalation_Rate": float(y.sum(axis=1).mean()) / max(1, len(countries)),
+           "Global_Escalation": float(df["Global_Escalation"].mean())}
+    last = df.iloc[-1]
+    out.update({f"{p}_{c}": float(last[f"{p}_{c}"]) for p in ("Tension", "Resource") for c in countries})
+    return pd.Series(out)
+
+@st.cache_resource
+def get_background_executor():
+    # یک کارگر: اجراهای تأیید پشت سر هم انجام می‌شوند (np.random سراسری با get_random_lock محافظت می‌شود)
+    return ThreadPoolExecutor(max_workers=1)
+
+def start_confirmation_run(agent_cfgs, W, steps, test_mode, seed, doctrine_update_every, num_runs, use_cache, steady, scenario=None,
+                           ensemble=None):
+    # اجرای واقعی پس‌زمینه با همان کلید کش دکمه اجرا؛ اگر تنظیمات عوض شود، کار قبلی (اگر شروع نشده) لغو می‌شود
+    key = simulation_cache_key(agent_cfgs, W, steps, test_mode, seed, doctrine_update_every, num_runs, steady, ensemble)
+    job = st.session_state.get("confirm_run")
+    if job is not None and job["key"] == key:
+        return job
+    if job is not None:
+        job["future"].cancel()
+    args = (copy.deepcopy(agent_cfgs), copy.deepcopy(W), steps, test_mode, seed, doctrine_update_every, num_runs, steady, ensemble)
+    cache = get_result_cache() if use_cache and is_seeded(test_mode, seed) else None
+    registry = get_registry()
+
+    def work():
+        if cache is None:
+            return registered_run_multiple_simulations(registry, False, scenario, *args)
+        return cached_simulations(cache, key, lambda: registered_run_multiple_simulations(registry, True, scenario, *args))
+
+    job = {"key": key, "future": get_background_executor().submit(work)}
+    st.session_state.confirm_run = job
+    return job
+
+def confirmation_result(key):
+    # نتیجه اجرای تأیید برای همین کلید (بعد از پایانش)؛ None اگر کار دیگری بود یا ناموفق شد.
+    # کار دیگر منتظر نمی‌ماند: get_random_lock اجراها را پشت سر هم می‌کند.
+    job = st.session_state.get("confirm_run")
+    if job is None or job["key"] != key or job["future"].cancelled():
+        return None
+    wait([job["future"]])
+    if job["future"].exception() is not None:
+        return None
+    return job["future"].result()
+
+def run_large_world(n, degree, n_blocs, steps, seed, doctrine_update_every, steady=None, stride: int = 1):
+    scenario = generate_scenario(n, seed=seed, degree=degree, n_blocs=n_blocs)
+    world = scenario.build_world(seed=seed, doctrine_update_every=int(doctrine_update_every), **BAYES_SETTINGS,
+                                 **steady_kwargs(steady), recording=RecordingSpec("summary", stride=int(stride)))
+    world.run(int(steps), fast_forward=bool((steady or {}).get("fast_forward")) and world.steady is not None)
+    meta = {"bloc_sizes": np.bincount(scenario.bloc_labels, minlength=int(n_blocs)).tolist()}
+    if world.steady is not None:
+        meta["steady_events"] = world.steady.to_frame()
+    return world.summary.to_frame(), meta
+
+def cached_run_large_world(n, degree, n_blocs, steps, seed, doctrine_update_every, use_cache: bool = True, steady=None,
+                           stride: int = 1):
+    args = (int(n), int(degree), int(n_blocs), int(steps), int(seed), int(doctrine_update_every))
+    key = config_hash(dict(large_world=args, bayes=BAYES_SETTINGS, steady=steady, stride=int(stride), engine=ENGINE_VERSION))
+    # فهرست با نام پارامترها ثبت می‌شود (کلید همان کلید کش است)
+    config = dict(large_world=dict(zip(("n", "degree", "n_blocs", "steps", "seed", "doctrine_update_every"), args)),
+                  bayes=BAYES_SETTINGS, steady=steady, stride=int(stride), engine=ENGINE_VERSION)
+    registry = get_registry()
+
+    def run(lookup):
+        return registered_run(registry, key, lambda: run_large_world(*args, steady=steady, stride=stride),
+                              pack_large_world, lambda frames, meta: (frames["summary"], meta), lookup=lookup,
+                              config=config, kind="large_world", scenario="large_world", seed=seed, steps=steps)
+
+    if not use_cache:
+        return run(False)
+    return get_result_cache().get_or_compute(key, lambda: run(True))
+
+def pack_large_world(result):
+    df, meta = result
+    metrics = {"Escalation_Rate": float(df["Escalation_Rate"].mean()), "Global_Escalation": float(df["Global_Escalation"].mean()),
+               "Mean_Tension": float(df["Mean_Tension"].iloc[-1]), "Mean_Resource": float(df["Mean_Resource"].iloc[-1])}
+    return {"summary": df}, meta, metrics
+
 # ==========================================================
 # 4) Tables + charts
 # ==========================================================
@@ -593,11 +977,40 @@ def df_action_counts(dfs, countries):
         })
     return pd.DataFrame(out)
 
+def _lod_window(df: pd.DataFrame, lod):
+    # محدود کردن ردیف‌ها به بازه زوم (اگر تعیین شده باشد)
+    if not lod or lod.get("window") is None: return df
+    t0, t1 = lod["window"]
+    tt = pd.to_numeric(df["Time"], errors="coerce")
+    return df[(tt >= t0) & (tt <= t1)]
+
+def _lod_budget(lod) -> int:
+    return int((lod or {}).get("budget", DEFAULT_POINT_BUDGET))
+
+def _lod_heatmap(times, z, lod):
+    # برش زمانی + min/max در هر بازه تا تعداد ستون‌ها محدود بماند
+    times = np.asarray(times)
+    z = np.asarray(z, dtype=float)
+    if lod and lod.get("window") is not None:
+        sl = window_slice(times, *lod["window"])
+        times, z = times[sl], z[:, sl]
+    x, zz = minmax_bins(times, z, max(1, _lod_budget(lod) // 2))
+    return x.tolist(), zz
+
+def lod_controls(df: pd.DataFrame):
+    times = pd.to_numeric(df["Time"], errors="coerce").dropna().astype(int)
+    t_min, t_max = int(times.min()), int(times.max())
+    budget = st.sidebar.number_input("بودجه نقاط نمودار (LOD)", 200, 20000, DEFAULT_POINT_BUDGET, 100, help=tip("lod_budget"))
+    if t_max <= t_min:
+        return {"window": None, "budget": int(budget)}
+    window = st.slider("بازه زمانی نمایش (زوم)", t_min, t_max, (t_min, t_max), key="lod_window", help=tip("lod_window"))
+    return {"window": (int(window[0]), int(window[1])), "budget": int(budget)}
+
 def _resource_norm(x: float) -> float:
     x = float(x)
     return x / (x + 1000.0)
 
-def plot_three_indices_heatmaps(df: pd.DataFrame, countries: list[str], window: int = 10):
+def plot_three_indices_heatmaps(df: pd.DataFrame, countries: list[str], window: int = 10, lod=None):
     if df is None or len(df) == 0 or len(countries) == 0: return
     if "Time" not in df.columns: return
 
@@ -634,7 +1047,8 @@ def plot_three_indices_heatmaps(df: pd.DataFrame, countries: list[str], window:
     tabs = st.tabs(["قدرت امنیت", "تاب‌آوری", "نفوذ/بازدارندگی"])
 
     def _heat(z, title):
-        fig = go.Figure(data=go.Heatmap(z=z, x=times, y=valid, zmin=0, zmax=1, colorscale="RdYlGn", hovertemplate="%{y}<br>زمان: %{x}<br>امتیاز: %{z:.3f}<extra></extra>"))
+        x, z = _lod_heatmap(times, z, lod)
+        fig = go.Figure(data=go.Heatmap(z=z, x=x, y=valid, zmin=0, zmax=1, colorscale="RdYlGn", hovertemplate="%{y}<br>زمان: %{x}<br>امتیاز: %{z:.3f}<extra></extra>"))
         fig.update_layout(title=title, xaxis_title="گام زمانی", yaxis_title="کشور", margin=dict(l=30, r=30, t=60, b=30))
         st.plotly_chart(fig, use_container_width=True)
 
@@ -662,26 +1076,38 @@ def build_transition_df(meta, countries):
             rows.append({"کشور": c, "بخش": "وضعیت", "پارامتر": label, "ابتدا": float(ini.get(k, np.nan)), "انتها": float(fin.get(k, np.nan))})
     return pd.DataFrame(rows)
 
-def plot_global_escalation(df):
+def plot_global_escalation(df, lod=None):
     if "Global_Escalation" not in df.columns: return
-    fig = px.area(df, x="Time", y="Global_Escalation", labels={"Time": "گام زمانی", "Global_Escalation": "احتمال/وضعیت بحران کلی"}, title="وضعیت بحران کلی", color_discrete_sequence=["red"])
+    dfw = _lod_window(df, lod)
+    x, y = lttb(pd.to_numeric(dfw["Time"], errors="coerce").to_numpy(dtype=float), pd.to_numeric(dfw["Global_Escalation"], errors="coerce").fillna(0.0).to_numpy(dtype=float), _lod_budget(lod))
+    fig = px.area(pd.DataFrame({"Time": x, "Global_Escalation": y}), x="Time", y="Global_Escalation", labels={"Time": "گام زمانی", "Global_Escalation": "احتمال/وضعیت بحران کلی"}, title="وضعیت بحران کلی", color_discrete_sequence=["red"])
     fig.update_yaxes(range=[0, 1])
     st.plotly_chart(fig, use_container_width=True)
 
-def plot_lines_by_country(df, countries, prefix, title_fa, y_label_fa):
+def plot_lines_by_country(df, countries, prefix, title_fa, y_label_fa, lod=None):
     cols = [f"{prefix}_{c}" for c in countries if f"{prefix}_{c}" in df.columns]
     if not cols: return
-    dfl = df.melt(id_vars=["Time"], value_vars=cols, var_name="variable", value_name="value")
-    dfl["کشور"] = dfl["variable"].str.replace(f"{prefix}_", "", regex=False)
+    dfw = _lod_window(df, lod)
+    tt = pd.to_numeric(dfw["Time"], errors="coerce").to_numpy(dtype=float)
+    parts = []
+    for col in cols:
+        x, y = lttb(tt, pd.to_numeric(dfw[col], errors="coerce").to_numpy(dtype=float), _lod_budget(lod))
+        parts.append(pd.DataFrame({"Time": x, "value": y, "کشور": col[len(prefix) + 1:]}))
+    dfl = pd.concat(parts, ignore_index=True)
     fig = px.line(dfl, x="Time", y="value", color="کشور", title=title_fa, labels={"Time": "گام زمانی", "value": y_label_fa, "کشور": "کشور"})
     st.plotly_chart(fig, use_container_width=True)
 
-def plot_actions_map(df, countries):
+def plot_actions_map(df, countries, lod=None):
     act_cols = [f"Action_{c}" for c in countries if f"Action_{c}" in df.columns]
     if not act_cols: return
-    df_m = df.melt(id_vars=["Time"], value_vars=act_cols, var_name="Country", value_name="Action")
-    df_m["Country"] = df_m["Country"].str.replace("Action_", "", regex=False)
-    uniq = df_m["Country"].unique().tolist()
+    dfw = _lod_window(df, lod)
+    codes_list = list(ACTION_LABEL_FA.keys())
+    code_idx = {a: k for k, a in enumerate(codes_list)}
+    codes = np.stack([dfw[col].map(code_idx).fillna(-1).to_numpy(dtype=int) for col in act_cols])
+    x, codes = mode_bins(pd.to_numeric(dfw["Time"], errors="coerce").to_numpy(), codes, _lod_budget(lod), len(codes_list))
+    uniq = [col[len("Action_"):] for col in act_cols]
+    r, k = np.nonzero(codes >= 0)
+    df_m = pd.DataFrame({"Time": x[k], "Country": [uniq[i] for i in r], "Action": [codes_list[c] for c in codes[r, k]]})
     to_y = {c: i for i, c in enumerate(uniq)}
     df_m["y_base"] = df_m["Country"].map(to_y)
     offset_map = {"P": 0.00, "S": 0.12, "R": 0.24}
@@ -691,50 +1117,110 @@ def plot_actions_map(df, countries):
     fig.update_yaxes(tickmode="array", tickvals=[to_y[c] + 0.12 for c in uniq], ticktext=uniq, title="کشور")
     st.plotly_chart(fig, use_container_width=True)
 
-def plot_dyad_tension_heatmap(df: pd.DataFrame, countries: list[str]):
-    if df is None or len(df) == 0 or len(countries) < 2 or "Time" not in df.columns: return
-    df = df.copy()
-    df["Time"] = pd.to_numeric(df["Time"], errors="coerce").fillna(0).astype(int)
-    df = df.sort_values("Time")
-    times = df["Time"].unique().tolist()
+DYAD_AGG_MIN_N = 8  # از این تعداد کشور به بالا، تجمیع سمت سرور پیش‌فرض است
+
+def _dyad_times(df: pd.DataFrame, T: int):
+    times = np.sort(pd.to_numeric(df["Time"], errors="coerce").fillna(0).astype(int).unique())
+    return times.tolist() if len(times) == T else list(range(T))
+
+def _dyad_rows(Z: np.ndarray, countries: list[str], key: str, W=None):
+    # انتخاب سطح نمایش: همه زوج‌ها / k زوج پرتنش / میانگین بلوکی
+    n = len(countries)
+    options = ["همه زوج‌ها", "k زوج پرتنش‌تر", "میانگین بلوک‌ها"]
+    mode = st.radio("سطح نمایش", options=options, index=1 if n >= DYAD_AGG_MIN_N else 0, horizontal=True, key=f"{key}_agg")
+    if mode == options[1]:
+        k = st.slider("تعداد زوج‌ها (k)", 1, n * (n - 1), min(n * (n - 1), 20), key=f"{key}_k")
+        return top_k_pairs(Z, countries, k)
+    if mode == options[2]:
+        labels = bloc_labels_from_W(W) if W is not None else np.zeros(n, dtype=int)
+        groups = ["، ".join([c for c, g in zip(countries, labels) if g == b][:3]) for b in range(int(labels.max()) + 1)]
+        return block_pairs(Z, labels, bloc_names=[f"بلوک {b + 1} ({g})" for b, g in enumerate(groups)])
+    return pair_matrix(Z, countries)
+
+def dyad_tensor_arrays(df: pd.DataFrame, countries: list[str]):
+    """(T, N, N) DyadTension / CrisisProb / Crisis arrays of a result, computed once per result.
+
+    Stored in meta next to ``graph_frames`` so the heatmaps only slice them on reruns.
+    """
+    if df is None or len(df) == 0 or len(countries) < 2 or "Time" not in df.columns: return None
+    return {name: dyad_tensor_from_df(df, countries, name) for name in MultiAgentWorld.TENSOR_SERIES}
+
+def result_tensors(df: pd.DataFrame, meta, countries: list[str]):
+    # نتایج ثبت‌شده پیش از ذخیره تانسورها در meta: یک بار ساخته و در همان meta نگه داشته می‌شوند
+    if meta is None: return dyad_tensor_arrays(df, countries)
+    if meta.get("tensors") is None:
+        meta["tensors"] = dyad_tensor_arrays(df, countries)
+    return meta["tensors"]
+
+def plot_dyad_tension_heatmap(df: pd.DataFrame, countries: list[str], tensors, W=None, lod=None):
+    if df is None or len(df) == 0 or len(countries) < 2 or "Time" not in df.columns or not tensors: return
+    Z = tensors["DyadTension"]
+    times = _dyad_times(df, Z.shape[0])
     st.subheader("ماتریس حرارتی تنش بین کشورها در طول زمان")
 
-    pairs = [(src, dst) for src in countries for dst in countries if src != dst]
-    y_labels = [f"{src} - {dst}" for src, dst in pairs]
-    df_idx = df.set_index("Time")
-    z = []
-    for src, dst in pairs:
-        col = f"DyadTension_{src}_{dst}"
-        series = pd.to_numeric(df_idx[col], errors="coerce") if col in df_idx.columns else pd.Series([], dtype=float)
-        z.append(series.reindex(times).fillna(0.0).astype(float).tolist())
-
+    z, y_labels = _dyad_rows(Z, countries, "dyad_tension", W)
+    times, z = _lod_heatmap(times, z, lod)
     fig = go.Figure(data=go.Heatmap(z=z, x=times, y=y_labels, zmin=0, zmax=1, colorscale="RdYlGn_r", hovertemplate="زمان: %{x}<br>%{y}<br>تنش: %{z:.3f}<extra></extra>"))
     fig.update_layout(title="تنش دوتایی (کشورِ کنش‌گر - کشورِ هدف)", xaxis_title="گام زمانی", yaxis_title="زوج کشورها", yaxis_autorange="reversed", height=min(900, 120 + 22 * len(y_labels)))
     st.plotly_chart(fig, use_container_width=True)
 
-def plot_dyad_crisis_heatmap(df: pd.DataFrame, countries: list[str]):
-    if df is None or len(df) == 0 or len(countries) < 2 or "Time" not in df.columns: return
-    df = df.copy()
-    df["Time"] = pd.to_numeric(df["Time"], errors="coerce").fillna(0).astype(int)
-    df = df.sort_values("Time")
-    times = df["Time"].unique().tolist()
+def plot_dyad_crisis_heatmap(df: pd.DataFrame, countries: list[str], tensors, W=None, lod=None):
+    if df is None or len(df) == 0 or len(countries) < 2 or "Time" not in df.columns or not tensors: return
     st.subheader("ماتریس حرارتی عاملِ بحران در طول زمان")
     view = st.radio("نمایش بر اساس", options=["رخداد واقعی (احتمال تجمیع‌شده)", "احتمال تئوریک"], horizontal=True, key="crisis_heatmap_view")
+    name = "Crisis" if view.startswith("رخداد") else "CrisisProb"
+    Z = tensors[name]
+    times = _dyad_times(df, Z.shape[0])
 
-    pairs = [(src, dst) for src in countries for dst in countries if src != dst]
-    y_labels = [f"{src} - {dst}" for src, dst in pairs]
-    df_idx = df.set_index("Time")
-    z = []
-    for src, dst in pairs:
-        col = f"Crisis_{src}_{dst}" if view.startswith("رخداد") else f"CrisisProb_{src}_{dst}"
-        series = pd.to_numeric(df_idx[col], errors="coerce") if col in df_idx.columns else pd.Series([], dtype=float)
-        z.append(series.reindex(times).fillna(0.0).astype(float).tolist())
-
+    z, y_labels = _dyad_rows(Z, countries, "dyad_crisis", W)
+    times, z = _lod_heatmap(times, z, lod)
     colorscale = [[0.0, "green"], [1.0, "red"]] if view.startswith("رخداد") else "RdYlGn_r"
     fig = go.Figure(data=go.Heatmap(z=z, x=times, y=y_labels, zmin=0, zmax=1, colorscale=colorscale, hovertemplate="زمان: %{x}<br>%{y}<br>ارزش: %{z:.3f}<extra></extra>"))
     fig.update_layout(title="عامل بحران (کشورِ کنش‌گر - کشورِ هدف)", xaxis_title="گام زمانی", yaxis_title="زوج کشورها", yaxis_autorange="reversed", height=min(900, 120 + 22 * len(y_labels)))
     st.plotly_chart(fig, use_container_width=True)
 
+GRAPH_ACTIONS = ["P", "S", "R"]
+GRAPH_ACT_COLOR = {"P": "green", "S": "orange", "R": "red"}
+
+def graph_frame_arrays(df: pd.DataFrame, countries: list[str]):
+    """Per-time arrays for the directed interaction graph, computed once per result.
+
+    Returns a dict with ``times`` (T,), ``actions`` (T,N) indices into GRAPH_ACTIONS,
+    ``targets`` (T,N) country indices and ``y`` (T,N) escalation value of the chosen edge.
+    Missing time steps take the nearest recorded row (same as the old per-frame lookup).
+    """
+    if df is None or len(df) == 0 or len(countries) < 2 or "Time" not in df.columns: return None
+    n = len(countries)
+    dfi = df.assign(Time=pd.to_numeric(df["Time"], errors="coerce").fillna(0).astype(int))
+    dfi = dfi.drop_duplicates(subset=["Time"]).set_index("Time").sort_index()
+    times = np.arange(0, int(dfi.index.max()) + 1)
+    rows = dfi.index.get_indexer(times, method="nearest")
+
+    act_idx = {a: k for k, a in enumerate(GRAPH_ACTIONS)}
+    name_idx = {c: k for k, c in enumerate(countries)}
+    actions = np.zeros((len(times), n), dtype=np.int8)
+    targets = np.zeros((len(times), n), dtype=np.int32)
+    y = np.zeros((len(times), n), dtype=float)
+    for i, c in enumerate(countries):
+        col = f"Action_{c}"
+        if col in dfi.columns:
+            actions[:, i] = dfi[col].map(act_idx).fillna(0).to_numpy(dtype=np.int8)[rows]
+
+        default_tgt = (i + 1) % n
+        col = f"Target_{c}"
+        tgt = dfi[col].map(name_idx).fillna(default_tgt).to_numpy(dtype=np.int32)[rows] if col in dfi.columns else np.full(len(times), default_tgt, dtype=np.int32)
+        tgt[tgt == i] = default_tgt
+        targets[:, i] = tgt
+
+        y_cols = [f"Y_{c}_{d}" for d in countries]
+        y_all = np.zeros((len(times), n), dtype=float)
+        for j, ycol in enumerate(y_cols):
+            if ycol in dfi.columns:
+                y_all[:, j] = pd.to_numeric(dfi[ycol], errors="coerce").fillna(0.0).to_numpy(dtype=float)[rows]
+        y[:, i] = y_all[np.arange(len(times)), tgt]
+
+    return {"times": times, "actions": actions, "targets": targets, "y": y}
+
 def _layout_positions_circle(names):
     n = len(names)
     pos = {}
@@ -743,11 +1229,68 @@ def _layout_positions_circle(names):
         pos[name] = (math.cos(ang), math.sin(ang))
     return pos
 
-def plot_interaction_graph_directed(df, countries):
-    if df is None or len(df) == 0 or len(countries) < 2 or "Time" not in df.columns: return
-    df = df.copy()
-    df["Time"] = pd.to_numeric(df["Time"], errors="coerce").fillna(0).astype(int)
-    max_t = int(df["Time"].max())
+def _segments_xy(x0, y0, x1, y1):
+    # خروجی برای Scatter خطی: x0,x1,None,x0,x1,None,...
+    xs = np.empty(3 * len(x0), dtype=object); ys = np.empty(3 * len(x0), dtype=object)
+    xs[0::3], xs[1::3], xs[2::3] = x0, x1, None
+    ys[0::3], ys[1::3], ys[2::3] = y0, y1, None
+    return xs.tolist(), ys.tolist()
+
+def build_interaction_graph_figure(frames_data, countries, visible_map, t_initial: int = 0):
+    """Build the animated directed-graph figure (plain dict) from precomputed frame arrays.
+
+    Scrubbing is done by a Plotly slider on the client, so moving it never reruns the app.
+    """
+    n = len(countries)
+    pos = _layout_positions_circle(countries)
+    px_, py_ = np.array([pos[c][0] for c in countries]), np.array([pos[c][1] for c in countries])
+    palette = px.colors.qualitative.Set2
+    fills = [palette[i % len(palette)] for i in range(n)]
+    src = np.arange(n)
+    shrink = 0.22
+
+    def build_frame(k: int):
+        acts, tgts, yv = frames_data["actions"][k], frames_data["targets"][k], frames_data["y"][k]
+        a_codes = [GRAPH_ACTIONS[a] for a in acts]
+        x0, y0, x1, y1 = px_[src], py_[src], px_[tgts], py_[tgts]
+        L = np.hypot(x1 - x0, y1 - y0) + 1e-9
+        f0, f1 = shrink / L, 1 - shrink / L
+        x0s, y0s, x1s, y1s = x0 + (x1 - x0) * f0, y0 + (y1 - y0) * f0, x0 + (x1 - x0) * f1, y0 + (y1 - y0) * f1
+
+        traces = []
+        for ai, act in enumerate(GRAPH_ACTIONS):
+            vis = True if visible_map[act] else "legendonly"
+            for on in (False, True):
+                m = (acts == ai) & ((yv >= 0.5) == on)
+                xs, ys = _segments_xy(x0s[m], y0s[m], x1s[m], y1s[m])
+                if on:
+                    traces.append(dict(type="scatter", x=xs, y=ys, mode="lines", line=dict(width=4, color=GRAPH_ACT_COLOR[act]), name=f"یال‌های {act}", hoverinfo="skip", showlegend=True, opacity=0.95, visible=vis))
+                else:
+                    traces.append(dict(type="scatter", x=xs, y=ys, mode="lines", line=dict(width=2, color=GRAPH_ACT_COLOR[act], dash="dot"), hoverinfo="skip", showlegend=False, opacity=0.25, visible=vis))
+        traces.append(dict(type="scatter", x=px_.tolist(), y=py_.tolist(), mode="markers+text", text=list(countries), textposition="bottom center", marker=dict(size=26, color=fills, line=dict(width=4, color=[GRAPH_ACT_COLOR[a] for a in a_codes])), hovertext=[f"{c}<br>اقدام: {a}" for c, a in zip(countries, a_codes)], hoverinfo="text", showlegend=False))
+        anns = [dict(x=float(x1s[i]), y=float(y1s[i]), ax=float(x0s[i]), ay=float(y0s[i]), xref="x", yref="y", axref="x", ayref="y", showarrow=True, arrowhead=3, arrowsize=1.15, arrowwidth=2, arrowcolor=GRAPH_ACT_COLOR[a_codes[i]], opacity=0.25 + 0.70 * float(yv[i])) for i in range(n)]
+        return traces, anns
+
+    times = frames_data["times"]
+    frames = []
+    for k, t in enumerate(times):
+        d, ann = build_frame(k)
+        frames.append(dict(data=d, name=str(int(t)), layout=dict(annotations=ann)))
+
+    k0 = int(np.clip(t_initial, 0, len(times) - 1))
+    anim = lambda names, dur: [names, dict(frame=dict(duration=dur, redraw=True), transition=dict(duration=0), mode="immediate", fromcurrent=True)]
+    layout = dict(
+        title="گراف اقدام", xaxis=dict(visible=False, range=[-1.4, 1.4]), yaxis=dict(visible=False, range=[-1.3, 1.3]),
+        margin=dict(l=20, r=20, t=60, b=150), annotations=frames[k0]["layout"]["annotations"], legend=dict(orientation="h", y=1.02, x=10.0), uirevision="1",
+        updatemenus=[dict(type="buttons", direction="left", x=0.5, y=-0.20, buttons=[dict(label="▶ پخش", method="animate", args=[None, dict(frame=dict(duration=450, redraw=True), transition=dict(duration=150), fromcurrent=True, mode="immediate")]), dict(label="⏸ توقف", method="animate", args=[[None], dict(frame=dict(duration=0, redraw=False), transition=dict(duration=0), mode="immediate")])])],
+        sliders=[dict(active=k0, x=0.05, len=0.9, y=-0.02, currentvalue=dict(prefix="زمان نمایش (t): "), steps=[dict(method="animate", label=str(int(t)), args=anim([str(int(t))], 0)) for t in times])],
+    )
+    return dict(data=frames[k0]["data"], layout=layout, frames=frames)
+
+def plot_interaction_graph_directed(df, countries, frames_data=None):
+    if frames_data is None:
+        frames_data = graph_frame_arrays(df, countries)
+    if frames_data is None: return
 
     st.subheader("گراف تعاملات جهت‌دار")
     c1, c2, c3 = st.columns(3)
@@ -756,68 +1299,287 @@ def plot_interaction_graph_directed(df, countries):
     with c3: show_edges_R = st.checkbox("نمایش یال‌های تقویت/زور (R)", value=True, key="edgeR_action")
     visible_map = {"P": show_edges_P, "S": show_edges_S, "R": show_edges_R}
 
-    if "graph_time" not in st.session_state: st.session_state["graph_time"] = 0
-    t_selected = st.slider("زمان نمایش (t)", 0, max_t, int(st.session_state["graph_time"]), key="graph_time")
-    pos = _layout_positions_circle(countries)
-    act_color = {"P": "green", "S": "orange", "R": "red"}
-    palette = px.colors.qualitative.Set2
-    country_color = {c: palette[i % len(palette)] for i, c in enumerate(countries)}
+    # شکل فقط وقتی نتیجه یا فیلتر یال‌ها عوض شود دوباره ساخته می‌شود؛ کلید هش محتواست
+    # (id شیء بعد از پاک شدنش دوباره استفاده می‌شود و می‌تواند شکل کهنه برگرداند)
+    digest = hashlib.sha1(b"".join(np.ascontiguousarray(frames_data[k]).tobytes()
+                                   for k in ("times", "actions", "targets", "y"))).hexdigest()
+    fig_key = (digest, tuple(countries), tuple(visible_map.values()))
+    cached = st.session_state.get("_graph_fig")
+    if cached is None or cached[0] != fig_key:
+        cached = (fig_key, build_interaction_graph_figure(frames_data, countries, visible_map))
+        st.session_state["_graph_fig"] = cached
+    st.plotly_chart(cached[1], use_container_width=True)
+
+def plot_summary_lines(df, cols, title_fa, y_label_fa, lod=None):
+    cols = [c for c in cols if c in df.columns]
+    if not cols: return
+    dfw = _lod_window(df, lod)
+    tt = pd.to_numeric(dfw["Time"], errors="coerce").to_numpy(dtype=float)
+    parts = []
+    for col in cols:
+        x, y = lttb(tt, pd.to_numeric(dfw[col], errors="coerce").to_numpy(dtype=float), _lod_budget(lod))
+        parts.append(pd.DataFrame({"Time": x, "value": y, "سری": col}))
+    fig = px.line(pd.concat(parts, ignore_index=True), x="Time", y="value", color="سری", title=title_fa, labels={"Time": "گام زمانی", "value": y_label_fa, "سری": "سری"})
+    st.plotly_chart(fig, use_container_width=True)
 
-    def _get_row_safe(t: int):
-        sub = df.loc[df["Time"] == int(t)]
-        if not sub.empty: return sub.iloc[0]
-        return df.loc[(df["Time"] - int(t)).abs().idxmin()]
+def show_recording_estimate(n, steps, runs: int = 1, recording=None, engine: str = "loop", n_blocs: int = 0):
+    # برآورد حافظه خروجی ثبت‌شده، پیش از اجرا
+    est = (recording or RecordingSpec()).estimate(int(n), int(steps), engine, n_blocs=int(n_blocs))
+    st.sidebar.caption(f"📦 حافظه تخمینی خروجی: ~{est['total'] * int(runs) / 2 ** 20:.1f} MB "
+                       f"({est['rows']} گام ثبت‌شده{f' × {int(runs)} تکرار' if int(runs) > 1 else ''})", help=tip("record_memory"))
+
+def steady_controls():
+    # تشخیص حالت پایا (آستانه 0 = خاموش) و پرش اختیاری از باقی افق
+    tol = st.sidebar.number_input("آستانه حالت پایا", 0.0, 0.2, 0.03, 0.005, format="%.3f", help=tip("steady_tol"))
+    fast_forward = st.sidebar.toggle("⏩ پرش از حالت پایا", value=False, help=tip("fast_forward"))
+    return {"tol": float(tol), "fast_forward": bool(fast_forward and tol > 0)}
+
+def show_steady_events(meta):
+    events = (meta or {}).get("steady_events")
+    if events is None:
+        return
+    if events.empty:
+        st.caption(f"حالت پایا تشخیص داده نشد (پنجره {STEADY_WINDOW} گامی).")
+        return
+    ff = events[events["event"] == "fast_forward"]
+    if not ff.empty:
+        st.caption(f"⏩ {int(ff['steps'].sum())} گام با پرش از حالت پایا تولید شد (نه شبیه‌سازی).")
+    with st.expander("رویدادهای حالت پایا"):
+        st.dataframe(events, use_container_width=True)
+
+def ensemble_controls(num_runs):
+    # روش Monte Carlo برای بیش از یک تکرار (None = اجراهای مستقل موتور loop)
+    if num_runs <= 1:
+        return None
+    vectorized = st.sidebar.toggle("🎲 کاهش واریانس (موتور vectorized)", value=False, help=tip("variance_reduction"))
+    antithetic = vectorized and st.sidebar.toggle("جفت‌های antithetic", value=True, help=tip("antithetic"))
+    pooled = st.sidebar.toggle("🤝 یادگیری مشترک α/η بین تکرارها", value=False, help=tip("pooled"))
+    if not (vectorized or pooled):
+        return None
+    return {"engine": "vectorized" if vectorized else "loop", "antithetic": bool(antithetic), "pooled": bool(pooled)}
+
+def show_variance_reduction(meta):
+    fits = (meta or {}).get("pooled_fits")
+    if fits is not None:
+        st.caption(f"🤝 ضرایب α/η با داده همه تکرارها {fits} بار برازش شد (یک برازش مشترک به‌جای یکی برای هر تکرار).")
+    rows = (meta or {}).get("variance_reduction")
+    if rows is None or rows.empty:
+        return
+    with st.expander("کاهش واریانس میانگین Global_Escalation"):
+        st.dataframe(rows, use_container_width=True)
 
-    def _shrink_segment(x0, y0, x1, y1, shrink=0.22):
-        L = ((x1-x0)**2 + (y1-y0)**2)**0.5 + 1e-9
-        return x0 + (x1-x0)*(shrink/L), y0 + (y1-y0)*(shrink/L), x0 + (x1-x0)*(1-shrink/L), y0 + (y1-y0)*(1-shrink/L)
+def emulator_controls(agent_cfgs, W, steps, doctrine_update_every):
+    # شبیه‌ساز جایگزین: یک بار آموزش (در کش نتایج)، بعد پیش‌بینی فوری با هر تغییر اسلایدرها
+    st.sidebar.divider()
+    st.sidebar.header("🧠 پیش‌بینی فوری")
+    if not st.sidebar.toggle("پیش‌بینی با شبیه‌ساز جایگزین", value=False, key="emulator_on", help=tip("emulator")):
+        return None
+    n_design = st.sidebar.number_input("تعداد نقطه‌های آموزش", 64, 1024, 256, 64, help=tip("emulator_train"))
+    key = emulator_cache_key(agent_cfgs, W, steps, doctrine_update_every, n_design)
+    emulator = get_result_cache().get(key)
+    if emulator is None:
+        if st.sidebar.button("🎓 آموزش شبیه‌ساز جایگزین", use_container_width=True):
+            with st.spinner(f"در حال شبیه‌سازی {int(n_design)} نقطه آموزش و برازش مدل..."):
+                emulator = get_result_cache().get_or_compute(
+                    key, lambda: train_scenario_emulator(agent_cfgs, W, steps, doctrine_update_every, n_design))
+        else:
+            st.sidebar.caption("برای این سناریو هنوز آموزش داده نشده است.")
+    return emulator
+
+def emulator_panel(emulator, agent_cfgs, countries, num_runs, confirm):
+    st.subheader("🧠 پیش‌بینی فوری (شبیه‌ساز جایگزین)")
+    x = emulator_point(agent_cfgs)
+    if not emulator.space.contains(x):
+        st.warning("بعضی پارامترها بیرون بازه آموزش‌اند؛ پیش‌بینی برون‌یابی است.")
+    pred = emulator.predict_frame(x)
+    # پیش‌بینی میانگین num_runs اجرا: عدم قطعیت مدل + نویز Monte Carlo همان تعداد اجرا
+    noise = emulator.diagnostics["run_sd"] / np.sqrt(max(1, int(num_runs)))
+    pred["sd"] = np.sqrt(pred["sd"] ** 2 + noise ** 2)
+    m1, m2 = st.columns(2)
+    m1.metric("نرخ تشدید (میانگین)", f"{pred.at['Escalation_Rate', 'mean']:.3f}", f"± {2 * pred.at['Escalation_Rate', 'sd']:.3f}", delta_color="off")
+    m2.metric("تشدید جهانی (میانگین)", f"{pred.at['Global_Escalation', 'mean']:.3f}", f"± {2 * pred.at['Global_Escalation', 'sd']:.3f}", delta_color="off")
+    table = pd.DataFrame({
+        "کشور": countries,
+        "تنش نهایی": [pred.at[f"Tension_{c}", "mean"] for c in countries],
+        "تنش ±2σ": [2 * pred.at[f"Tension_{c}", "sd"] for c in countries],
+        "منابع نهایی": [pred.at[f"Resource_{c}", "mean"] for c in countries],
+        "منابع ±2σ": [2 * pred.at[f"Resource_{c}", "sd"] for c in countries],
+    })
+    st.dataframe(table.round(3), use_container_width=True, hide_index=True)
+    emulator_confirmation(pred, countries, confirm)
+    with st.expander("📏 دقت شبیه‌ساز جایگزین"):
+        st.caption(f"{len(emulator.design)} نقطه آموزش × {emulator.replicas} تکرار (موتور برداری، ضرایب α/η ثابت). "
+                   "loo_*: اعتبارسنجی حذف-یکی؛ test_*: نقطه‌های آزمون جدا؛ coverage95: سهم مقدارهای درون بازه ۹۵٪.")
+        st.dataframe(emulator.diagnostics.round(4), use_container_width=True)
+
+def emulator_confirmation(pred, countries, confirm):
+    # تا پایان اجرای پس‌زمینه هر ثانیه وضعیت بررسی می‌شود؛ بعد یک بار کل صفحه بازاجرا می‌شود
+    pending = not confirm["future"].done()
+
+    @st.fragment(run_every=1.0 if pending else None)
+    def status():
+        future = confirm["future"]
+        if not future.done():
+            st.caption("⏳ اجرای واقعی برای تأیید پیش‌بینی در پس‌زمینه در حال انجام است...")
+            return
+        if pending:
+            st.rerun()
+        if future.exception() is not None:
+            st.error(f"اجرای تأیید ناموفق بود: {future.exception()}")
+            return
+        actual = run_summary(future.result()[0], countries)
+        z = (actual - pred["mean"]) / pred["sd"].where(pred["sd"] > 0)
+        st.caption("✅ اجرای واقعی انجام شد (نتیجه در کش است؛ دکمه اجرا همین را نشان می‌دهد).")
+        st.dataframe(pd.DataFrame({"پیش‌بینی": pred["mean"], "±2σ": 2 * pred["sd"], "اجرای واقعی": actual,
+                                   "خطا / σ": z}).round(4), use_container_width=True)
+
+    status()
+
+def registry_panel(scenario, kind: str = "simulation"):
+    # اجراهای ثبت‌شده همین سناریو (یا همه) با شرط دلخواه روی پارامترها و معیارهای خلاصه
+    with st.expander("📚 دفتر آزمایش‌ها (اجراهای ثبت‌شده)"):
+        c1, c2 = st.columns([3, 1])
+        text = c1.text_input("شرط", "", placeholder="rho > 0.5, Global_Escalation < 0.3", help=tip("registry_filter"),
+                             key=f"registry_filter_{kind}")
+        everywhere = c2.toggle("همه سناریوها", value=False, key=f"registry_all_{kind}")
+        try:
+            runs = get_registry().find(scenario=None if everywhere else scenario, kind=kind, where=text)
+        except ValueError as exc:
+            st.warning(str(exc))
+            return
+        st.caption(f"{len(runs)} اجرای ثبت‌شده")
+        if len(runs):
+            st.dataframe(runs.assign(key=runs["key"].str[:12]), use_container_width=True, hide_index=True)
+
+def large_world_page(doctrine_update_every: int, use_cache: bool):
+    # حالت جهان بزرگ: موتور برداری + ثبت خلاصه (بدون ستون به ازای هر کشور/زوج)
+    st.sidebar.divider()
+    st.sidebar.header("🌐 جهان بزرگ")
+    n = st.sidebar.number_input("تعداد کشورها", 10, 5000, 500, 10)
+    degree = st.sidebar.number_input("تعداد همسایه هر کشور", 1, 64, 8, 1, help=tip("lw_degree"))
+    n_blocs = st.sidebar.number_input("تعداد بلوک‌ها", 1, 12, 4, 1, help=tip("lw_blocs"))
+    steps = st.sidebar.number_input("تعداد گام‌های زمانی", 10, 10_000, 1000, 10, help=tip("steps"))
+    seed = st.sidebar.number_input("عدد بذر تصادفی (Seed)", 0, 10_000_000, 42, help=tip("seed"))
+    stride = st.sidebar.number_input("ثبت هر چند گام", 1, 100, 1, 1, help=tip("record_stride"))
+    show_recording_estimate(n, steps, recording=RecordingSpec("summary", stride=int(stride)), engine="vectorized", n_blocs=n_blocs)
+    steady = steady_controls()
+    if st.sidebar.button("🚀 اجرای شبیه‌سازی", type="primary", use_container_width=True):
+        with st.spinner(f"در حال اجرای جهان بزرگ ({int(n)} کشور، {int(steps)} گام)..."):
+            st.session_state.lw_result = cached_run_large_world(n, degree, n_blocs, steps, seed, doctrine_update_every,
+                                                                 use_cache=use_cache, steady=steady, stride=stride)
+    registry_panel("large_world", kind="large_world")
+    if st.session_state.get("lw_result") is None: st.stop()
+
+    df, meta = st.session_state.lw_result
+    blocs = [f"Bloc{g + 1}" for g in range(len(meta["bloc_sizes"]))]
+    st.subheader("اندازه بلوک‌ها")
+    st.dataframe(pd.DataFrame({"بلوک": blocs, "تعداد کشور": meta["bloc_sizes"]}), use_container_width=True)
 
-    def build_frame(t: int):
-        row = _get_row_safe(t)
-        xs, ys, texts, fills, borders, hovers = [], [], [], [], [], []
-        for c in countries:
-            a = row.get(f"Action_{c}", "P")
-            x, y = pos[c]
-            xs.append(x); ys.append(y); texts.append(c); fills.append(country_color[c]); borders.append(act_color.get(a, "white"))
-            hovers.append(f"{c}<br>اقدام: {a}")
-        nodes_trace = go.Scatter(x=xs, y=ys, mode="markers+text", text=texts, textposition="bottom center", marker=dict(size=26, color=fills, line=dict(width=4, color=borders)), hovertext=hovers, hoverinfo="text", showlegend=False)
-
-        seg_on, seg_off, anns = {"P": [], "S": [], "R": []}, {"P": [], "S": [], "R": []}, []
-        for src in countries:
-            a = row.get(f"Action_{src}", "P")
-            if a not in ("P", "S", "R"): a = "P"
-            tgt = row.get(f"Target_{src}", None)
-            if tgt is None or tgt not in countries or tgt == src: tgt = countries[(countries.index(src) + 1) % len(countries)]
-            
-            y_val = float(row.get(f"Y_{src}_{tgt}", 0.0))
-            x0, y0 = pos[src]; x1, y1 = pos[tgt]
-            x0s, y0s, x1s, y1s = _shrink_segment(x0, y0, x1, y1)
-            
-            if y_val >= 0.5: seg_on[a].append((x0s, y0s, x1s, y1s))
-            else: seg_off[a].append((x0s, y0s, x1s, y1s))
-            anns.append(dict(x=x1s, y=y1s, ax=x0s, ay=y0s, xref="x", yref="y", axref="x", ayref="y", showarrow=True, arrowhead=3, arrowsize=1.15, arrowwidth=2, arrowcolor=act_color[a], opacity=0.25 + 0.70 * y_val))
+    st.divider()
+    lod = lod_controls(df)
+    plot_global_escalation(df, lod=lod)
+    show_steady_events(meta)
 
-        traces = []
-        for act in ["P", "S", "R"]:
-            x_list, y_list = [], []
-            for (x0s, y0s, x1s, y1s) in seg_off[act]: x_list += [x0s, x1s, None]; y_list += [y0s, y1s, None]
-            traces.append(go.Scatter(x=x_list, y=y_list, mode="lines", line=dict(width=2, color=act_color[act], dash="dot"), hoverinfo="skip", showlegend=False, opacity=0.25, visible=True if visible_map[act] else "legendonly"))
+    st.divider()
+    plot_summary_lines(df, ["Mean_Tension", "Mean_Psi", "Escalation_Rate"], "میانگین تنش، ψ و نرخ تشدید", "مقدار", lod=lod)
+    if "Escalation_Rate_RB" in df.columns:
+        # نسخه Rao-Blackwell (امید ψ_ij) همان نرخ را با نوسان نمونه‌گیری کمتر نشان می‌دهد
+        plot_summary_lines(df, ["Escalation_Rate", "Escalation_Rate_RB"],
+                           "نرخ تشدید: نمونه‌گیری‌شده در برابر امید شرطی (Rao-Blackwell)", "نرخ", lod=lod)
 
-            x_list2, y_list2 = [], []
-            for (x0s, y0s, x1s, y1s) in seg_on[act]: x_list2 += [x0s, x1s, None]; y_list2 += [y0s, y1s, None]
-            traces.append(go.Scatter(x=x_list2, y=y_list2, mode="lines", line=dict(width=4, color=act_color[act]), name=f"یال‌های {act}", hoverinfo="skip", showlegend=True, opacity=0.95, visible=True if visible_map[act] else "legendonly"))
-        return (traces + [nodes_trace]), anns
+    st.divider()
+    plot_summary_lines(df, [c for c in df.columns if c.startswith("Share_")], "سهم اقدامات در هر گام", "سهم", lod=lod)
 
-    frames = []
-    for t in range(max_t + 1):
-        d, ann = build_frame(t)
-        frames.append(go.Frame(data=d, name=str(t), layout=dict(annotations=ann)))
+    st.divider()
+    plot_summary_lines(df, ["Mean_Resource"], "میانگین منابع کشورها", "منابع", lod=lod)
 
-    base_data, base_ann = build_frame(t_selected)
-    fig = go.Figure(data=base_data, frames=frames)
-    fig.update_layout(title=f"گراف اقدام — زمان {t_selected}", xaxis=dict(visible=False, range=[-1.4, 1.4]), yaxis=dict(visible=False, range=[-1.3, 1.3]), margin=dict(l=20, r=20, t=60, b=150), annotations=base_ann, legend=dict(orientation="h", y=1.02, x=10.0), uirevision="1", updatemenus=[dict(type="buttons", direction="left", x=0.5, y=-0.20, buttons=[dict(label="▶ پخش", method="animate", args=[None, dict(frame=dict(duration=450, redraw=True), transition=dict(duration=150), fromcurrent=True, mode="immediate")]), dict(label="⏸ توقف", method="animate", args=[[None], dict(frame=dict(duration=0, redraw=False), transition=dict(duration=0), mode="immediate")])])])
+    st.divider()
+    plot_lines_by_country(df, blocs, prefix="Tension", title_fa="روند تنش بلوک‌ها", y_label_fa="میانگین تنش بلوک", lod=lod)
+
+    st.divider()
+    plot_lines_by_country(df, blocs, prefix="Escalations", title_fa="تعداد تشدید در هر بلوک", y_label_fa="تعداد تشدید", lod=lod)
+
+def plot_mean_field_check(run_args, all_dfs, countries, lod=None):
+    # مقایسه میانگین Monte Carlo با اجرای mean-field (فقط وقتی بیش از یک تکرار داریم و کاربر آن را بخواهد)
+    if run_args is None or len(all_dfs) < 2: return
+    if not st.toggle("🧮 مقایسه با حالت میانگین تحلیلی (Mean-field)", value=False, help=tip("mean_field"), key="mean_field_check"): return
+    mf_df = cached_mean_field(*run_args)
+    if mf_df is None or len(mf_df) == 0: return
+    cols = [f"{p}_{c}" for p in ("Tension", "Resource", "Psi") for c in countries] + ["Global_Escalation"]
+    st.caption(tip("mean_field").replace("\n", " "))
+    report = compare_frames(mf_df, all_dfs, cols)
+    st.dataframe(report.round(4), use_container_width=True)
+    dfw = _lod_window(pd.DataFrame({"Time": all_dfs[0]["Time"]}), lod)
+    t_keep = set(pd.to_numeric(dfw["Time"], errors="coerce").dropna().astype(int))
+    mc = pd.concat(all_dfs).groupby("Time")[[f"Tension_{c}" for c in countries]].mean().reset_index()
+    parts = []
+    for src, frame in (("Monte Carlo", mc), ("Mean-field", mf_df)):
+        frame = frame[frame["Time"].isin(t_keep)]
+        for c in countries:
+            x, y = lttb(frame["Time"].to_numpy(dtype=float), frame[f"Tension_{c}"].to_numpy(dtype=float), _lod_budget(lod))
+            parts.append(pd.DataFrame({"Time": x, "value": y, "کشور": c, "روش": src}))
+    fig = px.line(pd.concat(parts, ignore_index=True), x="Time", y="value", color="کشور", line_dash="روش",
+                  title="تنش: میانگین Monte Carlo در برابر Mean-field", labels={"Time": "گام زمانی", "value": "تنش (Tension)"})
     st.plotly_chart(fig, use_container_width=True)
 
+def what_if_branches(df, meta, countries, run_args=None):
+    # شاخه‌سازی از وسط اجرا: هر شاخه یک fork از نقطه بازگشت با دکترین تازه یک کشور است.
+    # run_args: ورودی‌های run_multiple_simulations همین اجرا (برای ساختن دوباره نقطه‌های بازگشت)
+    st.subheader("🔀 شاخه‌های «چه می‌شد اگر»")
+    checkpoints = (meta or {}).get("checkpoints")
+    if not checkpoints:
+        if run_args is None or run_args[6] != 1:
+            st.info("💡 شاخه‌سازی فقط در اجرای تکی (۱ تکرار) در دسترس است.")
+            return
+        if not is_seeded(run_args[3], run_args[4]):
+            st.info("💡 نقطه‌های بازگشت این اجرا ذخیره نشده‌اند؛ برای شاخه‌سازی دوباره اجرا کن.")
+            return
+        st.caption("این نتیجه از نتایج ذخیره‌شده آمده و نقطه‌های بازگشت آن ذخیره نمی‌شوند.")
+        if not st.button("🔁 ساخت نقطه‌های بازگشت", key="branch_rebuild"):
+            return
+        with st.spinner("اجرای دوباره با همان Seed..."):
+            checkpoints = meta["checkpoints"] = rebuild_checkpoints(*run_args)
+    steps = int(pd.to_numeric(df["Time"]).max()) + 1
+    times = sorted(t for t in checkpoints if t < steps)
+    c1, c2 = st.columns(2)
+    t0 = c1.select_slider("گام شروع شاخه", options=times, value=times[len(times) // 2], key="branch_t", help=tip("branch_t"))
+    who = c2.selectbox("کشور", countries, key="branch_country")
+    ag = checkpoints[t0].agent(countries.index(who))
+    k = f"{who}_{t0}"
+    d1, d2, d3 = st.columns(3)
+    rho = d1.slider("ریسک‌پذیری (ρ_c)", 0.0, 1.0, round(float(ag.rho_c), 2), 0.01, key=f"branch_rho_{k}", help=tip("rho_c"))
+    d = d2.slider("ترجیح بازدارندگی/نفوذ (d_c)", 0.0, 1.0, round(float(ag.d_c), 2), 0.01, key=f"branch_d_{k}", help=tip("d_c"))
+    f = d3.slider("آستانه زور (f_c)", 0.0, 1.0, round(float(ag.f_c), 2), 0.01, key=f"branch_f_{k}", help=tip("f_c"))
+    p1, p2, p3 = st.columns(3)
+    omega_a = [float(x) for x in ag.omega_a]
+    prefs = [
+        p1.number_input("ترجیح آگاهی وضعیتی (ω_P)", 0.0, 10.0, round(omega_a[0], 2), 0.05, key=f"branch_prefP_{k}", help=tip("prefP")),
+        p2.number_input("ترجیح سیگنال (ω_S)", 0.0, 10.0, round(omega_a[1], 2), 0.05, key=f"branch_prefS_{k}", help=tip("prefS")),
+        p3.number_input("ترجیح تقویت/زور (ω_R)", 0.0, 10.0, round(omega_a[2], 2), 0.05, key=f"branch_prefR_{k}", help=tip("prefR")),
+    ]
+    if st.button("➕ اجرای شاخه", key="branch_run", help=tip("branch_run")):
+        mods = {"countries": {who: {"rho_c": rho, "d_c": d, "f_c": f, "omega_a": prefs}}}
+        with st.spinner(f"اجرای شاخه از گام {t0}..."):
+            bdf = run_branch(checkpoints[t0], t0, steps, mods)
+        st.session_state.setdefault("branches", []).append((f"{who} از گام {t0} (ρ={rho:.2f}, d={d:.2f}, f={f:.2f})", t0, bdf))
+
+    branches = st.session_state.get("branches", [])
+    if not branches: return
+    options = ["Global_Escalation"] + [f"{p}_{c}" for p in ("Tension", "Psi", "Resource") for c in countries]
+    col = st.selectbox("سری برای مقایسه", [o for o in options if o in df.columns], key="branch_series")
+    parts = [pd.DataFrame({"Time": df["Time"], "value": df[col], "شاخه": "اجرای اصلی"})]
+    for label, _, bdf in branches:
+        if col in bdf.columns:
+            parts.append(pd.DataFrame({"Time": bdf["Time"], "value": bdf[col], "شاخه": label}))
+    fig = px.line(pd.concat(parts, ignore_index=True), x="Time", y="value", color="شاخه",
+                  title=f"اجرای اصلی در برابر شاخه‌ها: {col}", labels={"Time": "گام زمانی", "value": col, "شاخه": "شاخه"})
+    for t0 in sorted({b[1] for b in branches}):
+        fig.add_vline(x=t0, line_dash="dot", line_color="gray")
+    st.plotly_chart(fig, use_container_width=True)
+    if st.button("🗑️ حذف شاخه‌ها", key="branch_clear"):
+        st.session_state.branches = []
+        st.rerun()
+
 # ==========================================================
 # 5) Streamlit UI
 # ==========================================================
@@ -825,6 +1587,12 @@ def main():
     st.set_page_config(page_title="شبیه‌ساز ژئوپلیتیک", layout="wide")
     st.title("🌍 شبیه‌ساز ژئوپلیتیک")
 
+    if st.sidebar.toggle("🌐 حالت جهان بزرگ", value=False, key="large_world", help=tip("large_world")):
+        doctrine_update_every = st.sidebar.number_input("تغییر دکترین بعد از چند بار انجام اقدام؟", 0, 200, 0, 5)
+        use_cache = st.sidebar.toggle("استفاده از نتایج ذخیره‌شده", value=True, help=tip("use_cache"))
+        large_world_page(doctrine_update_every, use_cache)
+        return
+
     scenarios = scenario_pack()
     st.sidebar.header("🧩 سناریوهای آماده")
     scenario_keys = ["custom"] + list(scenarios.keys())
@@ -860,7 +1628,12 @@ def main():
     seed = st.sidebar.number_input("عدد بذر تصادفی (Seed)", 0, 10_000_000, 42) if test_mode else None
     
     steps = st.sidebar.number_input("تعداد گام‌های زمانی", 10, 200, scenarios.get(chosen, {}).get("steps_default", 70), 5)
+    show_recording_estimate(len(countries), steps, runs=num_runs)
+    steady = steady_controls()
+    ensemble = ensemble_controls(num_runs)
+    use_cache = st.sidebar.toggle("استفاده از نتایج ذخیره‌شده", value=True, help=tip("use_cache"))
     run_btn = st.sidebar.button("🚀 اجرای شبیه‌سازی", type="primary", use_container_width=True)
+    emulator = emulator_controls(agent_cfgs, W, steps, doctrine_update_every)
 
 
     if "sim_df" not in st.session_state: st.session_state.sim_df = None
@@ -869,11 +1642,25 @@ def main():
 
     if run_btn:
         with st.spinner(f"در حال اجرای شبیه‌سازی ({num_runs} بار)..."):
-            df_avg, avg_meta, all_dfs = run_multiple_simulations(agent_cfgs, W, steps, test_mode, seed, doctrine_update_every, num_runs)
+            result = confirmation_result(simulation_cache_key(agent_cfgs, W, steps, test_mode, seed, doctrine_update_every, num_runs,
+                                                              steady, ensemble))
+            if result is None:
+                result = cached_run_multiple_simulations(agent_cfgs, W, steps, test_mode, seed, doctrine_update_every, num_runs,
+                                                         use_cache=use_cache, steady=steady, scenario=chosen, ensemble=ensemble)
+            df_avg, avg_meta, all_dfs = result
             st.session_state.sim_df = df_avg
             st.session_state.sim_meta = avg_meta
+            st.session_state.sim_args = (agent_cfgs, W, steps, test_mode, seed, doctrine_update_every, num_runs, steady, ensemble)
             st.session_state.all_dfs = all_dfs
             st.session_state.has_run = True
+            st.session_state.branches = []
+
+    if emulator is not None:
+        confirm = start_confirmation_run(agent_cfgs, W, steps, test_mode, seed, doctrine_update_every, num_runs, use_cache, steady,
+                                         scenario=chosen, ensemble=ensemble)
+        emulator_panel(emulator, agent_cfgs, countries, num_runs, confirm)
+
+    registry_panel(chosen)
 
     if not st.session_state.has_run: st.stop()
 
@@ -888,35 +1675,44 @@ def main():
     st.dataframe(df_action_counts(all_dfs, countries), use_container_width=True)
     
     st.divider()
-    plot_three_indices_heatmaps(df, countries, window=10)
+    lod = lod_controls(df)
+    plot_three_indices_heatmaps(df, countries, window=10, lod=lod)
 
     st.divider()
-    plot_global_escalation(df)
+    plot_global_escalation(df, lod=lod)
+    show_steady_events(meta)
+    show_variance_reduction(meta)
+    if num_runs > 1:
+        plot_mean_field_check(st.session_state.get("sim_args"), all_dfs, countries, lod=lod)
 
     st.divider()
-    plot_dyad_crisis_heatmap(df, countries)
+    tensors = result_tensors(df, meta, countries)
+    plot_dyad_crisis_heatmap(df, countries, tensors, W=W, lod=lod)
 
     st.divider()
-    plot_lines_by_country(df, countries, prefix="Tension", title_fa="روند تنش کشورها (Tension)", y_label_fa="تنش (Tension)")
+    plot_lines_by_country(df, countries, prefix="Tension", title_fa="روند تنش کشورها (Tension)", y_label_fa="تنش (Tension)", lod=lod)
 
     st.divider()
-    plot_lines_by_country(df, countries, prefix="Resource", title_fa="روند منابع کشورها (Resources)", y_label_fa="منابع (Resources)")
+    plot_lines_by_country(df, countries, prefix="Resource", title_fa="روند منابع کشورها (Resources)", y_label_fa="منابع (Resources)", lod=lod)
 
     st.divider()
-    plot_lines_by_country(df, countries, prefix="Psi", title_fa="خروجی تشدید کشور (ψ_c)", y_label_fa="ψ_c")
+    plot_lines_by_country(df, countries, prefix="Psi", title_fa="خروجی تشدید کشور (ψ_c)", y_label_fa="ψ_c", lod=lod)
 
     st.divider()
-    plot_actions_map(df, countries)
+    plot_actions_map(df, countries, lod=lod)
 
     st.divider()
-    plot_dyad_tension_heatmap(df, countries)
+    plot_dyad_tension_heatmap(df, countries, tensors, W=W, lod=lod)
 
     st.divider()
     if num_runs == 1:
-        plot_interaction_graph_directed(df, countries)
+        plot_interaction_graph_directed(df, countries, frames_data=(meta or {}).get("graph_frames"))
     else:
         st.info("💡 گراف تعاملات جهت‌دار در حالت میانگین‌گیری (بیش از ۱ تکرار) غیرفعال است.")
         
+    st.divider()
+    what_if_branches(df, meta, countries, st.session_state.get("sim_args"))
+
     st.divider()
     st.subheader("تغییر پارامترها (ابتدا → انتها)")
     trans_df = build_transition_df(meta, countries)
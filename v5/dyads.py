@@ -0,0 +1,89 @@
+# dyads.py
+# -------------------------------------------------------------------
+# استخراج داده‌های نمودار حرارتی دوتایی (src → dst) از آرایه‌های (T, N, N).
+# هیچ حلقه‌ای روی زوج‌ها و هیچ کار pandas به ازای هر زوج انجام نمی‌شود؛
+# همه چیز با برش (slicing) و ضرب ماتریسی ساخته می‌شود.
+# -------------------------------------------------------------------
+
+import numpy as np
+import pandas as pd
+
+
+def offdiag_pairs(n: int):
+    """Row-major (src, dst) index arrays for all ordered pairs with src != dst."""
+    I, J = np.nonzero(~np.eye(n, dtype=bool))
+    return I, J
+
+
+def dyad_tensor_from_df(df: pd.DataFrame, countries, prefix: str) -> np.ndarray:
+    """Gather the ``{prefix}_{src}_{dst}`` columns of a result frame into one (T, N, N) array.
+
+    One block conversion per family (no per-pair work); meant to run once per result, not per
+    redraw. Rows are ordered by sorted unique Time; missing columns and NaN cells are 0.
+    """
+    n = len(countries)
+    dfx = df.assign(Time=pd.to_numeric(df["Time"], errors="coerce").fillna(0).astype(int))
+    dfx = dfx.drop_duplicates(subset=["Time"]).sort_values("Time")
+    cols = [f"{prefix}_{src}_{dst}" for src in countries for dst in countries]
+    block = dfx.reindex(columns=cols).to_numpy(dtype=float, na_value=0.0, copy=True)
+    Z = block.reshape(len(dfx), n, n)
+    Z[:, np.arange(n), np.arange(n)] = 0.0
+    return Z
+
+
+def pair_matrix(Z: np.ndarray, countries):
+    """(T,N,N) → heatmap rows (P, T) for every ordered pair, plus the row labels."""
+    I, J = offdiag_pairs(Z.shape[1])
+    labels = [f"{countries[i]} - {countries[j]}" for i, j in zip(I, J)]
+    return Z[:, I, J].T, labels
+
+
+def top_k_pairs(Z: np.ndarray, countries, k: int):
+    """Keep the ``k`` pairs with the highest time-averaged value (most tense dyads first)."""
+    rows, labels = pair_matrix(Z, countries)
+    k = int(max(1, min(k, rows.shape[0])))
+    order = np.argsort(-rows.mean(axis=1), kind="stable")[:k]
+    return rows[order], [labels[o] for o in order]
+
+
+def bloc_labels_from_W(W, threshold: float = 0.3) -> np.ndarray:
+    """Group countries into blocs: connected components of the aligned part of W (W_ij + W_ji > 2·threshold)."""
+    W = np.asarray(W, dtype=float)
+    n = W.shape[0]
+    A = (W + W.T) > (2.0 * threshold)
+    labels = -np.ones(n, dtype=int)
+    g = 0
+    for s in range(n):
+        if labels[s] >= 0:
+            continue
+        stack = [s]
+        labels[s] = g
+        while stack:
+            u = stack.pop()
+            for v in np.nonzero(A[u] & (labels < 0))[0]:
+                labels[v] = g
+                stack.append(v)
+        g += 1
+    return labels
+
+
+def block_average(Z: np.ndarray, labels) -> np.ndarray:
+    """Average (T,N,N) over bloc pairs → (T,G,G); self-pairs (i == i) are excluded from the mean."""
+    labels = np.asarray(labels, dtype=int)
+    n = Z.shape[1]
+    G = int(labels.max()) + 1 if labels.size else 0
+    M = np.zeros((n, G), dtype=float)
+    M[np.arange(n), labels] = 1.0
+    sums = np.einsum("ia,tij,jb->tab", M, Z, M, optimize=True)
+    counts = M.T @ (1.0 - np.eye(n)) @ M
+    return sums / np.maximum(counts, 1.0)[None, :, :]
+
+
+def block_pairs(Z: np.ndarray, labels, bloc_names=None):
+    """Bloc-level heatmap rows (G·G, T) with labels ``"bloc a - bloc b"``."""
+    B = block_average(Z, labels)
+    G = B.shape[1]
+    names = list(bloc_names) if bloc_names is not None else [f"بلوک {g + 1}" for g in range(G)]
+    A, Bi = np.meshgrid(np.arange(G), np.arange(G), indexing="ij")
+    A, Bi = A.ravel(), Bi.ravel()
+    return B[:, A, Bi].T, [f"{names[a]} - {names[b]}" for a, b in zip(A, Bi)]
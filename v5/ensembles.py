@@ -0,0 +1,237 @@
+# ensembles.py
+# -------------------------------------------------------------------
+# اجرای گروهی (ensemble) شبیه‌سازی و مقایسه آن با حالت mean-field.
+# حالت mean-field میانگین Monte Carlo را با یک اجرای قطعی تقریب می‌زند؛
+# اینجا گزارشی ساخته می‌شود که نشان دهد این تقریب برای هر سری چقدر دقیق است
+# (خطا بر حسب خطای استاندارد میانگین نمونه‌ها).
+# کاهش واریانس: اعداد تصادفی مشترک (CRN) برای مقایسه دو پیکربندی، جفت‌های antithetic و
+# برآوردگر Rao-Blackwell (امید ψ_ij به‌جای Y نمونه‌گیری‌شده). هر کدام ضریب کاهش واریانس
+# به‌دست‌آمده را گزارش می‌کند.
+# یادگیری مشترک: تکرارها هم‌گام اجرا می‌شوند و α/η یک بار روی داده همه آن‌ها برازش می‌شود.
+# -------------------------------------------------------------------
+
+import numpy as np
+import pandas as pd
+
+from model5 import PooledBayesStore, RowBuffer
+
+SUMMARY_SERIES = ("Mean_Tension", "Mean_Resource", "Mean_Psi", "Escalation_Rate")
+
+
+def run_ensemble(make_world, steps: int, seeds, engine: str = "vectorized", **kwargs):
+    """Run ``make_world(engine=..., seed=s, **kwargs)`` for every seed; returns the list of summary frames."""
+    frames = []
+    for s in seeds:
+        world = make_world(engine=engine, seed=int(s), **kwargs)
+        world.run(int(steps))
+        frames.append(world.summary.to_frame())
+    return frames
+
+
+def ensemble_stats(frames, columns):
+    """Per-time mean and standard error (of the mean) over runs → two DataFrames indexed by Time."""
+    stack = np.stack([f.set_index("Time")[list(columns)].to_numpy(dtype=float) for f in frames])
+    idx = frames[0]["Time"].to_numpy()
+    mean = stack.mean(axis=0)
+    se = stack.std(axis=0, ddof=1) / np.sqrt(len(frames)) if len(frames) > 1 else np.zeros_like(mean)
+    return (pd.DataFrame(mean, index=idx, columns=list(columns)),
+            pd.DataFrame(se, index=idx, columns=list(columns)))
+
+
+def compare_frames(approx: pd.DataFrame, frames, columns=None) -> pd.DataFrame:
+    """Accuracy of one deterministic trajectory against the mean of sampled runs, one row per series.
+
+    Columns: final values, RMSE and max absolute error over time, the largest |error| / SE,
+    and ``coverage`` = share of steps where the error is within 2 standard errors.
+    """
+    if columns is None:
+        columns = [c for c in approx.columns if c != "Time" and all(c in f.columns for f in frames)]
+    columns = [c for c in columns if c in approx.columns]
+    mean, se = ensemble_stats(frames, columns)
+    approx = approx.set_index("Time").reindex(mean.index)[columns].astype(float)
+    rows = []
+    for c in columns:
+        err = approx[c].to_numpy() - mean[c].to_numpy()
+        s = se[c].to_numpy()
+        z = np.abs(err) / np.maximum(s, 1e-12)
+        rows.append({
+            "series": c,
+            "mc_final": float(mean[c].iloc[-1]),
+            "approx_final": float(approx[c].iloc[-1]),
+            "rmse": float(np.sqrt(np.nanmean(err ** 2))),
+            "max_abs_err": float(np.nanmax(np.abs(err))),
+            "mean_se": float(np.nanmean(s)),
+            "max_z": float(np.nanmax(z)),
+            "coverage": float(np.nanmean(np.abs(err) <= 2.0 * s)),
+        })
+    return pd.DataFrame(rows)
+
+
+def mean_field_report(make_world, steps: int, n_runs: int = 50, seed: int = 0, columns=SUMMARY_SERIES):
+    """Run the mean-field engine once and a sampled ensemble of ``n_runs``; compare their summaries.
+
+    ``make_world(engine, seed)`` must build a fresh world each call. Returns ``(report, detail)``
+    where ``detail`` holds the mean-field frame and the ensemble mean/SE frames. For a like-for-like
+    check build worlds with ``bayes_update_every=0`` (the mean-field engine does not refit α/η).
+    """
+    mf = make_world(engine="mean_field", seed=None)
+    mf.run(int(steps))
+    approx = mf.summary.to_frame()
+    frames = run_ensemble(make_world, steps, range(int(seed), int(seed) + int(n_runs)))
+    cols = list(columns) + [c for c in approx.columns if c.startswith("Share_")]
+    mean, se = ensemble_stats(frames, cols)
+    return compare_frames(approx, frames, cols), {"mean_field": approx, "mc_mean": mean, "mc_se": se}
+
+
+# -------------------------------------------------------------------
+# کاهش واریانس
+# -------------------------------------------------------------------
+def run_statistic(frame: pd.DataFrame, column: str, statistic: str = "mean") -> float:
+    """Scalar output of one run: ``"mean"`` over time, ``"final"`` value or ``"sum"`` of ``column``."""
+    x = frame[column].to_numpy(dtype=float)
+    if statistic == "mean":
+        return float(x.mean())
+    if statistic == "final":
+        return float(x[-1])
+    if statistic == "sum":
+        return float(x.sum())
+    raise ValueError(f"unknown statistic {statistic!r}")
+
+
+def _vr_row(technique, estimate, se, naive_se, n_runs):
+    vrf = (naive_se / se) ** 2 if se > 0 else np.inf
+    return {"technique": technique, "estimate": float(estimate), "se": float(se),
+            "naive_se": float(naive_se), "variance_reduction": float(vrf), "n_runs": int(n_runs)}
+
+
+def crn_difference(make_a, make_b, steps: int, seeds, column: str = "Escalation_Rate",
+                   statistic: str = "mean") -> dict:
+    """Difference ``B - A`` of one output, with both configurations run on the same seeds (CRN).
+
+    The naive SE is what independent streams would give for the same number of runs,
+    ``sqrt((Var A + Var B) / n)``; the CRN SE is ``sd(B - A) / sqrt(n)`` over the paired runs.
+    """
+    seeds = [int(s) for s in seeds]
+    a = np.array([run_statistic(f, column, statistic) for f in run_ensemble(make_a, steps, seeds)])
+    b = np.array([run_statistic(f, column, statistic) for f in run_ensemble(make_b, steps, seeds)])
+    n = len(seeds)
+    se = float(np.std(b - a, ddof=1) / np.sqrt(n))
+    naive = float(np.sqrt((np.var(a, ddof=1) + np.var(b, ddof=1)) / n))
+    return _vr_row("crn", (b - a).mean(), se, naive, 2 * n)
+
+
+def antithetic_estimate(make_world, steps: int, n_pairs: int, seed: int = 0, column: str = "Escalation_Rate",
+                        statistic: str = "mean") -> dict:
+    """Mean of one output from ``n_pairs`` antithetic pairs (seed s with ``antithetic=False`` / ``True``).
+
+    ``make_world`` must accept an ``antithetic`` keyword. The naive SE treats the ``2 n`` runs as
+    independent (``sd / sqrt(2n)``); the reported SE comes from the pair means.
+    """
+    seeds = range(int(seed), int(seed) + int(n_pairs))
+    return antithetic_pairs(run_ensemble(make_world, steps, seeds), run_ensemble(make_world, steps, seeds, antithetic=True),
+                            column, statistic)
+
+
+def antithetic_pairs(frames, twins, column: str = "Escalation_Rate", statistic: str = "mean") -> dict:
+    """:func:`antithetic_estimate` from runs already made: ``twins[k]`` is the antithetic run of ``frames[k]``."""
+    a = np.array([run_statistic(f, column, statistic) for f in frames])
+    b = np.array([run_statistic(f, column, statistic) for f in twins])
+    pair = 0.5 * (a + b)
+    se = float(np.std(pair, ddof=1) / np.sqrt(len(pair)))
+    naive = float(np.std(np.concatenate([a, b]), ddof=1) / np.sqrt(2 * len(pair)))
+    return _vr_row("antithetic", pair.mean(), se, naive, 2 * len(pair))
+
+
+def rao_blackwell_estimate(frames, sampled: str = "Escalations", expected: str = None,
+                           statistic: str = "mean") -> dict:
+    """Mean of a sampled escalation series next to its Rao-Blackwellized twin from the same runs.
+
+    ``expected`` defaults to ``sampled + "_RB"`` (E[Y | ψ_ij], recorded by the vectorized engine).
+    Both estimate the same quantity; the reduction is ``Var(sampled) / Var(expected)`` across runs.
+    """
+    expected = expected or f"{sampled}_RB"
+    x = np.array([run_statistic(f, sampled, statistic) for f in frames])
+    r = np.array([run_statistic(f, expected, statistic) for f in frames])
+    n = len(frames)
+    row = _vr_row("rao_blackwell", r.mean(), np.std(r, ddof=1) / np.sqrt(n), np.std(x, ddof=1) / np.sqrt(n), n)
+    row["naive_estimate"] = float(x.mean())
+    return row
+
+
+def variance_reduction_report(make_world, steps: int, n_runs: int = 20, seed: int = 0,
+                              column: str = "Escalation_Rate", make_alt=None) -> pd.DataFrame:
+    """One row per technique: Rao-Blackwell (if ``column`` has an ``_RB`` twin), antithetic, and CRN
+    when ``make_alt`` is given.
+
+    ``make_world(engine, seed, antithetic=False)`` builds a fresh world; ``make_alt`` is the second
+    configuration for the CRN difference ``alt - base``.
+    """
+    seeds = range(int(seed), int(seed) + int(n_runs))
+    frames = run_ensemble(make_world, steps, seeds)
+    rows = []
+    if f"{column}_RB" in frames[0].columns:
+        rows.append(rao_blackwell_estimate(frames, column, f"{column}_RB"))
+    rows.append(antithetic_estimate(make_world, steps, n_runs, seed, column))
+    if make_alt is not None:
+        rows.append(crn_difference(make_world, make_alt, steps, seeds, column))
+    return pd.DataFrame(rows)
+
+
+# -------------------------------------------------------------------
+# یادگیری مشترک ضرایب تشدید بین تکرارها
+# -------------------------------------------------------------------
+def _advance(world, t0: int, steps: int, seed):
+    # اجرا در پردازه کارگر؛ مسیر loop از np.random سراسری می‌خواند، پس بذر هر قطعه تعیین می‌شود
+    if seed is not None:
+        np.random.seed(int(seed))
+    world.run(int(steps), int(t0))
+    return world
+
+
+def run_pooled(worlds, steps: int, t0: int = 0, store: PooledBayesStore = None, executor=None, seed=None):
+    """Run replicas in lockstep with one shared α/η window and one fit per update step.
+
+    Every replica's rows go into ``store`` (created and attached if not given, sized
+    ``bayes_window × replicas``); at each multiple of ``bayes_update_every`` the coefficients are
+    fitted once on the pooled rows and installed in all replicas. Without ``executor`` replicas
+    share the buffers directly; with a ``concurrent.futures`` executor (use processes for the
+    loop engine) each replica runs the stretch up to the next update step in a worker, and its
+    rows are merged into the store before the fit (``seed`` seeds each stretch). Returns
+    ``(worlds, store)``; with an executor ``worlds`` are the returned copies.
+    """
+    worlds = list(worlds)
+    lead = worlds[0]
+    every = int(lead.bayes_update_every)
+    if store is None:
+        store = PooledBayesStore(lead.bayes_window, lead.bayes_min_samples, n_replicas=len(worlds))
+        for w in worlds:
+            store.attach(w)
+    t, end = int(t0), int(t0) + int(steps)
+
+    def is_update(u):
+        return every > 0 and u > 0 and u % every == 0
+
+    if executor is None:
+        for t in range(t, end):
+            for w in worlds:
+                w.step(t)
+            if is_update(t):
+                store.update(worlds)
+        return worlds, store
+
+    seeds = np.random.SeedSequence(seed)
+    while t < end:
+        u = end - 1 if every <= 0 else min(end - 1, max(every, -(-t // every) * every))
+        for w in worlds:
+            w._country_buf = RowBuffer(w.bayes_window, 11)
+            w._edge_buf = RowBuffer(w.bayes_window, 5)
+        stretch = [int(s.generate_state(1)[0]) for s in seeds.spawn(len(worlds))]
+        worlds = list(executor.map(_advance, worlds, [t] * len(worlds), [u - t + 1] * len(worlds), stretch))
+        for w in worlds:
+            store.absorb(w)
+        if is_update(u):
+            store.update(worlds)
+        t = u + 1
+    for w in worlds:
+        store.attach(w)
+    return worlds, store
@@ -0,0 +1,323 @@
+# history_store.py
+# -------------------------------------------------------------------
+# نوشتن خروجی گام‌به‌گام روی دیسک برای اجراهای خیلی بلند (out-of-core):
+# - ChunkedHistoryWriter جای فهرست world.history (و ردیف‌های SummaryRecorder) می‌نشیند:
+#   ردیف‌ها در تکه‌های chunk_rows تایی جمع می‌شوند و هر تکه روی یک نخ پس‌زمینه به ستون تبدیل
+#   و به‌صورت یک فایل جدا (فقط افزودنی) نوشته می‌شود؛ شبیه‌سازی در همین حال ادامه می‌دهد.
+# - حافظه محدود: حداکثر max_pending تکه در صف نوشتن + تکه جاری + tail ردیف آخر
+#   (tail برای پرش از حالت پایا و نمایش زنده)، مستقل از طول اجرا.
+# - قالب‌ها: "npy" (آرایه ساختاریافته، قابل memory-map؛ ستون‌های رشته‌ای به کد عددی +
+#   واژه‌نامه در meta.json)، "parquet" و "arrow" (IPC) با pyarrow اختیاری.
+# - HistoryStore همان پوشه را می‌خواند (حتی وسط اجرا): تکه‌به‌تکه (stream)، یک ستون، یا بازه‌ای از ردیف‌ها.
+# -------------------------------------------------------------------
+
+import json
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+FORMATS = {"npy": ".npy", "parquet": ".parquet", "arrow": ".arrow"}
+META_FILE = "meta.json"
+CODE_DTYPE = "<i4"
+# ستون‌های رشته‌ای (کد کنش، نام هدف) در npy به این نوع کد می‌شوند
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet  # noqa: F401
+    except ImportError as exc:
+        raise ImportError("the 'parquet' and 'arrow' formats need pyarrow (pip install pyarrow); "
+                          "use fmt='npy' without it") from exc
+    return pyarrow
+
+
+def _write_atomic(path: str, write):
+    tmp = f"{path}.tmp"
+    try:
+        with open(tmp, "wb") as fh:
+            write(fh)
+        os.replace(tmp, path)  # خواننده هیچ‌وقت فایل نیمه‌نوشته نمی‌بیند
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+class ChunkedHistoryWriter:
+    """List-like sink for per-step rows that keeps a bounded tail in memory and writes the rest to disk.
+
+    :meth:`append` collects row dicts; every ``chunk_rows`` rows the chunk goes to a background
+    thread that turns it into columns and writes it to ``path`` as one append-only file
+    (``fmt``: ``"npy"`` structured array, ``"parquet"`` or ``"arrow"`` IPC; the last two need
+    pyarrow). At most ``max_pending`` chunks wait for the writer (:meth:`append` blocks beyond
+    that), so memory stays at ``(max_pending + 1) · chunk_rows + tail`` rows for any run length.
+
+    The first chunk fixes the columns; later rows must have the same keys. ``len()`` counts every
+    appended row, while indexing and slicing only reach the last ``tail`` rows (what
+    :meth:`MultiAgentWorld.fast_forward` and live views need). :meth:`close` writes the rest
+    and returns a :class:`HistoryStore`. Errors of the writer thread are raised by the next
+    :meth:`flush` / :meth:`close`.
+    """
+
+    def __init__(self, path: str, chunk_rows: int = 4096, fmt: str = "npy", tail: int = 0, max_pending: int = 2):
+        if fmt not in FORMATS:
+            raise ValueError(f"fmt must be one of {tuple(FORMATS)}")
+        if int(chunk_rows) < 1 or int(max_pending) < 1:
+            raise ValueError("chunk_rows and max_pending must be >= 1")
+        if fmt != "npy":
+            _pyarrow()
+        self.path = str(path)
+        self.fmt = fmt
+        self.chunk_rows = int(chunk_rows)
+        self.max_pending = int(max_pending)
+        os.makedirs(self.path, exist_ok=True)
+        if os.path.exists(os.path.join(self.path, META_FILE)):
+            raise FileExistsError(f"{self.path} already holds a recorded history")
+        self._buf = []
+        self._tail = deque(maxlen=int(tail))
+        self._n = 0
+        self._pending = deque()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-writer")
+        # فقط نخ نویسنده به این‌ها دست می‌زند (یک کارگر، پس تکه‌ها به ترتیب نوشته می‌شوند)
+        self._codes = {}
+        self._schema = None
+        self.meta = dict(format=fmt, columns=None, dtypes={}, categories={}, chunks=[], rows=0, closed=False)
+        self._save_meta()
+        self.closed = False
+
+    # ---------- سمت شبیه‌سازی ----------
+    def append(self, row: dict):
+        if self.closed:
+            raise ValueError("history writer is closed")
+        self._buf.append(row)
+        self._tail.append(row)
+        self._n += 1
+        if len(self._buf) >= self.chunk_rows:
+            self.flush()
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def append_frame(self, df: pd.DataFrame):
+        """Append a whole DataFrame (same columns as the rows) without going through row dicts."""
+        if self.closed:
+            raise ValueError("history writer is closed")
+        self.flush()
+        for i in range(0, len(df), self.chunk_rows):
+            self._submit(df.iloc[i:i + self.chunk_rows].reset_index(drop=True))
+        if self._tail.maxlen:
+            self._tail.extend(df.iloc[-self._tail.maxlen:].to_dict("records"))
+        self._n += len(df)
+
+    def flush(self):
+        """Hand the rows collected so far to the writer thread (blocks while ``max_pending`` chunks wait)."""
+        if self._buf:
+            rows, self._buf = self._buf, []
+            self._submit(rows)
+
+    def _submit(self, rows):
+        while self._pending and (self._pending[0].done() or len(self._pending) >= self.max_pending):
+            self._pending.popleft().result()
+        self._pending.append(self._executor.submit(self._write_chunk, rows))
+
+    def wait(self):
+        """Block until every handed-off chunk is on disk."""
+        while self._pending:
+            self._pending.popleft().result()
+
+    def close(self) -> "HistoryStore":
+        if not self.closed:
+            self.flush()
+            self.wait()
+            self.meta["closed"] = True
+            self._save_meta()
+            self._executor.shutdown()
+            self.closed = True
+        return HistoryStore(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ---------- رفتار شبیه فهرست ----------
+    def __len__(self) -> int:
+        return self._n
+
+    def __bool__(self) -> bool:
+        return self._n > 0
+
+    def recent(self) -> list:
+        """The rows still held in memory (at most ``tail``)."""
+        return list(self._tail)
+
+    def __getitem__(self, key):
+        tail = self._tail
+        first = self._n - len(tail)
+        if isinstance(key, slice):
+            idx = range(*key.indices(self._n))
+            if len(idx) and min(idx[0], idx[-1]) < first:
+                raise IndexError(f"rows before {first} were written to {self.path}; read them with HistoryStore")
+            return [tail[i - first] for i in idx]
+        i = int(key) + (self._n if key < 0 else 0)
+        if not first <= i < self._n:
+            raise IndexError(f"row {key} is not in the in-memory tail; read it with HistoryStore")
+        return tail[i - first]
+
+    def __iter__(self):
+        raise TypeError("a streamed history is on disk; iterate HistoryStore(path).iter_chunks() instead")
+
+    def __getstate__(self):
+        # کپی pickle‌شده فقط خواندنی است: نخ و صف قابل pickle نیستند
+        self.wait()
+        state = {k: v for k, v in self.__dict__.items() if k not in ("_executor", "_pending")}
+        state.update(closed=True, _buf=[])
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._pending = deque()
+        self._executor = None
+
+    # ---------- سمت نخ نویسنده ----------
+    def _save_meta(self):
+        meta = dict(self.meta, categories={c: list(v) for c, v in self._codes.items()})
+        data = json.dumps(meta, ensure_ascii=False).encode("utf-8")
+        _write_atomic(os.path.join(self.path, META_FILE), lambda fh: fh.write(data))
+
+    def _write_chunk(self, rows):
+        df = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame.from_records(rows)
+        meta = self.meta
+        if meta["columns"] is None:
+            meta["columns"] = list(df.columns)
+            for c in df.columns:
+                s = df[c]
+                numeric = pd.api.types.is_numeric_dtype(s) or pd.api.types.is_bool_dtype(s)
+                meta["dtypes"][c] = s.to_numpy().dtype.str if numeric else "category"
+        elif set(df.columns) != set(meta["columns"]):
+            raise ValueError(f"rows of chunk {len(meta['chunks'])} have different columns than the first chunk")
+        df = df[meta["columns"]]
+        target = os.path.join(self.path, f"chunk_{len(meta['chunks']):06d}{FORMATS[self.fmt]}")
+        if self.fmt == "npy":
+            arr = self._to_records(df)
+            _write_atomic(target, lambda fh: np.save(fh, arr))
+        else:
+            pa = _pyarrow()
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self._schema is None:
+                self._schema = table.schema
+                meta["dtypes"] = {f.name: str(f.type) for f in table.schema}
+            table = table.cast(self._schema)
+            if self.fmt == "parquet":
+                _write_atomic(target, lambda fh: pa.parquet.write_table(table, fh))
+            else:
+                def write(fh):
+                    with pa.ipc.new_file(fh, table.schema) as w:
+                        w.write_table(table)
+                _write_atomic(target, write)
+        meta["chunks"].append(len(df))
+        meta["rows"] += len(df)
+        self._save_meta()
+
+    def _to_records(self, df):
+        dtypes = self.meta["dtypes"]
+        out = np.empty(len(df), dtype=[(c, CODE_DTYPE if dtypes[c] == "category" else dtypes[c]) for c in df.columns])
+        for c in df.columns:
+            if dtypes[c] == "category":
+                vocab = self._codes.setdefault(c, {})
+                out[c] = [vocab.setdefault(v, len(vocab)) for v in df[c].tolist()]
+                continue
+            try:
+                out[c] = df[c].to_numpy().astype(dtypes[c], casting="same_kind")
+            except TypeError as exc:
+                raise ValueError(f"column {c!r} changed type ({df[c].dtype} after {dtypes[c]})") from exc
+        return out
+
+
+class HistoryStore:
+    """Read side of a :class:`ChunkedHistoryWriter` directory; works while the run is still writing.
+
+    :meth:`iter_chunks` streams one chunk at a time as a DataFrame, :meth:`column` and
+    :meth:`to_frame` assemble only the requested columns / rows, and :meth:`records` memory-maps
+    the raw structured array of an ``npy`` chunk (string columns hold codes into
+    ``categories[column]``). Call :meth:`refresh` to see chunks written since opening.
+    """
+
+    def __init__(self, path: str):
+        self.path = str(path)
+        self.refresh()
+
+    def refresh(self) -> "HistoryStore":
+        with open(os.path.join(self.path, META_FILE), encoding="utf-8") as fh:
+            self.meta = json.load(fh)
+        self.offsets = np.concatenate([[0], np.cumsum(self.meta["chunks"], dtype=np.int64)])
+        self.categories = {c: np.asarray(v, dtype=object) for c, v in self.meta["categories"].items()}
+        return self
+
+    def __len__(self) -> int:
+        return int(self.meta["rows"])
+
+    @property
+    def columns(self) -> list:
+        return list(self.meta["columns"] or [])
+
+    @property
+    def n_chunks(self) -> int:
+        return len(self.meta["chunks"])
+
+    @property
+    def complete(self) -> bool:
+        return bool(self.meta["closed"])
+
+    def _file(self, i: int) -> str:
+        return os.path.join(self.path, f"chunk_{int(i):06d}{FORMATS[self.meta['format']]}")
+
+    def records(self, i: int) -> np.ndarray:
+        """Memory-mapped structured array of ``npy`` chunk ``i`` (nothing is read until used)."""
+        if self.meta["format"] != "npy":
+            raise ValueError("records() needs an 'npy' store")
+        # سرآیند آرایه‌های پهن (هزاران ستون) از سقف پیش‌فرض numpy بزرگ‌تر است؛ فایل را خودمان نوشته‌ایم
+        return np.load(self._file(i), mmap_mode="r", max_header_size=1 << 30)
+
+    def chunk(self, i: int, columns=None) -> pd.DataFrame:
+        columns = self.columns if columns is None else list(columns)
+        fmt = self.meta["format"]
+        if fmt == "npy":
+            rec = self.records(i)
+            return pd.DataFrame({c: self.categories[c][rec[c]] if self.meta["dtypes"][c] == "category"
+                                 else np.array(rec[c]) for c in columns})
+        pa = _pyarrow()
+        if fmt == "parquet":
+            return pa.parquet.read_table(self._file(i), columns=columns).to_pandas()
+        with pa.memory_map(self._file(i)) as src:
+            return pa.ipc.open_file(src).read_all().select(columns).to_pandas()
+
+    def iter_chunks(self, columns=None):
+        """Yield every chunk as a DataFrame, one at a time."""
+        for i in range(self.n_chunks):
+            yield self.chunk(i, columns)
+
+    def column(self, name: str) -> np.ndarray:
+        return np.concatenate([df[name].to_numpy() for df in self.iter_chunks([name])]) if self.n_chunks else np.array([])
+
+    def to_frame(self, columns=None, start: int = 0, stop: int = None) -> pd.DataFrame:
+        """Rows ``start:stop`` (default all) of ``columns``; only the chunks that overlap are read."""
+        stop = len(self) if stop is None else min(int(stop), len(self))
+        start = max(0, int(start))
+        parts = []
+        for i in range(self.n_chunks):
+            lo, hi = int(self.offsets[i]), int(self.offsets[i + 1])
+            if hi <= start or lo >= stop:
+                continue
+            parts.append(self.chunk(i, columns).iloc[max(start, lo) - lo:min(stop, hi) - lo])
+        if not parts:
+            return pd.DataFrame(columns=self.columns if columns is None else list(columns))
+        return pd.concat(parts, ignore_index=True)
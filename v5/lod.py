@@ -0,0 +1,107 @@
+# lod.py
+# -------------------------------------------------------------------
+# لایه «سطح جزئیات» (Level of Detail) برای نمودارهای زمانی طولانی.
+# هدف: حجم داده‌ای که به مرورگر می‌رود به «بودجه پیکسل» محدود شود
+# و مستقل از طول افق شبیه‌سازی باشد، ولی شکل سری‌ها حفظ شود:
+# - خطوط: LTTB (Largest-Triangle-Three-Buckets)
+# - نقشه حرارتی: min/max در هر بازه
+# - اقدامات (دسته‌ای): مُد در هر بازه
+# -------------------------------------------------------------------
+
+import numpy as np
+
+DEFAULT_POINT_BUDGET = 1500
+# تعداد نقطه افقی پیش‌فرض؛ حدوداً عرض یک نمودار تمام‌صفحه بر حسب پیکسل.
+
+
+def bin_edges(n: int, n_bins: int) -> np.ndarray:
+    """Integer edges splitting ``range(n)`` into ``n_bins`` contiguous, non-empty bins."""
+    n_bins = int(max(1, min(n_bins, n)))
+    return np.linspace(0, n, n_bins + 1).astype(int)
+
+
+def window_slice(times, t0=None, t1=None) -> slice:
+    """Index slice of sorted ``times`` that falls inside ``[t0, t1]`` (None = open end)."""
+    times = np.asarray(times)
+    lo = 0 if t0 is None else int(np.searchsorted(times, t0, side="left"))
+    hi = len(times) if t1 is None else int(np.searchsorted(times, t1, side="right"))
+    return slice(lo, max(lo, hi))
+
+
+def lttb_indices(x, y, n_out: int) -> np.ndarray:
+    """Indices selected by Largest-Triangle-Three-Buckets downsampling (first/last always kept)."""
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    n_out = int(n_out)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    y = np.where(np.isfinite(y), y, 0.0)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    out = np.empty(n_out, dtype=int)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for b in range(n_out - 2):
+        lo, hi = edges[b], max(edges[b] + 1, edges[b + 1])
+        nlo, nhi = edges[b + 1], (edges[b + 2] if b + 2 < len(edges) else n)
+        nhi = max(nlo + 1, nhi)
+        cx, cy = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        # مساحت مثلث (نقطه قبلی انتخاب‌شده، کاندید، میانگین بازه بعد)
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(np.argmax(area))
+        out[b + 1] = a
+    return out
+
+
+def lttb(x, y, n_out: int):
+    """Downsample one line series; returns ``(x, y)`` arrays."""
+    idx = lttb_indices(x, y, n_out)
+    return np.asarray(x)[idx], np.asarray(y)[idx]
+
+
+def minmax_bins(times, Z, n_bins: int):
+    """Heatmap downsampling along time: each bin becomes two columns (min, max).
+
+    ``Z`` is (rows, T). Returns ``(x, Z_lod)`` with at most ``2 * n_bins`` columns; bins of
+    width 1 keep their single column. Spikes survive because both extremes are kept.
+    """
+    times = np.asarray(times)
+    Z = np.asarray(Z, dtype=float)
+    T = Z.shape[1]
+    if T <= 2 * n_bins:
+        return times, Z
+    e = bin_edges(T, n_bins)
+    lo, hi = e[:-1], e[1:]
+    zmin = np.minimum.reduceat(Z, lo, axis=1)
+    zmax = np.maximum.reduceat(Z, lo, axis=1)
+    wide = (hi - lo) > 1
+    x = np.empty(2 * len(lo), dtype=times.dtype)
+    x[0::2], x[1::2] = times[lo], times[hi - 1]
+    z = np.empty((Z.shape[0], 2 * len(lo)), dtype=float)
+    z[:, 0::2], z[:, 1::2] = zmin, zmax
+    keep = np.ones(2 * len(lo), dtype=bool)
+    keep[1::2] = wide
+    return x[keep], z[:, keep]
+
+
+def mode_bins(times, codes, n_bins: int, n_categories: int):
+    """Categorical downsampling: the most frequent code per time bin.
+
+    ``codes`` is (rows, T) of ints in ``[0, n_categories)``; negative values are ignored.
+    Returns ``(x, codes_lod)`` with bin-start times as x.
+    """
+    times = np.asarray(times)
+    codes = np.asarray(codes)
+    T = codes.shape[1]
+    if T <= n_bins:
+        return times, codes
+    e = bin_edges(T, n_bins)
+    bin_of = np.repeat(np.arange(len(e) - 1), np.diff(e))
+    R = codes.shape[0]
+    counts = np.zeros((R, len(e) - 1, n_categories), dtype=np.int32)
+    r_idx, t_idx = np.nonzero(codes >= 0)
+    np.add.at(counts, (r_idx, bin_of[t_idx], codes[r_idx, t_idx]), 1)
+    out = counts.argmax(axis=2)
+    out[counts.sum(axis=2) == 0] = -1
+    return times[e[:-1]], out
@@ -6,8 +6,19 @@
 # چند اصلاح مهندسی برای پایداری/واقع‌گرایی خروجی‌ها.
 # -------------------------------------------------------------------
 
+import atexit
+import copy
+import os
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
 import numpy as np
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, replace
+
+ENGINE_VERSION = "5.4"
+# نسخه موتور: هر تغییری که خروجی شبیه‌سازی را عوض کند باید این را بالا ببرد
+# (کلید کش نتایج در app به این مقدار وابسته است).
 
 
 # ==========================================================
@@ -60,6 +71,120 @@ def fit_logistic_map(X, y, w0=None, l2=1.0, lr=0.1, iters=200):
     # فرمول استاندارد: 1/(1+e^-x)
 
 
+@dataclass
+class LaplacePosterior:
+    """Gaussian approximation ``N(mean, H⁻¹)`` of a logistic-regression posterior around its MAP.
+
+    ``factor`` is ``L⁻ᵀ`` for the Cholesky factor ``L`` of the Hessian ``H``, so
+    ``mean + factor @ z`` with ``z ~ N(0, I)`` is a posterior draw. A batch of G independent
+    posteriors has ``mean`` (G, d) and ``factor`` (G, d, d).
+    """
+    mean: np.ndarray
+    factor: np.ndarray
+
+    @classmethod
+    def from_hessian(cls, mean, H) -> "LaplacePosterior":
+        L = np.linalg.cholesky(H)
+        return cls(mean=np.array(mean, dtype=float), factor=np.swapaxes(np.linalg.inv(L), -1, -2))
+
+    @property
+    def cov(self) -> np.ndarray:
+        return self.factor @ np.swapaxes(self.factor, -1, -2)
+
+    @property
+    def sd(self) -> np.ndarray:
+        return np.sqrt((self.factor ** 2).sum(axis=-1))
+
+    def sample(self, z) -> np.ndarray:
+        """Draw(s) for standard normal ``z``: (d,) or (m, d) for one posterior, (G, d) for a batch."""
+        z = np.asarray(z, dtype=float)
+        if self.factor.ndim == 3:
+            return self.mean + np.einsum("gij,gj->gi", self.factor, z)
+        return self.mean + z @ self.factor.T
+
+
+def laplace_logistic(X, y, w_map, l2=1.0) -> LaplacePosterior:
+    """Laplace approximation at ``w_map`` for the same model as :func:`fit_logistic_map`.
+
+    Hessian of the negative log-posterior: ``H = Xᵀ diag(p(1-p)) X + l2·I``; cost O(n·d²).
+    """
+    X = np.asarray(X, dtype=float)
+    w_map = np.asarray(w_map, dtype=float)
+    p = sigmoid(X @ w_map)
+    H = (X * (p * (1.0 - p))[:, None]).T @ X + float(l2) * np.eye(X.shape[1])
+    return LaplacePosterior.from_hessian(w_map, H)
+
+
+def fit_logistic_grouped(X, y, groups, n_groups: int, prior_mean, prior_prec=1.0, w0=None, iters: int = 5):
+    """MAP fit of ``n_groups`` logistic regressions at once (one per group, e.g. per country).
+
+    Group ``g`` has prior ``N(prior_mean[g], I / prior_prec)`` (``prior_mean`` is (d,) or (G, d)),
+    so groups with few rows shrink toward the prior mean and groups without rows sit on it.
+    Each Newton/IRLS iteration forms per-group gradients (G, d) and Hessians (G, d, d) in one
+    batched pass and does one batched solve: cost O(rows·d² + G·d³), linear in G. Rows are laid
+    out as a zero-padded (G, m, d) block (m = largest group) so the sums are batched matmuls;
+    if group sizes are too uneven for that, a segmented ``np.add.reduceat`` is used instead.
+
+    Returns ``(W, H)``: weights (G, d) and the Hessian of the negative log-posterior at ``W``.
+    """
+    X = np.asarray(X, dtype=float)
+    y = np.asarray(y, dtype=float)
+    g = np.asarray(groups, dtype=np.int64)
+    G, d = int(n_groups), X.shape[1]
+    mu = np.broadcast_to(np.asarray(prior_mean, dtype=float), (G, d))
+    W = mu.copy() if w0 is None else np.array(w0, dtype=float)
+    tau = float(prior_prec)
+    prior_H = np.broadcast_to(tau * np.eye(d), (G, d, d))
+
+    order = np.argsort(g, kind="stable")
+    g, X, y = g[order], X[order], y[order]
+    counts = np.bincount(g, minlength=G)
+    m = int(counts.max()) if len(g) else 0
+
+    if G * m <= 4 * max(len(g), G):
+        # چیدمان بلوکی (G, m, d) با صفر؛ ردیف‌های خالی وزن صفر دارند
+        pos = np.arange(len(g)) - (np.cumsum(counts) - counts)[g]
+        Xp = np.zeros((G, m, d))
+        Xp[g, pos] = X
+        yp = np.zeros((G, m))
+        yp[g, pos] = y
+        mask = np.zeros((G, m))
+        mask[g, pos] = 1.0
+
+        def probs(W):
+            return sigmoid(np.einsum("gmd,gd->gm", Xp, W))
+
+        def grad_sum(p):
+            return np.einsum("gmd,gm->gd", Xp, (yp - p) * mask)
+
+        def hess_sum(p):
+            return np.matmul((Xp * (p * (1.0 - p) * mask)[:, :, None]).transpose(0, 2, 1), Xp)
+    else:
+        # گروه‌های خیلی نامتوازن: جمع قطعه‌ای روی ردیف‌های مرتب‌شده
+        ids, starts = np.unique(g, return_index=True)
+        outer = (X[:, :, None] * X[:, None, :]).reshape(len(g), d * d)
+
+        def probs(W):
+            return sigmoid(np.einsum("nd,nd->n", X, W[g]))
+
+        def grad_sum(p):
+            out = np.zeros((G, d))
+            out[ids] = np.add.reduceat(X * (y - p)[:, None], starts, axis=0)
+            return out
+
+        def hess_sum(p):
+            out = np.zeros((G, d, d))
+            out[ids] = np.add.reduceat(outer * (p * (1.0 - p))[:, None], starts, axis=0).reshape(-1, d, d)
+            return out
+
+    for _ in range(max(1, int(iters))):
+        p = probs(W)
+        grad = grad_sum(p) - tau * (W - mu)
+        W = W + np.linalg.solve(hess_sum(p) + prior_H, grad[:, :, None])[:, :, 0]
+    H = hess_sum(probs(W)) + prior_H
+    return W, H
+
+
 ACTIONS = ["Patrol (P)", "Signal (S)", "Reinforce (R)"]
 # تعریف «فضای اقدام» (Action Space) با سه اقدام:
 # P: گشت‌زنی، S: سیگنال/مانور، R: تقویت/زور
@@ -142,6 +267,21 @@ class EscalationCoeffs:
     # این هم در کتابچه نیست و برای «مقیاس کردن» ورودی ψ اضافه شده
     # تا دامنه ورودی سیگموید کنترل شود و تنوع خروجی‌ها بیشتر شود.
 
+    # ترتیب بردارهای وزن همان ترتیب ویژگی‌ها در بافرهای برازش بیزی است:
+    # α = [αS(3), αO(3), αT(3), δ(2)] و η = [η1, η2, η3, ηW, η_bias]
+    def alpha_vector(self) -> np.ndarray:
+        return np.concatenate([self.alpha_S, self.alpha_O, self.alpha_T, self.delta])
+
+    def eta_vector(self) -> np.ndarray:
+        return np.array([self.eta1, self.eta2, self.eta3, self.eta_W, self.eta_bias], dtype=float)
+
+    def with_weights(self, w_alpha, w_eta) -> "EscalationCoeffs":
+        """Copy with α / η taken from weight vectors (same order as :meth:`alpha_vector` / :meth:`eta_vector`)."""
+        w_alpha = np.asarray(w_alpha, dtype=float)
+        return replace(self, alpha_S=w_alpha[0:3], alpha_O=w_alpha[3:6], alpha_T=w_alpha[6:9], delta=w_alpha[9:11],
+                       eta1=float(w_eta[0]), eta2=float(w_eta[1]), eta3=float(w_eta[2]),
+                       eta_W=float(w_eta[3]), eta_bias=float(w_eta[4]))
+
 
 @dataclass
 class StateDynamicsCoeffs:
@@ -219,6 +359,28 @@ class ActionBases:
     # γ_e ضریب تیزکننده برای بسیج mobilize در gC.
     # در کتابچه mobilize معمولاً یک سیگموید از (ε - tension) است (نگاشت عملیاتی/صفحه 12).
 
+    # ---------- تعریف اعلانی فضای اقدام (K اقدام) ----------
+    # به جای if روی اندیس اقدام در gC و در موفقیت، هر اقدام با چند «ماسک/ضریب» توصیف می‌شود؛
+    # پس اضافه کردن اقدام جدید (مثلاً تحریم یا عملیات سایبری) فقط یک ردیف داده است.
+
+    codes: tuple = None
+    # کد کوتاه هر اقدام برای ستون‌های خروجی (پیش‌فرض P/S/R).
+
+    labels: tuple = None
+    # نام کامل هر اقدام (پیش‌فرض ACTIONS).
+
+    alloc_mask: tuple = None
+    # 1 اگر اقدام از تخصیص عملیات (λ_op) استفاده می‌کند: پیش‌فرض P و R.
+
+    tempo_mask: tuple = None
+    # 1 اگر اقدام ریتم/تمپو (1/τ) دارد: پیش‌فرض فقط P.
+
+    success_base: tuple = None
+    # احتمال موفقیت پایه هر اقدام (پیش‌فرض P/S: 0.82 ، R: 0.60).
+
+    escalation_penalty: tuple = None
+    # کاهش احتمال موفقیت وقتی کشور درگیر تشدید است (پیش‌فرض فقط R: 0.08).
+
     def __post_init__(self):
         # __post_init__ بعد از ساخته شدن dataclass اجرا می‌شود.
         # کارش: اگر کاربر هیچ مقدار نداده باشد، مقادیر پیش‌فرض منطقی ست کند.
@@ -262,6 +424,214 @@ class ActionBases:
             self.learning_cost = {0: 0.05, 1: 0.07, 2: 0.18}
             # R پیچیدگی/آموزش/هماهنگی بیشتر ⇒ هزینه یادگیری بالاتر.
 
+        K = len(self.sec_gain)
+        for name in ("inf_gain", "cost", "eff_loss", "fail_risk", "learning_cost"):
+            if sorted(getattr(self, name)) != list(range(K)):
+                raise ValueError(f"ActionBases.{name} must have keys 0..{K - 1}")
+
+        default = K == len(ACTIONS)
+        if self.codes is None:
+            self.codes = tuple(ACT_MAP.values()) if default else tuple(f"A{k}" for k in range(K))
+        if self.labels is None:
+            self.labels = tuple(ACTIONS) if default else tuple(self.codes)
+        if self.alloc_mask is None:
+            self.alloc_mask = (1.0, 0.0, 1.0) if default else (1.0,) * K
+        if self.tempo_mask is None:
+            self.tempo_mask = (1.0, 0.0, 0.0) if default else (0.0,) * K
+        if self.success_base is None:
+            self.success_base = (0.82, 0.82, 0.60) if default else (0.82,) * K
+        if self.escalation_penalty is None:
+            self.escalation_penalty = (0.0, 0.0, 0.08) if default else (0.0,) * K
+        for name in ("codes", "labels", "alloc_mask", "tempo_mask", "success_base", "escalation_penalty"):
+            if len(getattr(self, name)) != K:
+                raise ValueError(f"ActionBases.{name} must have {K} entries")
+
+        self.table = np.array([[self.sec_gain[a], self.inf_gain[a], self.cost[a],
+                                self.eff_loss[a], self.fail_risk[a], self.learning_cost[a]]
+                               for a in range(K)], dtype=float)
+        # جدول (K, 6): sec_gain, inf_gain, cost, eff_loss, fail_risk, learning_cost
+        # (از دیکشنری‌ها در زمان ساخت پر می‌شود؛ برای تغییر، ActionBases تازه بسازید).
+        self.alloc = np.asarray(self.alloc_mask, dtype=float)
+        self.tempo = np.asarray(self.tempo_mask, dtype=float)
+        self.success = np.asarray(self.success_base, dtype=float)
+        self.penalty = np.asarray(self.escalation_penalty, dtype=float)
+
+    @property
+    def n_actions(self) -> int:
+        return int(self.table.shape[0])
+
+    @classmethod
+    def from_table(cls, table, codes, labels=None, alloc_mask=None, tempo_mask=None,
+                   success_base=None, escalation_penalty=None, gamma_e: float = 10.0):
+        """Build from a (K, 6) array with columns sec_gain, inf_gain, cost, eff_loss, fail_risk, learning_cost."""
+        table = np.asarray(table, dtype=float)
+        if table.ndim != 2 or table.shape[1] != 6:
+            raise ValueError("table must have shape (K, 6)")
+        cols = [{k: float(v) for k, v in enumerate(table[:, c])} for c in range(6)]
+        return cls(*cols, gamma_e=gamma_e, codes=tuple(codes), labels=None if labels is None else tuple(labels),
+                   alloc_mask=alloc_mask, tempo_mask=tempo_mask, success_base=success_base,
+                   escalation_penalty=escalation_penalty)
+
+    def with_action(self, code: str, bases, label: str = None, alloc: float = 0.0, tempo: float = 0.0,
+                    success: float = 0.82, penalty: float = 0.0):
+        """Copy with one more action appended; ``bases`` = its six table entries (same column order)."""
+        return ActionBases.from_table(
+            np.vstack([self.table, np.asarray(bases, dtype=float)]),
+            codes=self.codes + (code,), labels=self.labels + (label or code,),
+            alloc_mask=tuple(self.alloc) + (float(alloc),), tempo_mask=tuple(self.tempo) + (float(tempo),),
+            success_base=tuple(self.success) + (float(success),),
+            escalation_penalty=tuple(self.penalty) + (float(penalty),), gamma_e=self.gamma_e)
+
+
+# ==========================================================
+# 2b) Doctrine drift rules
+# ==========================================================
+# قوانین «تغییر دکترین بعد از N بار انجام یک اقدام» به شکل جدول:
+# ردیف = اقدام، ستون = پارامتر دکترین. این‌ها قبلاً داخل کد عامل ثابت نوشته شده بودند.
+
+@dataclass
+class DoctrineRules:
+    """Doctrine drift as data: ``deltas[a, p]`` is added to parameter ``params[p]`` when action ``a`` triggers.
+
+    A trigger happens when an agent's count of action ``a`` reaches a multiple of N
+    (``doctrine_update_every``). Only parameters with a non-zero delta are moved, then
+    clipped to ``[lo[p], hi[p]]``.
+    """
+
+    deltas: np.ndarray = None
+    params: tuple = ("rho_c", "d_c", "f_c", "chi_c")
+    lo: tuple = (0.0, 0.0, 0.0, 0.4)
+    hi: tuple = (1.0, 1.0, 1.0, 3.0)
+
+    # پیش‌فرض (همان منطق قبلی):
+    # R → ریسک‌پذیرتر، آستانه زور پایین‌تر، نفوذ نرم کمتر، هزینه‌کرد بیشتر
+    # S → نفوذمحورتر، کمی محتاط‌تر، کمی ریسک‌گریزتر
+    # P → محافظه‌کارتر (آستانه زور بالاتر، ریسک کمتر) با هزینه‌کرد کمی بیشتر
+    DEFAULT = {
+        "P": {"rho_c": -0.02, "f_c": +0.02, "chi_c": +0.01},
+        "S": {"rho_c": -0.01, "d_c": +0.03, "f_c": +0.01},
+        "R": {"rho_c": +0.03, "d_c": -0.01, "f_c": -0.02, "chi_c": +0.03},
+    }
+
+    def __post_init__(self):
+        if self.deltas is None:
+            self.deltas = self.from_dict(self.DEFAULT, tuple(ACT_MAP.values())).deltas
+        self.deltas = np.atleast_2d(np.asarray(self.deltas, dtype=float))
+        self.lo = np.asarray(self.lo, dtype=float)
+        self.hi = np.asarray(self.hi, dtype=float)
+        if self.deltas.shape[1] != len(self.params) or len(self.lo) != len(self.params) or len(self.hi) != len(self.params):
+            raise ValueError("deltas / lo / hi must have one column per doctrine parameter")
+        self.active = self.deltas != 0.0
+
+    @classmethod
+    def from_dict(cls, rules: dict, codes, params=None, lo=None, hi=None):
+        """Rules keyed by action code, e.g. ``{"R": {"rho_c": +0.03}}``; unlisted actions/params don't move."""
+        kw = {}
+        if params is not None: kw["params"] = tuple(params)
+        if lo is not None: kw["lo"] = lo
+        if hi is not None: kw["hi"] = hi
+        params = kw.get("params", cls.params)
+        codes = list(codes)
+        deltas = np.zeros((len(codes), len(params)))
+        for code, row in rules.items():
+            if code not in codes:
+                raise ValueError(f"unknown action code {code!r}")
+            for name, d in row.items():
+                if name not in params:
+                    raise ValueError(f"unknown doctrine parameter {name!r}")
+                deltas[codes.index(code), params.index(name)] = float(d)
+        return cls(deltas=deltas, **kw)
+
+    @classmethod
+    def for_actions(cls, action_bases):
+        """Default rules sized to ``action_bases`` (actions other than P/S/R get no drift)."""
+        return cls.from_dict({c: r for c, r in cls.DEFAULT.items() if c in action_bases.codes}, action_bases.codes)
+
+    @property
+    def n_actions(self) -> int:
+        return int(self.deltas.shape[0])
+
+    def apply(self, arrays, actions, every: int):
+        """Batched update: count ``actions`` (N,), then drift the triggered rows with one masked clip.
+
+        Returns the (N,) trigger mask.
+        """
+        actions = np.asarray(actions, dtype=int)
+        rows = np.arange(arrays.n)
+        arrays.own("action_counts")
+        arrays.action_counts[rows, actions] += 1
+        every = int(every or 0)
+        if every <= 0:
+            return np.zeros(arrays.n, dtype=bool)
+        trig = (arrays.action_counts[rows, actions] % every) == 0
+        if not trig.any():
+            return trig
+        arrays.own(*self.params)
+        cols = [getattr(arrays, p) for p in self.params]
+        P = np.stack(cols, axis=1)
+        mask = trig[:, None] & self.active[actions]
+        P = np.where(mask, np.clip(P + self.deltas[actions], self.lo, self.hi), P)
+        for c, col in enumerate(cols):
+            col[:] = P[:, c]
+        return trig
+
+    def apply_expected(self, arrays, probs, every: int):
+        """Mean-field drift: each action triggers with rate ``probs[:, a] / every`` per step, so the
+        parameters move by ``(probs / every) @ deltas`` (then clipped). Counts are not touched."""
+        every = int(every or 0)
+        if every <= 0:
+            return
+        arrays.own(*self.params)
+        cols = [getattr(arrays, p) for p in self.params]
+        P = np.stack(cols, axis=1)
+        moving = (np.asarray(probs) @ self.active) > 0
+        P = np.where(moving, np.clip(P + (np.asarray(probs) / every) @ self.deltas, self.lo, self.hi), P)
+        for c, col in enumerate(cols):
+            col[:] = P[:, c]
+
+
+_OWN_FIELDS = []
+# ترتیب خانه‌های فهرست _own عامل تنها (یک خانه برای هر _row_field، به ترتیب تعریف)
+
+
+def _row_field(name: str, scalar: bool = True, on_set=None):
+    """Attribute that lives in row ``self._i`` of the shared column ``self._arr.<name>``.
+
+    Scalars read back as Python floats; vectors return a writable view of the row,
+    so in-place updates (``ag.p_ab[0] += 1``) go straight to the shared array. Writes (and vector
+    reads) first take a private copy of a column still shared with a fork (:meth:`AgentArrays.own`).
+    ``on_set`` (a method name) runs after a whole-value assignment, e.g. to refresh caches.
+    An agent not yet bound to arrays keeps the value in its plain ``_own`` list instead.
+    """
+    k = len(_OWN_FIELDS)
+    _OWN_FIELDS.append(name)
+    dtype = int if name == "action_counts" else float
+    if scalar:
+        def fget(self):
+            if self._arr is None:
+                return self._own[k]
+            return getattr(self._arr, name).item(self._i)
+    else:
+        def fget(self):
+            if self._arr is None:
+                return self._own[k]
+            # نمای ردیف ممکن است درجا نوشته شود (ag.p_ab[0] += 1): ستون مشترک با fork اول کپی می‌شود
+            if self._arr._shared:
+                self._arr.own(name)
+            return getattr(self._arr, name)[self._i]
+
+    def fset(self, value):
+        if self._arr is None:
+            self._own[k] = float(value) if scalar else np.array(value, dtype=dtype)
+            return
+        if self._arr._shared:
+            self._arr.own(name)
+        getattr(self._arr, name)[self._i] = value
+        if on_set is not None:
+            getattr(self, on_set)()
+
+    return property(fget, fset, doc=f"row view of AgentArrays.{name}")
+
 
 # ==========================================================
 # 3) Agent (clean separation: income vs operational allocation)
@@ -289,6 +659,33 @@ class HierarchicalAgent:
     # - MNL/Logit choice: کتابچه بخش انتخاب اقدام (معمولاً صفحه 14-15)
     # و همچنین اصلاحات مهندسی‌ای که اضافه کردیم را فهرست می‌کند.
 
+    # نمایش فشرده: خود عامل فقط یک «نما» (view) روی یک ردیف از آرایه‌های مشترک
+    # AgentArrays است (بدون __dict__). عامل تنها تا وقتی جهان آن را با bind به ردیف خودش
+    # وصل کند مقدارها را در یک فهرست ساده (_own) نگه می‌دارد؛ bind آن را دور می‌اندازد.
+    __slots__ = ("name", "action_bases", "dyn", "_arr", "_i", "_own")
+
+    resource = _row_field("resource")
+    v_c = _row_field("v_c")
+    tension = _row_field("tension")
+    rho_c = _row_field("rho_c")
+    d_c = _row_field("d_c")
+    f_c = _row_field("f_c")
+    chi_c = _row_field("chi_c")
+    lambda_op = _row_field("lambda_op")
+    tau_c = _row_field("tau_c")
+    eps_c = _row_field("eps_c")
+    income_c = _row_field("income_c")
+    eta_c = _row_field("eta_c")
+    kappa_c = _row_field("kappa_c")
+    beta_c = _row_field("beta_c")
+    omega_S = _row_field("omega_S", scalar=False)
+    omega_C = _row_field("omega_C", scalar=False)
+    omega_R = _row_field("omega_R", scalar=False)
+    omega_a = _row_field("omega_a", scalar=False)
+    p_ab = _row_field("p_ab", scalar=False, on_set="_refresh_beliefs")
+    r_ab = _row_field("r_ab", scalar=False, on_set="_refresh_beliefs")
+    action_counts = _row_field("action_counts", scalar=False)
+
     def __init__(
             self,
             name: str,
@@ -372,6 +769,11 @@ class HierarchicalAgent:
         self.dyn = dyn_coeffs
         # اتصال ضرایب دینامیک حالت به عامل، تا update_state بتواند از آن استفاده کند.
 
+        self._arr = None
+        self._i = 0
+        self._own = [None] * len(_OWN_FIELDS)
+        # مقدارهای عامل تنها (مثل ویژگی‌های معمولی)؛ MultiAgentWorld عامل را به ردیف مشترک خودش bind می‌کند.
+
         # ---------- state ----------
         self.resource = float(initial_resource)
         # مقدار اولیه منابع کشور (حالت فیزیکی/اقتصادی).
@@ -454,11 +856,28 @@ class HierarchicalAgent:
         # در UI نداده‌ایم، برابر فرض می‌کنیم تا مدل کامل باشد.
 
         # ---- action counters for doctrine update ----
-        self.action_counts = np.zeros(3, dtype=int)
+        self.action_counts = np.zeros(self.action_bases.n_actions, dtype=int)
         # شمارنده تعداد دفعاتی که هر اقدام انجام شده:
         # action_counts[0]=تعداد P ، [1]=تعداد S ، [2]=تعداد R
         # این جزء کتابچه نیست؛ برای نیاز تو اضافه شد تا «هر N بار» دکترین تغییر کند.
 
+    # ---------- shared-array binding ----------
+    def bind(self, arrays, i: int):
+        """Point this agent at row ``i`` of ``arrays`` (no copy; the world owns the data)."""
+        self._arr = arrays
+        self._i = int(i)
+        self._own = None
+        return self
+
+    @classmethod
+    def view(cls, arrays, i: int, action_bases: ActionBases, dyn_coeffs: StateDynamicsCoeffs):
+        """Agent object over an existing row, e.g. to inspect one country of an array-only world."""
+        ag = cls.__new__(cls)
+        ag.name = arrays.names[int(i)]
+        ag.action_bases = action_bases
+        ag.dyn = dyn_coeffs
+        return ag.bind(arrays, i)
+
     # ---------- snapshots (برای "ابتدا→انتها") ----------
     def snapshot(self) -> dict:
         # این تابع یک «عکس لحظه‌ای» از پارامترهای مهم عامل می‌گیرد
@@ -530,32 +949,45 @@ class HierarchicalAgent:
         # خروجی یک dict است که راحت در pandas/streamlit نمایش داده می‌شود.
 
     # ---------- Beta means ----------
-    @staticmethod
-    def _mean_beta(ab):
-        # این تابع میانگین توزیع Beta(α,β) را می‌دهد:
-        # E[x] = α / (α + β)
-        # این دقیقاً در کتابچه در بخش Beta update/پیوست آمده.
+    # میانگین‌های بتا (p_c, r_c) و حاصل‌ضرب p·r در ستون‌های مشترک AgentArrays نگه داشته
+    # می‌شوند و فقط وقتی p_ab/r_ab عوض می‌شود (update_beliefs یا انتساب) دوباره حساب می‌شوند؛
+    # gR و ψ_c دیگر در هر بار خواندن α/(α+β) را حساب نمی‌کنند.
+    def _refresh_beliefs(self):
+        # به‌روزرسانی کش میانگین‌ها برای ردیف همین عامل (بعد از تغییر p_ab یا r_ab).
+        if self._arr is not None:
+            self._arr.refresh_beliefs(self._i)
 
-        a, b = ab
-        # جدا کردن α و β از لیست/تاپل ورودی.
-
-        return float(a / (a + b))
-        # میانگین بتا را به float تبدیل می‌کنیم برای راحتی.
+    @staticmethod
+    def _beta_mean(ab) -> float:
+        # عامل تنها کش ندارد: همان فرمول AgentArrays.refresh_beliefs
+        a, b = ab.tolist()
+        return a / (a + b) if a + b else float("nan")
 
     @property
     def p_c(self) -> float:
         # p_c احتمال موفقیت (mean of Beta) برای کشور.
         # کتابچه: پارامتر موفقیت فنی با بتا مدل می‌شود.
 
-        return self._mean_beta(self.p_ab)
-        # میانگین بتای p از پارامترهای p_ab
+        if self._arr is None:
+            return self._beta_mean(self.p_ab)
+        return self._arr.p_mean.item(self._i)
+        # میانگین بتای p (کش‌شده از p_ab)
 
     @property
     def r_c(self) -> float:
         # r_c قابلیت اطمینان/پایداری (mean of Beta) برای کشور.
 
-        return self._mean_beta(self.r_ab)
-        # میانگین بتای r از پارامترهای r_ab
+        if self._arr is None:
+            return self._beta_mean(self.r_ab)
+        return self._arr.r_mean.item(self._i)
+        # میانگین بتای r (کش‌شده از r_ab)
+
+    @property
+    def pr_c(self) -> float:
+        # p_c · r_c که در fail_risk (gR) استفاده می‌شود.
+        if self._arr is None:
+            return self.p_c * self.r_c
+        return self._arr.pr.item(self._i)
 
     # ---------- feature maps ----------
     def gS(self, a_idx: int) -> np.ndarray:
@@ -568,19 +1000,22 @@ class HierarchicalAgent:
         # gS همان «نگاشت راهبردی» در کتابچه است (کتابچه: صفحه 12).
         # خروجی یک بردار 3تایی است: [امنیت, نفوذ, هزینه]
 
-        sec = self.action_bases.sec_gain[a_idx] * (1.0 - self.tension)
+        base = self.action_bases.table[a_idx]
+        # ردیف اقدام در جدول (K, 6) پایه‌ها.
+
+        sec = base[0] * (1.0 - self.tension)
         # امنیت:
         # - پایه امنیت اقدام از ActionBases گرفته می‌شود.
         # - با (1 - tension) ضرب می‌شود تا اگر تنش بالا بود، «اثر امنیتی واقعی» کمتر حس شود.
         # این ایده از کتابچه می‌آید که تنش (حالت نهفته) روی برداشت امنیت اثر دارد.
 
-        inf = self.action_bases.inf_gain[a_idx] * self.d_c
+        inf = base[1] * self.d_c
         # نفوذ:
         # - پایه نفوذ اقدام از ActionBases گرفته می‌شود.
         # - با d_c (ترجیح بازدارندگی/نفوذ) تعدیل می‌شود:
         #   کشورهایی که d بالاتر دارند از سیگنال/نمایش قدرت نفوذ بیشتری می‌گیرند.
 
-        cst = self.action_bases.cost[a_idx] * (1.0 - self.rho_c)
+        cst = base[2] * (1.0 - self.rho_c)
         # هزینه:
         # - پایه هزینه اقدام
         # - ضرب در (1 - rho): کشور ریسک‌پذیرتر (rho بزرگتر) هزینه را کمتر «احساس» می‌کند.
@@ -592,21 +1027,21 @@ class HierarchicalAgent:
     def gC(self, a_idx: int) -> np.ndarray:
         """
         O = [alloc, tempo, mobilize]
-        - alloc: λ_op * 1[a∈{P,R}]
-        - tempo: (1/τ) * 1[a=P]
+        - alloc: λ_op * alloc_mask[a]   (پیش‌فرض 1[a∈{P,R}])
+        - tempo: (1/τ) * tempo_mask[a]  (پیش‌فرض 1[a=P])
         - mobilize: σ(γ(ε - tension))
         """
         # gC همان «نگاشت عملیاتی/Operational mapping» در کتابچه است (کتابچه: صفحه 12).
         # خروجی یک بردار 3تایی است: [alloc, tempo, mobilize]
 
-        alloc = self.lambda_op * (1.0 if a_idx in (0, 2) else 0.0)
+        alloc = self.lambda_op * self.action_bases.alloc[a_idx]
         # alloc:
         # - اگر اقدام P یا R باشد، تخصیص عملیات فعال می‌شود ⇒ 1
         # - اگر S باشد، تخصیص مستقیم کمتر است ⇒ 0
         # - λ_op شدت آن را تعیین می‌کند.
         # این دقیقاً مطابق فرم 1[ a∈{...} ] در کتابچه است.
 
-        tempo = (1.0 / (self.tau_c + 1e-12)) * (1.0 if a_idx == 0 else 0.0)
+        tempo = (1.0 / (self.tau_c + 1e-12)) * self.action_bases.tempo[a_idx]
         # tempo:
         # - فقط برای P معنا دارد (گشت‌زنی یعنی حضور مستمر/ریتم)
         # - (1/τ) یعنی هرچه τ کوچکتر ⇒ سرعت/ریتم بیشتر.
@@ -633,20 +1068,23 @@ class HierarchicalAgent:
         # gR همان «نگاشت فنی/Technical mapping» در کتابچه است (کتابچه: صفحه 13).
         # خروجی یک بردار 3تایی است: [اتلاف کارایی, ریسک شکست, هزینه یادگیری]
 
-        eff = self.action_bases.eff_loss[a_idx] / (self.eta_c + 1e-12)
+        base = self.action_bases.table[a_idx]
+        # ردیف اقدام در جدول (K, 6) پایه‌ها.
+
+        eff = base[3] / (self.eta_c + 1e-12)
         # eff_loss:
         # - پایه اتلاف اقدام
         # - تقسیم بر η_c: اگر توان فنی بیشتر باشد، اتلاف کمتر می‌شود (منطقی).
         # +1e-12 برای جلوگیری از تقسیم بر صفر.
 
-        fail = self.action_bases.fail_risk[a_idx] * (1.0 - (self.p_c * self.r_c))
+        fail = base[4] * (1.0 - self.pr_c)
         # fail_risk:
         # - پایه ریسک شکست اقدام
         # - ضرب در (1 - p*r)
         # اگر p و r بالا باشند، (p*r) بزرگ می‌شود ⇒ (1 - p*r) کوچک ⇒ ریسک کمتر.
         # این همان ایده کتابچه درباره موفقیت/قابلیت اطمینان است.
 
-        learn = self.action_bases.learning_cost[a_idx] * self.kappa_c
+        learn = base[5] * self.kappa_c
         # learning_cost:
         # - پایه هزینه یادگیری اقدام
         # - ضرب در κ: اگر κ بالاتر باشد، هزینه یادگیری بیشتر حس می‌شود.
@@ -655,25 +1093,37 @@ class HierarchicalAgent:
         # بازگرداندن بردار T
 
     # ---------- utility ----------
+    def feature_maps(self):
+        """gS/gC/gR for all K actions at once → S, O, T each of shape (K, 3)."""
+        ab = self.action_bases
+        tab = ab.table
+        tension = self.tension
+        S = tab[:, 0:3] * np.array([1.0 - tension, self.d_c, 1.0 - self.rho_c])
+        O = np.empty((ab.n_actions, 3), dtype=float)
+        O[:, 0] = self.lambda_op * ab.alloc
+        O[:, 1] = (1.0 / (self.tau_c + 1e-12)) * ab.tempo
+        O[:, 2] = sigmoid(ab.gamma_e * (self.eps_c - tension))
+        T = np.empty((ab.n_actions, 3), dtype=float)
+        T[:, 0] = tab[:, 3] / (self.eta_c + 1e-12)
+        T[:, 1] = tab[:, 4] * (1.0 - self.pr_c)
+        T[:, 2] = tab[:, 5] * self.kappa_c
+        return S, O, T
+
     def utilities(self) -> np.ndarray:
         # این تابع Utility هر اقدام را حساب می‌کند.
         # کتابچه: U = ωS·gS + ωC·gC − ωR·gR (حوالی صفحات 11 تا 13)
 
-        U = np.zeros(3, dtype=float)
-        # یک آرایه طول 3 برای نگه داشتن U(P), U(S), U(R)
-
-        for a in range(3):
-            # روی هر اقدام a=0..2 حلقه می‌زنیم.
+        S, O, T = self.feature_maps()
+        # ویژگی‌های همه K اقدام یک‌جا (هر کدام ماتریس K×3) به جای حلقه روی اقدام‌ها.
 
-            U[a] = (self.omega_S @ self.gS(a)) + (self.omega_C @ self.gC(a)) - (self.omega_R @ self.gR(a))
-            # محاسبه Utility طبق فرم کتابچه:
-            # - ωS·gS: سود/زیان راهبردی
-            # - ωC·gC: سود/زیان عملیاتی
-            # - ωR·gR: ریسک/هزینه فنی با علامت منفی
-            # @ در numpy یعنی ضرب داخلی (dot product)
+        U = (S @ self.omega_S) + (O @ self.omega_C) - (T @ self.omega_R)
+        # محاسبه Utility طبق فرم کتابچه برای همه اقدام‌ها با ضرب ماتریس در بردار:
+        # - ωS·gS: سود/زیان راهبردی
+        # - ωC·gC: سود/زیان عملیاتی
+        # - ωR·gR: ریسک/هزینه فنی با علامت منفی
 
         return U
-        # خروجی: بردار مطلوبیت 3تایی برای استفاده در قانون انتخاب (لاجیت).
+        # خروجی: بردار مطلوبیت K تایی برای استفاده در قانون انتخاب (لاجیت).
 
     # ---------- choice rule ----------
     def choice_probs(self) -> np.ndarray:
@@ -708,8 +1158,8 @@ class HierarchicalAgent:
         probs = self.choice_probs()
         # گرفتن احتمال انتخاب هر اقدام.
 
-        a = int(np.random.choice(3, p=probs))
-        # انتخاب تصادفی وزن‌دار از بین 0..2
+        a = int(np.random.choice(len(probs), p=probs))
+        # انتخاب تصادفی وزن‌دار از بین 0..K-1
         # این همان «bounded rationality» است: همیشه بهترین اقدام را قطعی انتخاب نمی‌کند.
 
         return a, probs
@@ -762,7 +1212,7 @@ class HierarchicalAgent:
         lr = 0.05
         # نرخ یادگیری برای آپدیت ترجیح تاکتیکی (عدد کوچک برای تغییر ملایم).
 
-        target = np.zeros(3, dtype=float)
+        target = np.zeros(len(self.omega_a), dtype=float)
         # بردار هدف که نشان می‌دهد این بار کدام اقدام انجام شده.
 
         target[chosen_a] = 1.0
@@ -796,12 +1246,16 @@ class HierarchicalAgent:
             self.r_ab[0] += 0.3
             # کمی α اضافه می‌کنیم ⇒ r آرام آرام بالا می‌رود (یادگیری مثبت ملایم).
 
+        self._refresh_beliefs()
+        # تغییرات درجا روی p_ab/r_ab از setter نمی‌گذرند؛ کش میانگین‌ها را اینجا تازه می‌کنیم.
+
     # ---------- doctrine update (every N occurrences of an action) ----------
-    def record_action_and_maybe_update_doctrine(self, action_idx: int, doctrine_every: int):
+    def record_action_and_maybe_update_doctrine(self, action_idx: int, doctrine_every: int, rules: DoctrineRules = None):
         """
         doctrine_every:
           - اگر 0 یا None باشد: دکترین ثابت می‌ماند.
           - اگر N باشد: هر بار تعداد کل اجرای یک اقدام (مثلاً R) به مضرب N برسد، دکترین کمی تغییر می‌کند.
+        rules: جدول DoctrineRules (پیش‌فرض: DoctrineRules.for_actions(action_bases)).
         """
         # این تابع جزء کتابچه نیست؛ پاسخ به درخواست توست:
         # «بعد از N بار تکرار یک اقدام (پشت سر هم مهم نیست) دکترین تغییر کند».
@@ -821,51 +1275,18 @@ class HierarchicalAgent:
             # اگر تعداد انجام این اقدام هنوز به مضرب N نرسیده، کاری نمی‌کنیم.
             return
 
-        # منطق تغییر (ملایم و قابل فهم):
+        # منطق تغییر (ملایم و قابل فهم) از جدول قوانین خوانده می‌شود:
         # این قسمت «طراحی رفتاری» است، نه متن مستقیم کتابچه.
         # ولی با روح مدل سازگار است: تکرار رفتار => تغییر دکترین/نگرش.
+        # (مثلاً تکرار R: rho ↑، f ↓، d ↓، chi ↑ — به DoctrineRules.DEFAULT نگاه کن.)
 
-        if action_idx == 2:  # R
-            # اگر اقدام R زیاد انجام شود:
-            # برداشت: کشور «تهاجمی‌تر» می‌شود، ریسک‌پذیرتر می‌شود، و منابع بیشتری برای اعمال قدرت خرج می‌کند.
-
-            self.rho_c = float(np.clip(self.rho_c + 0.03, 0.0, 1.0))
-            # rho ↑ : ریسک‌پذیری کمی بیشتر
+        if rules is None:
+            rules = DoctrineRules.for_actions(self.action_bases)
 
-            self.f_c = float(np.clip(self.f_c - 0.02, 0.0, 1.0))
-            # f ↓ : آستانه استفاده از زور کمی کمتر (راحت‌تر وارد زور می‌شود)
-
-            self.d_c = float(np.clip(self.d_c - 0.01, 0.0, 1.0))
-            # d ↓ : تمرکز روی نفوذ/بازدارندگی نرم کمی کم می‌شود (چون به زور تکیه کرده)
-
-            self.chi_c = float(np.clip(self.chi_c + 0.03, 0.4, 3.0))
-            # chi ↑ : هزینه‌کرد عملیاتی/مصرف منابع بیشتر (رفتار تهاجمی معمولاً پرهزینه‌تر است)
-
-        elif action_idx == 1:  # S
-            # اگر اقدام S زیاد انجام شود:
-            # برداشت: کشور بیشتر دنبال نفوذ/بازدارندگی نرم است.
-
-            self.d_c = float(np.clip(self.d_c + 0.03, 0.0, 1.0))
-            # d ↑ : تمرکز روی نفوذ بیشتر
-
-            self.f_c = float(np.clip(self.f_c + 0.01, 0.0, 1.0))
-            # f ↑ : کمی محتاط‌تر نسبت به زور می‌شود
-
-            self.rho_c = float(np.clip(self.rho_c - 0.01, 0.0, 1.0))
-            # rho ↓ : کمی ریسک‌گریزتر می‌شود (چون مسیرش نرم‌تر/دیپلماتیک‌تر است)
-
-        else:  # P
-            # اگر اقدام P زیاد انجام شود:
-            # برداشت: کشور محافظه‌کارتر می‌شود و به ثبات/حضور مستمر متکی است.
-
-            self.f_c = float(np.clip(self.f_c + 0.02, 0.0, 1.0))
-            # f ↑ : آستانه زور بالاتر ⇒ کمتر زور می‌زند
-
-            self.rho_c = float(np.clip(self.rho_c - 0.02, 0.0, 1.0))
-            # rho ↓ : ریسک‌پذیری کمتر
-
-            self.chi_c = float(np.clip(self.chi_c + 0.01, 0.4, 3.0))
-            # chi کمی ↑ : چون حتی حضور مستمر هم هزینه دارد، ولی افزایش کوچک است.
+        for p in np.nonzero(rules.active[action_idx])[0]:
+            # فقط پارامترهایی که برای این اقدام قانون دارند جابه‌جا و به بازه مجاز محدود می‌شوند.
+            name = rules.params[p]
+            setattr(self, name, float(np.clip(getattr(self, name) + rules.deltas[action_idx, p], rules.lo[p], rules.hi[p])))
 
     # ---------- state dynamics ----------
     def update_state(self, E_U: float, psi: float, chosen_action: int):
@@ -903,7 +1324,7 @@ class HierarchicalAgent:
             # - αr * resource_norm اثر کاهش‌دهنده منابع (منابع بیشتر ⇒ فشار/تنش کمتر)
         )
 
-        base_cost = float(self.action_bases.cost[chosen_action])
+        base_cost = float(self.action_bases.table[chosen_action, 2])
         # هزینه پایه اقدام انتخاب‌شده را می‌گیریم.
         # نکته مهم: اینجا «هزینه واقعاً اقدام انتخاب‌شده» کم می‌شود
         # (نه میانگین مورد انتظار روی همه اقدامات) تا رفتار ملموس‌تر باشد.
@@ -931,6 +1352,664 @@ class HierarchicalAgent:
         # منابع منفی معنا ندارد ⇒ حداقل 0 در نظر می‌گیریم.
 
 
+# ==========================================================
+# 3b) Struct-of-arrays state + sparse interactions (large worlds)
+# ==========================================================
+# برای جهان‌های بزرگ (صدها تا هزاران کشور) حلقه پایتونی روی عامل‌ها و کلیدهای N²
+# دیکشنری قابل‌استفاده نیست. اینجا همان مدل را به شکل «آرایه‌ای» نگه می‌داریم:
+# هر پارامتر/حالت یک آرایه با یک ردیف به ازای هر کشور است.
+
+class RowBuffer:
+    """Fixed-capacity ring buffer of (X, y) rows; ``data()`` returns them oldest-first.
+
+    Each row also carries a group id (the country it belongs to; -1 if not given), read with
+    ``groups()`` for per-country fits.
+    """
+
+    def __init__(self, capacity: int, dim: int):
+        self.capacity = int(max(1, capacity))
+        self.X = np.zeros((self.capacity, int(dim)), dtype=float)
+        self.y = np.zeros(self.capacity, dtype=float)
+        self.g = np.full(self.capacity, -1, dtype=np.int64)
+        self._start = 0
+        self._size = 0
+
+    _shared = False
+    # آرایه‌ها هنوز با یک fork مشترک‌اند؛ اولین append کپی می‌گیرد
+
+    def __len__(self) -> int:
+        return self._size
+
+    def fork(self) -> "RowBuffer":
+        """Copy-on-write copy: the rows are copied by whichever side appends first."""
+        new = RowBuffer.__new__(RowBuffer)
+        new.__dict__.update(self.__dict__)
+        for a in (self.X, self.y, self.g):
+            a.flags.writeable = False
+        self._shared = new._shared = True
+        return new
+
+    def append(self, X, y, g=-1):
+        if self._shared:
+            self.X, self.y, self.g = np.array(self.X), np.array(self.y), np.array(self.g)
+            self._shared = False
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        y = np.atleast_1d(np.asarray(y, dtype=float))
+        m = X.shape[0]
+        g = np.broadcast_to(np.asarray(g, dtype=np.int64), (m,))
+        if m >= self.capacity:
+            # فقط جدیدترین ردیف‌ها نگه داشته می‌شوند
+            self.X[:] = X[-self.capacity:]
+            self.y[:] = y[-self.capacity:]
+            self.g[:] = g[-self.capacity:]
+            self._start, self._size = 0, self.capacity
+            return
+        end = (self._start + self._size) % self.capacity
+        idx = (end + np.arange(m)) % self.capacity
+        self.X[idx] = X
+        self.y[idx] = y
+        self.g[idx] = g
+        overflow = max(0, self._size + m - self.capacity)
+        self._start = (self._start + overflow) % self.capacity
+        self._size = min(self.capacity, self._size + m)
+
+    def data(self):
+        idx = (self._start + np.arange(self._size)) % self.capacity
+        return self.X[idx], self.y[idx]
+
+    def __getstate__(self):
+        # فقط ردیف‌های پر ذخیره می‌شوند (نقطه‌های بازگشت جهان در کش نتایج)
+        state = dict(self.__dict__)
+        idx = (self._start + np.arange(self._size)) % self.capacity
+        state.update(X=self.X[idx], y=self.y[idx], g=self.g[idx], _start=0)
+        state.pop("_shared", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        m, cap = len(self.y), self.capacity
+        self.X = np.concatenate([self.X, np.zeros((cap - m, self.X.shape[1]))])
+        self.y = np.concatenate([self.y, np.zeros(cap - m)])
+        self.g = np.concatenate([self.g, np.full(cap - m, -1, dtype=np.int64)])
+
+    def groups(self) -> np.ndarray:
+        return self.g[(self._start + np.arange(self._size)) % self.capacity]
+
+
+class AgentArrays:
+    """Struct-of-arrays state for N agents (one row per country).
+
+    Scalar fields are (N,) float arrays; vector fields are (N, 3) or (N, K) arrays with
+    the same meaning as the attributes of :class:`HierarchicalAgent`.
+
+    ``p_mean``, ``r_mean`` and ``pr`` (= p·r) are derived (N,) caches of the Beta means; they are
+    rebuilt from ``p_ab``/``r_ab`` on construction and by :meth:`refresh_beliefs`.
+
+    :meth:`fork` makes a copy-on-write copy: columns stay shared (and read-only) until one side
+    calls :meth:`own` before writing them. ``DYNAMIC`` lists the columns every step writes.
+    """
+
+    SCALARS = ("resource", "v_c", "tension", "rho_c", "d_c", "f_c", "chi_c", "lambda_op", "tau_c",
+               "eps_c", "income_c", "eta_c", "kappa_c", "beta_c")
+    VECTORS = ("omega_S", "omega_C", "omega_R", "omega_a", "p_ab", "r_ab", "action_counts")
+    FIELDS = SCALARS + VECTORS
+    UNIT_FIELDS = ("v_c", "rho_c", "d_c", "f_c", "lambda_op", "eps_c")
+    # پارامترهای اسکالر با بازه [0,1] (برای جستجو/برازش/طرح آزمایش روی پارامترها)
+    CACHES = ("p_mean", "r_mean", "pr")
+    DYNAMIC = ("resource", "tension", "omega_a", "p_ab", "r_ab", "action_counts") + CACHES
+    _shared = frozenset()
+    # ستون‌هایی که هنوز با یک fork مشترک‌اند (قبل از نوشتن باید own شوند)
+
+    def __init__(self, names, **columns):
+        self.names = list(names)
+        n = len(self.names)
+        missing = [f for f in self.FIELDS if f not in columns]
+        if missing:
+            raise ValueError(f"missing columns: {missing}")
+        for f in self.SCALARS:
+            col = np.asarray(columns[f], dtype=float).reshape(-1)
+            if col.shape[0] != n:
+                raise ValueError(f"column {f} must have length {n}")
+            setattr(self, f, col.copy())
+        for f in self.VECTORS:
+            dtype = int if f == "action_counts" else float
+            col = np.asarray(columns[f], dtype=dtype)
+            if col.ndim != 2 or col.shape[0] != n:
+                raise ValueError(f"column {f} must be 2D with {n} rows")
+            setattr(self, f, col.copy())
+        self.p_mean = np.zeros(n)
+        self.r_mean = np.zeros(n)
+        self.pr = np.zeros(n)
+        self.refresh_beliefs()
+
+    def refresh_beliefs(self, rows=None):
+        """Recompute the cached Beta means (all rows, or ``rows`` only) after p_ab/r_ab changed.
+
+        E[x] = α / (α + β) for Beta(α, β), as in the booklet's Beta update.
+        """
+        if self._shared:
+            self.own(*self.CACHES)
+        if isinstance(rows, (int, np.integer)):
+            # مسیر تک‌عامل (update_beliefs): حساب اسکالر، بدون سربار عملیات آرایه‌ای
+            pa, pb = self.p_ab[rows].tolist()
+            ra, rb = self.r_ab[rows].tolist()
+            p = pa / (pa + pb) if pa + pb else float("nan")
+            r = ra / (ra + rb) if ra + rb else float("nan")
+            self.p_mean[rows], self.r_mean[rows], self.pr[rows] = p, r, p * r
+            return
+        if rows is None:
+            rows = slice(None)
+        p_ab, r_ab = self.p_ab[rows], self.r_ab[rows]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            # ردیف‌های خالیِ AgentArrays.empty (α=β=0) تا پر شدن NaN می‌مانند
+            self.p_mean[rows] = p_ab[..., 0] / (p_ab[..., 0] + p_ab[..., 1])
+            self.r_mean[rows] = r_ab[..., 0] / (r_ab[..., 0] + r_ab[..., 1])
+        self.pr[rows] = self.p_mean[rows] * self.r_mean[rows]
+
+    @property
+    def n(self) -> int:
+        return len(self.names)
+
+    @property
+    def n_actions(self) -> int:
+        return int(self.omega_a.shape[1])
+
+    def columns(self) -> dict:
+        return {f: getattr(self, f) for f in self.FIELDS}
+
+    @classmethod
+    def empty(cls, names, n_actions: int = 3):
+        """Zero-filled arrays for ``names`` (to be filled column by column)."""
+        n = len(names)
+        cols = {f: np.zeros(n) for f in cls.SCALARS}
+        cols.update({f: np.zeros((n, 3)) for f in ("omega_S", "omega_C", "omega_R")})
+        cols.update(omega_a=np.zeros((n, n_actions)), action_counts=np.zeros((n, n_actions), dtype=int))
+        cols.update(p_ab=np.zeros((n, 2)), r_ab=np.zeros((n, 2)))
+        return cls(names, **cols)
+
+    @classmethod
+    def from_agents(cls, agents):
+        cols = {f: [] for f in cls.FIELDS}
+        for ag in agents:
+            for f in cls.FIELDS:
+                cols[f].append(np.array(getattr(ag, f), dtype=float).copy())
+        return cls([ag.name for ag in agents], **{f: np.array(v) for f, v in cols.items()})
+
+    def bind(self, agents):
+        """Make ``agents`` views onto the rows of these arrays (their own storage is dropped)."""
+        for i, ag in enumerate(agents):
+            ag.bind(self, i)
+        return agents
+
+    def copy(self):
+        return AgentArrays(self.names, **self.columns())
+
+    def fork(self) -> "AgentArrays":
+        """Copy-on-write copy in O(1): both objects share every column until they :meth:`own` it.
+
+        Shared columns are marked read-only, so a write that skips :meth:`own` fails loudly
+        instead of leaking into the other branch.
+        """
+        new = copy.copy(self)
+        new.names = list(self.names)
+        shared = frozenset(self.FIELDS + self.CACHES)
+        for f in shared:
+            getattr(self, f).flags.writeable = False
+        self._shared = new._shared = shared
+        return new
+
+    def own(self, *fields):
+        """Replace the given shared columns (all by default) with private writable copies.
+
+        Call before writing in place; a no-op for columns this object already owns.
+        """
+        todo = self._shared.intersection(fields) if fields else self._shared
+        for f in todo:
+            setattr(self, f, np.array(getattr(self, f)))
+        self._shared = self._shared - todo
+
+    def take(self, idx):
+        """New AgentArrays with rows ``idx`` (gather; used for replication/resampling)."""
+        idx = np.asarray(idx, dtype=int)
+        return AgentArrays([self.names[i] for i in idx], **{f: getattr(self, f)[idx] for f in self.FIELDS})
+
+
+class InteractionGraph:
+    """Directed targeting structure as padded neighbour lists.
+
+    ``neighbors[i, k]`` is the k-th candidate target of i (``-1`` = padding) and ``w_signed[i, k]``
+    the signed relation in [-1, +1] (same meaning as W). Memory is O(N·k) instead of O(N²).
+    """
+
+    def __init__(self, neighbors, w_signed, n: int | None = None):
+        self.neighbors = np.asarray(neighbors, dtype=np.int64)
+        self.w_signed = np.clip(np.asarray(w_signed, dtype=float), -1.0, 1.0)
+        if self.neighbors.shape != self.w_signed.shape or self.neighbors.ndim != 2:
+            raise ValueError("neighbors and w_signed must be 2D arrays of equal shape")
+        self.n = int(n) if n is not None else self.neighbors.shape[0]
+        valid = self.neighbors >= 0
+        w01 = np.where(valid, np.clip((1.0 - self.w_signed) / 2.0, 0.0, 1.0), 0.0)
+        tot = w01.sum(axis=1)
+        self._has_weight = tot > 1e-12
+        n_valid = valid.sum(axis=1)
+        # اگر وزن‌ها صفر بودند: یکنواخت روی همسایه‌ها (مثل fallback نسخه چگال)
+        uniform = valid / np.maximum(n_valid, 1)[:, None]
+        probs = np.where(self._has_weight[:, None], w01 / np.maximum(tot, 1e-300)[:, None], uniform)
+        self.cdf = np.cumsum(probs, axis=1)
+        self._isolated = n_valid == 0
+
+    @classmethod
+    def from_dense(cls, W):
+        W = np.asarray(W, dtype=float)
+        n = W.shape[0]
+        mask = ~np.eye(n, dtype=bool)
+        nbrs = np.tile(np.arange(n), (n, 1))[mask].reshape(n, n - 1)
+        return cls(nbrs, W[mask].reshape(n, n - 1), n=n)
+
+    @property
+    def degree(self) -> int:
+        return int(self.neighbors.shape[1])
+
+    def sample(self, u):
+        """Inverse-CDF target sampling from uniforms ``u`` (N,); returns (targets, w_signed of chosen edge)."""
+        u = np.asarray(u, dtype=float)
+        rows = np.arange(self.neighbors.shape[0])
+        k = np.minimum((self.cdf < u[:, None]).sum(axis=1), self.degree - 1) if self.degree else np.zeros(len(u), int)
+        tgt = self.neighbors[rows, k] if self.degree else -np.ones(len(u), dtype=np.int64)
+        w = self.w_signed[rows, k] if self.degree else np.zeros(len(u))
+        if self._isolated.any():
+            # کشور بدون همسایه: هدف یکنواخت از بقیه کشورها، رابطه خنثی
+            iso = np.nonzero(self._isolated)[0]
+            j = np.minimum((u[iso] * (self.n - 1)).astype(np.int64), self.n - 2)
+            tgt[iso] = j + (j >= iso)
+            w[iso] = 0.0
+        return tgt, w
+
+    def target_probs(self) -> np.ndarray:
+        """(N, k) probability of targeting each neighbour slot (0 on padding; isolated rows are all 0)."""
+        P = np.diff(self.cdf, axis=1, prepend=0.0)
+        P[self._isolated] = 0.0
+        return P
+
+    @property
+    def isolated(self) -> np.ndarray:
+        return np.nonzero(self._isolated)[0]
+
+    def pair_weights(self, src, dst) -> np.ndarray:
+        """Signed relation of the ordered pairs ``(src[k], dst[k])``; 0 (neutral) for non-neighbours."""
+        src, dst = np.asarray(src, dtype=np.int64), np.asarray(dst, dtype=np.int64)
+        hit = self.neighbors[src] == dst[:, None]
+        return np.where(hit.any(axis=1), self.w_signed[src, hit.argmax(axis=1)], 0.0)
+
+    def replicate(self, copies: int) -> "InteractionGraph":
+        """Block-diagonal graph of ``copies`` disconnected copies (rows ``c·n … c·n + n − 1``).
+
+        Isolated countries get explicit neutral edges to the rest of their own copy, so targets
+        never cross copies (same distribution as :meth:`sample`'s uniform fallback).
+        """
+        nbrs, w = self.neighbors, self.w_signed
+        if self._isolated.any():
+            width = max(self.degree, self.n - 1)
+            nbrs = np.pad(nbrs, ((0, 0), (0, width - self.degree)), constant_values=-1)
+            w = np.pad(w, ((0, 0), (0, width - self.degree)))
+            for i in self.isolated:
+                nbrs[i, :self.n - 1] = np.delete(np.arange(self.n), i)
+                w[i] = 0.0
+        offset = (np.arange(int(copies)) * self.n)[:, None, None]
+        big = np.where(nbrs[None] >= 0, nbrs[None] + offset, -1).reshape(-1, nbrs.shape[1])
+        return InteractionGraph(big, np.tile(w, (int(copies), 1)), n=self.n * int(copies))
+
+    def to_dense(self) -> np.ndarray:
+        W = np.zeros((self.n, self.n), dtype=float)
+        r, k = np.nonzero(self.neighbors >= 0)
+        W[r, self.neighbors[r, k]] = self.w_signed[r, k]
+        return W
+
+
+def batch_feature_maps(arr: AgentArrays, action_bases: ActionBases):
+    """gS/gC/gR for every agent and action at once → S, O, T each of shape (N, K, 3).
+
+    Action semantics come only from ``action_bases`` (the (K, 6) table and the operational
+    masks), so the same code serves any K.
+    """
+    tab = action_bases.table
+    S = tab[None, :, 0:3] * np.stack([1.0 - arr.tension, arr.d_c, 1.0 - arr.rho_c], axis=1)[:, None, :]
+    mobilize = sigmoid(action_bases.gamma_e * (arr.eps_c - arr.tension))
+    O = np.stack(np.broadcast_arrays(
+        arr.lambda_op[:, None] * action_bases.alloc[None, :],
+        (1.0 / (arr.tau_c + 1e-12))[:, None] * action_bases.tempo[None, :],
+        mobilize[:, None],
+    ), axis=-1)
+    T = tab[None, :, 3:6] * np.stack([1.0 / (arr.eta_c + 1e-12), 1.0 - arr.pr, arr.kappa_c], axis=1)[:, None, :]
+    return S, O, T
+
+
+def batch_utilities(arr: AgentArrays, action_bases: ActionBases):
+    """U (N, K) as one batched matrix product of the stacked features [S, O, −T] with [ωS, ωC, ωR].
+
+    Returns ``(U, S, O, T)`` so callers can reuse the feature maps (ψ_c, Bayes features).
+    """
+    S, O, T = batch_feature_maps(arr, action_bases)
+    F = np.concatenate([S, O, -T], axis=2)  # (N, K, 9)
+    w = np.concatenate([arr.omega_S, arr.omega_C, arr.omega_R], axis=1)  # (N, 9)
+    U = np.matmul(F, w[:, :, None])[:, :, 0]
+    return U, S, O, T
+
+
+def batch_choice_probs(arr: AgentArrays, action_bases: ActionBases) -> np.ndarray:
+    """Logit choice probabilities (N, K) of the current state, ``softmax(β_c U + ω_a)``."""
+    U = batch_utilities(arr, action_bases)[0]
+    logits = arr.beta_c[:, None] * U + arr.omega_a
+    ex = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return ex / (ex.sum(axis=1, keepdims=True) + 1e-12)
+
+
+def sample_categorical(probs, u) -> np.ndarray:
+    """Row-wise inverse-CDF sampling: probs (N, K), u (N,) → indices (N,)."""
+    cdf = np.cumsum(probs, axis=1)
+    return np.minimum((cdf < (u * cdf[:, -1])[:, None]).sum(axis=1), probs.shape[1] - 1)
+
+
+class RandomStreams:
+    """Named uniform streams, one per kind of decision, for common random numbers (CRN).
+
+    Every decision type (action choice, target, escalation draw, success draw, Bayes
+    subsample) reads its own generator derived from ``(seed, name)``, so two configurations run
+    with the same seed consume aligned randomness per decision even if one of them draws more
+    numbers elsewhere. ``antithetic=True`` returns ``1 - u`` for every uniform: run the pair
+    (seed, False) / (seed, True) to get negatively correlated replicas.
+
+    ``tile=C`` serves a batched world of C equal-sized blocks: each draw of n numbers is n / C
+    fresh numbers repeated C times, so every block sees the same randomness (CRN across blocks).
+    """
+
+    tile = 1
+
+    def __init__(self, seed=None, antithetic: bool = False, tile: int = 1):
+        self._root = np.random.SeedSequence(seed)
+        self.antithetic = bool(antithetic)
+        self.tile = int(tile)
+        self._gens = {}
+
+    @property
+    def entropy(self):
+        return self._root.entropy
+
+    def generator(self, name: str) -> np.random.Generator:
+        gen = self._gens.get(name)
+        if gen is None:
+            key = zlib.crc32(name.encode("utf-8"))
+            gen = np.random.default_rng(np.random.SeedSequence(self._root.entropy, spawn_key=(key,)))
+            self._gens[name] = gen
+        return gen
+
+    def uniform(self, name: str, n: int) -> np.ndarray:
+        u = np.tile(self.generator(name).random(int(n) // self.tile), self.tile)
+        return 1.0 - u if self.antithetic else u
+
+    def normal(self, name: str, size) -> np.ndarray:
+        if self.tile > 1 and np.ndim(size) == 0:
+            z = np.tile(self.generator(name).standard_normal(int(size) // self.tile), self.tile)
+        else:
+            z = self.generator(name).standard_normal(size)
+        return -z if self.antithetic else z
+
+
+@dataclass(frozen=True)
+class RecordingSpec:
+    """What a world writes per step, and how often.
+
+    ``level``:
+
+    - ``"none"``: nothing (the state still evolves; use for batched/internal worlds);
+    - ``"summary"``: :class:`SummaryRecorder` rows only (population means, counts, shares);
+    - ``"agent"``: summary + one ``history`` row per step with ``Time``, ``Global_Escalation``
+      and the per-country series (``AGENT_SERIES``);
+    - ``"full"``: agent + the dyadic series (``DYAD_SERIES``), from which
+      :meth:`MultiAgentWorld.history_tensors` builds (T, N, N) tensors on demand. Only the loop
+      engine produces dyadic series; the other engines record ``"full"`` like ``"agent"``.
+
+    ``stride=k`` records only steps with ``t % k == 0``. ``series`` keeps only the listed
+    per-country/dyadic families (e.g. ``("Tension", "Resource")``) in ``history`` and the
+    tensors; ``Time`` and ``Global_Escalation`` are always kept.
+    """
+
+    LEVELS = ("none", "summary", "agent", "full")
+    AGENT_SERIES = ("Action", "Target", "Tension", "Resource", "Psi", "ActionProb")
+    DYAD_SERIES = ("DyadTension", "PsiEdge", "Y", "CrisisProb", "Crisis")
+    CELL_BYTES = 104
+    # هزینه اندازه‌گیری‌شده هر خانه history (ورودی dict + کلید رشته‌ای تازه + شیء float پایتون)
+    SUMMARY_CELL_BYTES = 32
+    # هر خانه summary: اشاره‌گر فهرست + شیء float
+    level: str = "full"
+    stride: int = 1
+    series: tuple = None
+
+    def __post_init__(self):
+        if self.level not in self.LEVELS:
+            raise ValueError(f"level must be one of {self.LEVELS}")
+        if int(self.stride) < 1:
+            raise ValueError("stride must be >= 1")
+        if self.series is not None:
+            unknown = set(self.series) - set(self.AGENT_SERIES + self.DYAD_SERIES)
+            if unknown:
+                raise ValueError(f"unknown series {sorted(unknown)}")
+            object.__setattr__(self, "series", tuple(self.series))
+
+    def records(self, t: int) -> bool:
+        """Is step ``t`` recorded at all?"""
+        return self.level != "none" and int(t) % int(self.stride) == 0
+
+    def keeps(self, family: str) -> bool:
+        """Is the per-country/dyadic series ``family`` part of the history rows?"""
+        if family in self.DYAD_SERIES:
+            ok = self.level == "full"
+        else:
+            ok = self.level in ("agent", "full")
+        return ok and (self.series is None or family in self.series)
+
+    @property
+    def rows(self) -> bool:
+        return self.level in ("agent", "full")
+
+    @property
+    def dyadic(self) -> bool:
+        return any(self.keeps(f) for f in self.DYAD_SERIES)
+
+    def filter(self, row: dict) -> dict:
+        # حذف ستون‌های خانواده‌های انتخاب‌نشده (خانواده = پیشوند تا اولین "_")
+        if self.series is None and self.level == "full":
+            return row
+        return {k: v for k, v in row.items()
+                if k in ("Time", "Global_Escalation") or self.keeps(k.split("_", 1)[0])}
+
+    def estimate(self, n: int, steps: int, engine: str = "loop", n_actions: int = 3, n_blocs: int = 0) -> dict:
+        """Approximate bytes the recorded output of ``steps`` steps of an ``n``-country world will take.
+
+        Counts the cells every engine writes per recorded step: history row (``CELL_BYTES`` each)
+        and summary columns (``SUMMARY_CELL_BYTES``). Returns ``{"rows", "history", "summary", "total"}``.
+        """
+        n, K = int(n), int(n_actions)
+        rows = 0 if self.level == "none" else len(range(0, int(steps), int(self.stride)))
+        width = {"Action": n, "Target": n, "Tension": n, "Resource": n, "Psi": n, "ActionProb": K * n,
+                 "DyadTension": n * (n - 1), "PsiEdge": n, "Y": n, "CrisisProb": n * n, "Crisis": n * n}
+        if engine == "mean_field":
+            families = ("Tension", "Resource", "Psi", "ActionProb")
+        elif engine == "loop":
+            families = ("Action", "Target", "Tension", "Resource", "Psi") + self.DYAD_SERIES
+        else:
+            families = ("Action", "Target", "Tension", "Resource", "Psi")
+        cells = (2 + sum(width[f] for f in families if self.keeps(f))) if self.rows else 0
+        out = dict(rows=rows, history=rows * cells * self.CELL_BYTES,
+                   summary=rows * (10 + K + 2 * int(n_blocs)) * self.SUMMARY_CELL_BYTES)
+        out["total"] = out["history"] + out["summary"]
+        return out
+
+
+class SummaryRecorder:
+    """Bounded per-step output for large worlds: population means, escalation counts, action shares.
+
+    With ``bloc_labels`` the mean tension and escalation count are also kept per bloc.
+    Memory is O(steps · (K + blocs)), independent of N. With a ``sink`` (see
+    :meth:`MultiAgentWorld.stream_output`) every row is also appended to it and only the last
+    ``keep`` rows stay in ``rows``.
+    """
+
+    sink = None
+    keep = 0
+    # مقصد اختیاری ردیف‌ها (ChunkedHistoryWriter) و تعداد ردیف‌هایی که در حافظه می‌مانند
+
+    def __init__(self, n_actions: int = 3, bloc_labels=None, action_codes=None):
+        self.n_actions = int(n_actions)
+        self.action_codes = tuple(action_codes) if action_codes is not None else tuple(
+            ACT_MAP.get(k, f"A{k}") for k in range(self.n_actions))
+        self.bloc_labels = None if bloc_labels is None else np.asarray(bloc_labels, dtype=int)
+        self.n_blocs = 0 if self.bloc_labels is None else int(self.bloc_labels.max()) + 1
+        self.rows = {}
+
+    def _put(self, key, value):
+        self.rows.setdefault(key, []).append(value)
+
+    def _put_rb(self, psi_edge):
+        # برآوردگر Rao-Blackwell: امید شرطی تعداد/وقوع تشدید به شرط ψ_ij همین گام
+        psi_edge = np.clip(np.asarray(psi_edge, dtype=float), 0.0, 1.0)
+        self._put("Escalations_RB", float(psi_edge.sum()))
+        self._put("Escalation_Rate_RB", float(psi_edge.mean()) if psi_edge.size else 0.0)
+        self._put("Global_Escalation_RB", float(-np.expm1(np.log1p(-np.minimum(psi_edge, 1.0 - 1e-15)).sum())))
+
+    def record(self, t, arr: AgentArrays, actions, psi, y, psi_edge=None):
+        """Sampled step. ``psi_edge`` (ψ_ij of the chosen edges) adds the Rao-Blackwellized
+        ``*_RB`` columns: same targets as ``Escalations`` / ``Global_Escalation`` but with the
+        Bernoulli draw integrated out."""
+        n = arr.n
+        esc = int(np.count_nonzero(y))
+        self._put("Time", int(t))
+        self._put("Mean_Tension", float(arr.tension.mean()))
+        self._put("Mean_Resource", float(arr.resource.mean()))
+        self._put("Mean_Psi", float(np.mean(psi)))
+        self._put("Escalations", esc)
+        self._put("Escalation_Rate", esc / max(1, n))
+        self._put("Global_Escalation", int(esc > 0))
+        shares = np.bincount(actions, minlength=self.n_actions) / max(1, n)
+        for k in range(self.n_actions):
+            self._put(f"Share_{self.action_codes[k]}", float(shares[k]))
+        if self.n_blocs:
+            cnt = np.bincount(self.bloc_labels, minlength=self.n_blocs)
+            ten = np.bincount(self.bloc_labels, weights=arr.tension, minlength=self.n_blocs) / np.maximum(cnt, 1)
+            eb = np.bincount(self.bloc_labels, weights=np.asarray(y, dtype=float), minlength=self.n_blocs)
+            for g in range(self.n_blocs):
+                self._put(f"Tension_Bloc{g + 1}", float(ten[g]))
+                self._put(f"Escalations_Bloc{g + 1}", int(eb[g]))
+        if psi_edge is not None:
+            self._put_rb(psi_edge)
+        self._emit()
+
+    def record_expected(self, t, arr: AgentArrays, probs, psi, y_prob):
+        """Mean-field counterpart of :meth:`record`: action probabilities (N, K) and per-country
+        escalation probabilities (N,) instead of sampled actions / outcomes."""
+        n = arr.n
+        y_prob = np.asarray(y_prob, dtype=float)
+        esc = float(y_prob.sum())
+        self._put("Time", int(t))
+        self._put("Mean_Tension", float(arr.tension.mean()))
+        self._put("Mean_Resource", float(arr.resource.mean()))
+        self._put("Mean_Psi", float(np.mean(psi)))
+        self._put("Escalations", esc)
+        self._put("Escalation_Rate", esc / max(1, n))
+        self._put("Global_Escalation", float(-np.expm1(np.log1p(-np.clip(y_prob, 0.0, 1.0 - 1e-15)).sum())))
+        shares = np.asarray(probs).mean(axis=0)
+        for k in range(self.n_actions):
+            self._put(f"Share_{self.action_codes[k]}", float(shares[k]))
+        if self.n_blocs:
+            cnt = np.bincount(self.bloc_labels, minlength=self.n_blocs)
+            ten = np.bincount(self.bloc_labels, weights=arr.tension, minlength=self.n_blocs) / np.maximum(cnt, 1)
+            eb = np.bincount(self.bloc_labels, weights=y_prob, minlength=self.n_blocs)
+            for g in range(self.n_blocs):
+                self._put(f"Tension_Bloc{g + 1}", float(ten[g]))
+                self._put(f"Escalations_Bloc{g + 1}", float(eb[g]))
+        self._put_rb(y_prob)
+        self._emit()
+
+    def _emit(self):
+        # ردیف کامل آخر به sink؛ حافظه هر وقت دو برابر keep شد به keep ردیف آخر کوتاه می‌شود
+        if self.sink is None:
+            return
+        self.sink.append({k: v[-1] for k, v in self.rows.items()})
+        extra = len(self.rows["Time"]) - self.keep
+        if extra > self.keep:
+            for v in self.rows.values():
+                del v[:extra]
+
+    def to_frame(self):
+        import pandas as pd
+        return pd.DataFrame(self.rows)
+
+
+class SteadyStateDetector:
+    """Flags approximate stationarity of the state and the choice distributions.
+
+    Every step contributes a signature in [0, 1]: tension, ``resource / (resource + 1000)`` and
+    the choice probabilities of each country (or their population means when ``per_country`` is
+    False). The world is stationary once the means over the last two windows of ``window``
+    steps differ by at most ``tol`` in every component, and stops being stationary when the
+    difference exceeds ``2·tol`` (hysteresis against sampling noise). For sampled engines
+    ``tol`` must sit above the noise of window means (≈ 0.02 for 20-step windows on the bundled
+    scenarios); the mean-field engine converges cleanly. Transitions are logged in ``events``.
+
+    Every ``window`` steps the belief and action counters are marked, so :meth:`MultiAgentWorld.fast_forward`
+    can advance them at the observed per-step rate.
+    """
+
+    COUNTERS = ("p_ab", "r_ab", "action_counts")
+
+    def __init__(self, tol: float = 0.03, window: int = 20, per_country: bool = True):
+        self.tol = float(tol)
+        self.window = int(window)
+        self.per_country = bool(per_country)
+        self._sig = deque(maxlen=2 * self.window)
+        self._marks = deque(maxlen=3)
+        self._seen = 0
+        self.steady = False
+        self.drift = np.inf
+        self.events = []
+
+    def signature(self, arr: AgentArrays, probs) -> np.ndarray:
+        cols = [arr.tension, arr.resource / (arr.resource + 1000.0)]
+        probs = np.asarray(probs, dtype=float)
+        if self.per_country:
+            return np.concatenate(cols + [probs.ravel()])
+        return np.concatenate([[c.mean() for c in cols], probs.mean(axis=0)])
+
+    def observe(self, t: int, arr: AgentArrays, probs) -> bool:
+        """Add step ``t`` (after its state update); returns whether the state is stationary."""
+        self._sig.append(self.signature(arr, probs))
+        self._seen += 1
+        if self._seen % self.window == 1 or self.window == 1:
+            self._marks.append((int(t), {f: getattr(arr, f).copy() for f in self.COUNTERS}))
+        if len(self._sig) < 2 * self.window:
+            return self.steady
+        S = np.asarray(self._sig)
+        self.drift = float(np.max(np.abs(S[self.window:].mean(axis=0) - S[:self.window].mean(axis=0))))
+        if not self.steady and self.drift <= self.tol:
+            self.steady = True
+            self.events.append({"Time": int(t), "event": "steady", "drift": self.drift, "steps": 0})
+        elif self.steady and self.drift > 2.0 * self.tol:
+            self.steady = False
+            self.events.append({"Time": int(t), "event": "unsteady", "drift": self.drift, "steps": 0})
+        return self.steady
+
+    def rates(self, t: int, arr: AgentArrays) -> dict:
+        """Per-step increments of the counters since the oldest mark (zeros if none is older than ``t``)."""
+        t0, mark = self._marks[0] if self._marks else (t, None)
+        if mark is None or t <= t0:
+            return {f: np.zeros_like(getattr(arr, f), dtype=float) for f in self.COUNTERS}
+        return {f: (getattr(arr, f) - mark[f]) / float(t - t0) for f in self.COUNTERS}
+
+    def to_frame(self):
+        import pandas as pd
+        return pd.DataFrame(self.events, columns=["Time", "event", "drift", "steps"])
+
+
 # ==========================================================
 # 4) World with directed targeting (solves "who acts against whom")
 # ==========================================================
@@ -938,6 +2017,115 @@ class HierarchicalAgent:
 # بخش کلیدی که مشکل تو را حل می‌کند: هر کشور علاوه بر Action، یک Target هم دارد.
 # بنابراین تعامل «علیه چه کسی» مشخص می‌شود (کتابچه: تعاملات بین کشورها / ψ_ij / صفحه 17).
 
+_FIT_EXECUTOR = None
+
+
+def _fit_executor():
+    """Shared background pool for asynchronous coefficient fits (created on first use)."""
+    global _FIT_EXECUTOR
+    if _FIT_EXECUTOR is None:
+        _FIT_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="esc-fit")
+        atexit.register(_FIT_EXECUTOR.shutdown, wait=False, cancel_futures=True)
+    return _FIT_EXECUTOR
+
+
+def _copied_future(fut: Future) -> Future:
+    """A future that resolves to a deep copy of ``fut``'s result, without waiting for it."""
+    out = Future()
+
+    def _copy(src):
+        try:
+            out.set_result(copy.deepcopy(src.result()))
+        except BaseException as exc:
+            out.set_exception(exc)
+
+    fut.add_done_callback(_copy)
+    return out
+
+
+def fit_escalation_coeffs(Xc, yc, Xe, ye, w0_alpha, w0_eta, l2=0.8, laplace=False, hierarchy=None,
+                          solver: str = "gd") -> dict:
+    """MAP fit of α (country windows) and η (edge windows); pure, so it can run in any worker.
+
+    Returns ``{"alpha", "eta"}`` and, with ``laplace=True``, their :class:`LaplacePosterior` as
+    ``"alpha_posterior"`` / ``"eta_posterior"``.
+
+    ``hierarchy`` (dict with ``groups_c``, ``groups_e``, ``n_groups``, ``alpha_c``, ``eta_c``,
+    ``shrinkage``) adds per-country α and per-source η (``"alpha_c"`` / ``"eta_c"``, (N, d)):
+    one batched Newton fit per coefficient block with prior ``N(pooled MAP, I / shrinkage)``,
+    warm-started from the current per-country values.
+
+    ``solver="gd"`` is the original fixed-budget gradient ascent (moves a bounded distance per
+    update); ``"newton"`` solves for the MAP exactly (single-group :func:`fit_logistic_grouped`).
+    """
+    if solver == "newton":
+        def fit(X, y, w0):
+            return fit_logistic_grouped(X, y, np.zeros(len(y), dtype=np.int64), 1, np.zeros(X.shape[1]), l2,
+                                        w0=np.asarray(w0, dtype=float)[None], iters=8)[0][0]
+    else:
+        def fit(X, y, w0):
+            return fit_logistic_map(X, y, w0=w0, l2=l2, lr=0.25, iters=160)
+    w_alpha = fit(Xc, yc, w0_alpha)
+    w_eta = fit(Xe, ye, w0_eta)
+    out = {"alpha": w_alpha, "eta": w_eta}
+    if laplace:
+        out["alpha_posterior"] = laplace_logistic(Xc, yc, w_alpha, l2=l2)
+        out["eta_posterior"] = laplace_logistic(Xe, ye, w_eta, l2=l2)
+    if hierarchy is not None:
+        G, tau = hierarchy["n_groups"], hierarchy["shrinkage"]
+        A, Ha = fit_logistic_grouped(Xc, yc, hierarchy["groups_c"], G, w_alpha, tau, w0=hierarchy["alpha_c"])
+        E, He = fit_logistic_grouped(Xe, ye, hierarchy["groups_e"], G, w_eta, tau, w0=hierarchy["eta_c"])
+        out["alpha_c"], out["eta_c"] = A, E
+        if laplace:
+            out["alpha_c_posterior"] = LaplacePosterior.from_hessian(A, Ha)
+            out["eta_c_posterior"] = LaplacePosterior.from_hessian(E, He)
+    return out
+
+
+class PooledBayesStore:
+    """One Bayesian window shared by an ensemble of replicas (same countries, different random paths).
+
+    Attached worlds append their α/η rows to the shared buffers and skip their own fits; the
+    driver calls :meth:`update` once per update step, which fits on the pooled rows of all
+    replicas and installs the result in every replica (in Laplace mode each replica still takes
+    its own posterior draw). Rows from replicas run elsewhere (other processes) are merged
+    with :meth:`absorb`. The pooled fit uses the exact Newton MAP by default, so the larger
+    window translates into coefficients that settle within the first few updates.
+    """
+
+    def __init__(self, window: int = 2000, min_samples: int = 200, n_replicas: int = 1, solver: str = "newton"):
+        cap = int(window) * max(1, int(n_replicas))
+        self.country_buf = RowBuffer(cap, 11)
+        self.edge_buf = RowBuffer(cap, 5)
+        self.min_samples = int(min_samples)
+        self.solver = solver
+        self.n_fits = 0
+
+    def attach(self, world):
+        world.bayes_pooled = True
+        world._country_buf, world._edge_buf = self.country_buf, self.edge_buf
+
+    def absorb(self, world):
+        """Append the rows a replica collected in its own buffers since they were last emptied."""
+        for src, dst in ((world._country_buf, self.country_buf), (world._edge_buf, self.edge_buf)):
+            if src is not dst and len(src):
+                X, y = src.data()
+                dst.append(X, y, src.groups())
+
+    def ready(self) -> bool:
+        return len(self.country_buf) >= self.min_samples and len(self.edge_buf) >= self.min_samples
+
+    def update(self, worlds) -> bool:
+        """One pooled fit, installed in every replica; False if there are not enough rows yet."""
+        if not worlds or not self.ready():
+            return False
+        fit = fit_escalation_coeffs(*worlds[0]._fit_args(self.country_buf, self.edge_buf), solver=self.solver)
+        for w in worlds:
+            w._apply_escalation_fit(fit)
+        self.n_fits += 1
+        return True
+
+
 class MultiAgentWorld:
     """
     - هر کشور در هر گام: (action, target) انتخاب می‌کند.
@@ -949,45 +2137,162 @@ class MultiAgentWorld:
     # نسخه ساده: فقط تعداد R ها را می‌شمردیم ⇒ تعامل واقعی i و j نداشت.
     # این نسخه: هدف‌گیری جهت‌دار + ψ_ij فقط روی همان یال‌های انتخاب‌شده اعمال می‌شود.
 
-    def __init__(self, agents, interaction_W=None, esc_coeffs=None, doctrine_update_every: int = 0,
-                 bayes_update_every: int = 10, bayes_window: int = 2000, bayes_min_samples: int = 200):
+    ENGINES = ("loop", "vectorized", "mean_field")
+    MEAN_FIELD_PER_COUNTRY_MAX = 50
+    # در حالت mean_field تا این تعداد کشور، ستون‌های هر کشور هم در history ثبت می‌شود.
+    STEADY_PER_COUNTRY_MAX = 50
+    # تا این تعداد کشور، تشخیص حالت پایا روی مقادیر هر کشور است؛ بیشتر از آن روی میانگین جمعیت
+    BAYES_POSTERIORS = ("map", "laplace")
+    BAYES_ASYNC = ("off", "deterministic", "eager")
+    BAYES_HIERARCHIES = ("pooled", "country")
+    BAYES_L2 = 0.8
+    # شدت پیشین نرمال (1/σ²) در برازش α و η
+
+    def __init__(self, agents=None, interaction_W=None, esc_coeffs=None, doctrine_update_every: int = 0,
+                 bayes_update_every: int = 10, bayes_window: int = 2000, bayes_min_samples: int = 200,
+                 engine: str = "loop", arrays: AgentArrays = None, interaction: InteractionGraph = None,
+                 action_bases: ActionBases = None, dyn_coeffs: StateDynamicsCoeffs = None,
+                 seed=None, bloc_labels=None, doctrine_rules: DoctrineRules = None, antithetic: bool = False,
+                 bayes_posterior: str = "map", posterior_draws: str = "update",
+                 bayes_async: str = "off", bayes_staleness: int = 5, bayes_executor=None,
+                 bayes_hierarchy: str = "pooled", bayes_shrinkage: float = 10.0,
+                 bayes_store: PooledBayesStore = None, steady_tol: float = 0.0, steady_window: int = 20,
+                 recording: RecordingSpec = None):
         # سازنده جهان:
         # - agents: لیست کشورها
         # - interaction_W: ماتریس وزن تعامل W_ij
         # - esc_coeffs: ضرایب فرمول‌های ψ
         # - doctrine_update_every: هر N بار تکرار اقدام، دکترین تغییر کند
-
-        self.agents = list(agents)
+        # - doctrine_rules: جدول قوانین تغییر دکترین (DoctrineRules؛ پیش‌فرض همان قوانین قبلی)
+        # - engine: "loop" (نسخه اصلی، حلقه روی عامل‌ها) یا "vectorized" (آرایه‌ای، برای جهان بزرگ)
+        #   یا "mean_field" (انتشار قطعی امید ریاضی؛ تقریب میانگین Monte Carlo با هزینه یک اجرا)
+        # - arrays/interaction: ساخت مستقیم جهان بزرگ بدون اشیاء عامل (به from_arrays نگاه کن)
+        # - bayes_posterior: "map" (ضرایب α/η = تخمین نقطه‌ای MAP) یا "laplace" (نمونه از تقریب
+        #   لاپلاس پسین)؛ posterior_draws: "update" (نمونه تازه در هر به‌روزرسانی) یا "replica"
+        #   (یک چندک ثابت از پسین برای کل این اجرا)
+        # - bayes_async: "off" (برازش درون گام)، "deterministic" یا "eager" (برازش در پس‌زمینه و
+        #   اعمال حداکثر bayes_staleness گام بعد؛ deterministic دقیقاً همان گام، برای تکرارپذیری)؛
+        #   bayes_executor: Executor دلخواه (مثلاً ProcessPoolExecutor)، پیش‌فرض یک thread pool مشترک
+        # - bayes_hierarchy: "pooled" (یک α/η برای همه) یا "country" (α هر کشور و η هر کشور مبدأ،
+        #   با پیشین سلسله‌مراتبی حول مقدار سراسری؛ bayes_shrinkage = دقت پیشین، بزرگ‌تر = نزدیک‌تر به سراسری)
+        # - bayes_store: پنجره بیزی مشترک بین تکرارهای Monte Carlo (PooledBayesStore)؛ این جهان
+        #   فقط داده جمع می‌کند و برازش را store.update برای همه تکرارها یک بار انجام می‌دهد
+        # - steady_tol: اگر > 0، تشخیص حالت پایا (SteadyStateDetector با پنجره steady_window) روشن
+        #   می‌شود؛ run(..., fast_forward=True) باقی گام‌ها را بعد از تشخیص با fast_forward می‌گذراند
+        # - recording: چه چیزی و هر چند گام ثبت شود (RecordingSpec)؛ پیش‌فرض رفتار قبلی هر موتور:
+        #   loop → full، vectorized → summary، mean_field → agent تا MEAN_FIELD_PER_COUNTRY_MAX کشور
+
+        if engine not in self.ENGINES:
+            raise ValueError(f"engine must be one of {self.ENGINES}")
+        self.engine = engine
+
+        self.agents = list(agents) if agents is not None else []
         # لیست عامل‌ها را ذخیره می‌کنیم.
 
+        if arrays is None:
+            if not self.agents:
+                raise ValueError("either agents or arrays must be given")
+            arrays = AgentArrays.from_agents(self.agents)
+        elif self.engine == "loop" and not self.agents:
+            raise ValueError("engine='loop' needs agent objects; use engine='vectorized' with arrays")
+        self.arrays = arrays
+        # وضعیت آرایه‌ای همه کشورها؛ تنها محل نگهداری داده‌ها در هر دو موتور.
+        if self.agents:
+            arrays.bind(self.agents)
+            # عامل‌ها از این به بعد نمای ردیف خودشان در self.arrays هستند.
+
+        self.action_bases = action_bases if action_bases is not None else (
+            self.agents[0].action_bases if self.agents else ActionBases())
+        self.dyn = dyn_coeffs if dyn_coeffs is not None else (
+            self.agents[0].dyn if self.agents else StateDynamicsCoeffs())
+
+        self.doctrine_rules = doctrine_rules if doctrine_rules is not None else DoctrineRules.for_actions(self.action_bases)
+        if self.doctrine_rules.n_actions != self.action_bases.n_actions:
+            raise ValueError("doctrine_rules must have one row per action")
+        # جدول قوانین تغییر دکترین (مشترک بین دو موتور).
+
+        self.streams = RandomStreams(seed, antithetic=antithetic)
+        # جریان‌های تصادفی نام‌دار مسیر vectorized (یکی برای هر نوع تصمیم؛ برای CRN و جفت‌های
+        # antithetic). مسیر loop مثل قبل از np.random سراسری استفاده می‌کند.
+
+        self.summary = SummaryRecorder(n_actions=arrays.n_actions, bloc_labels=bloc_labels,
+                                       action_codes=self.action_bases.codes)
+        # خروجی خلاصه (حافظه مستقل از N).
+        if recording is None:
+            recording = RecordingSpec({"loop": "full", "vectorized": "summary"}.get(
+                engine, "agent" if arrays.n <= self.MEAN_FIELD_PER_COUNTRY_MAX else "summary"))
+        self.recording = recording
+
         self.esc = esc_coeffs if esc_coeffs is not None else EscalationCoeffs()
         # اگر ضرایب داده شد از آن استفاده می‌کنیم، وگرنه پیش‌فرض EscalationCoeffs می‌سازیم.
 
         self.history = []
+        # ستون‌های دوتایی فقط در history ثبت می‌شوند؛ history_tensors ماتریس‌های (T, N, N) را
+        # هنگام نیاز از همان‌ها می‌سازد (نه نسخه دوم در حافظه).
         # ---------------------------
         # Buffers for booklet-style Bayesian/MAP updating of escalation coefficients (α, η)
         # ---------------------------
         self.bayes_update_every = int(bayes_update_every) if bayes_update_every is not None else 0
         self.bayes_window = int(bayes_window) if bayes_window is not None else 2000
         self.bayes_min_samples = int(bayes_min_samples) if bayes_min_samples is not None else 200
+        if bayes_posterior not in self.BAYES_POSTERIORS:
+            raise ValueError(f"bayes_posterior must be one of {self.BAYES_POSTERIORS}")
+        if posterior_draws not in ("update", "replica"):
+            raise ValueError("posterior_draws must be 'update' or 'replica'")
+        self.bayes_posterior = bayes_posterior
+        self.posterior_draws = posterior_draws
+        self.esc_posterior = {}
+        # آخرین تقریب لاپلاس پسین: {"alpha": LaplacePosterior, "eta": LaplacePosterior}
+        self._coef_map = None
+        # (w_alpha, w_eta) نقطه MAP آخر؛ شروع گرم برازش بعدی (نه نمونه کشیده‌شده)
+        self._posterior_z = None
+        self._coef_map_c = None
+        if bayes_async not in self.BAYES_ASYNC:
+            raise ValueError(f"bayes_async must be one of {self.BAYES_ASYNC}")
+        self.bayes_async = bayes_async
+        self.bayes_staleness = int(bayes_staleness)
+        self.bayes_executor = bayes_executor
+        self._bayes_job = None
+        # (گام اعمال، Future) برازش در حال اجرا در پس‌زمینه
+        self.np_random_state = None
+        # وضعیت np.random سراسری در لحظه fork (شاخه‌های مسیر loop؛ resume_random)
+        if bayes_hierarchy not in self.BAYES_HIERARCHIES:
+            raise ValueError(f"bayes_hierarchy must be one of {self.BAYES_HIERARCHIES}")
+        self.bayes_hierarchy = bayes_hierarchy
+        self.bayes_shrinkage = float(bayes_shrinkage)
+        self.alpha_c = self.eta_c = None
+        # ضرایب هر کشور (N, 11) و (N, 5)؛ در حالت pooled None (همه از self.esc می‌خوانند)
+        if bayes_hierarchy == "country":
+            self.alpha_c = np.tile(self.esc.alpha_vector(), (self.arrays.n, 1))
+            self.eta_c = np.tile(self.esc.eta_vector(), (self.arrays.n, 1))
 
         # country-level dataset: X_c = [S(3), O(3), T(3), Z(2)]  -> y_c = {0,1} "escalated_any"
-        self._country_X = []
-        self._country_y = []
+        self._country_buf = RowBuffer(self.bayes_window, 11)
 
         # edge-level dataset: X_ij = [psi_i, psi_j, psi_i*psi_j, (W_ij-0.5), 1] -> y_ij
-        self._edge_X = []
-        self._edge_y = []
+        self._edge_buf = RowBuffer(self.bayes_window, 5)
+        self.bayes_pooled = False
+        if bayes_store is not None:
+            bayes_store.attach(self)
+
+        self.steady = None
+        if steady_tol and steady_tol > 0:
+            self.steady = SteadyStateDetector(steady_tol, steady_window,
+                                              per_country=self.arrays.n <= self.STEADY_PER_COUNTRY_MAX)
 
         # تاریخچه هر گام زمانی را در این لیست ذخیره می‌کنیم تا بعداً DataFrame بسازیم.
 
         self.doctrine_update_every = int(doctrine_update_every) if doctrine_update_every is not None else 0
         # مقدار N برای آپدیت دکترین را ذخیره می‌کنیم.
 
-        n = len(self.agents)
+        n = self.arrays.n
         # تعداد کشورها.
 
-        if interaction_W is None:
+        self.interaction = interaction
+        if interaction is not None and interaction_W is None:
+            # جهان بزرگ: ماتریس چگال ساخته نمی‌شود (حافظه O(N·k))
+            self.W = None
+        elif interaction_W is None:
             # اگر ماتریس تعامل داده نشد:
 
             W = np.zeros((n, n), dtype=float)
@@ -1016,6 +2321,173 @@ class MultiAgentWorld:
             self.W = W
             # ذخیره ماتریس.
 
+        if self.interaction is None and self.engine in ("vectorized", "mean_field"):
+            self.interaction = InteractionGraph.from_dense(self.W)
+
+    @classmethod
+    def from_arrays(cls, arrays: AgentArrays, interaction: InteractionGraph, **kwargs):
+        """Large-world constructor: vectorized engine over struct-of-arrays state and sparse targeting."""
+        kwargs.setdefault("engine", "vectorized")
+        return cls(agents=None, arrays=arrays, interaction=interaction, **kwargs)
+
+    @property
+    def names(self):
+        return self.arrays.names
+
+    def agent(self, i: int) -> HierarchicalAgent:
+        """Country ``i`` as an agent object (a view; works for array-only worlds too)."""
+        if self.agents:
+            return self.agents[int(i)]
+        return HierarchicalAgent.view(self.arrays, i, self.action_bases, self.dyn)
+
+    def clone(self, seed=None, antithetic=None) -> "MultiAgentWorld":
+        """Independent copy of the full world state (checkpoint).
+
+        Country arrays and Bayes buffers are copy-on-write (:meth:`AgentArrays.fork`, each side
+        copies a column when it first writes it); agent views, escalation coefficients, doctrine
+        counters and recorded history are copied; the read-only pieces (interaction graph, W,
+        action bases, dynamics coefficients, doctrine rules, per-country coefficient rows) are
+        shared. With ``seed=None`` the copy continues the same random streams, so running original
+        and copy gives identical paths; with a seed the copy gets fresh streams and diverges (used
+        to branch trajectories). The loop engine draws from global ``np.random``, which is not part
+        of the checkpoint (see :meth:`fork`).
+        """
+        memo = {id(x): x for x in (self.interaction, self.W, self.action_bases, self.dyn,
+                                   self.doctrine_rules, self.summary.bloc_labels,
+                                   self.alpha_c, self.eta_c) if x is not None}
+        # ستون‌های کشورها و پنجره‌های بیزی کپی-هنگام-نوشتن؛ بیشتر ستون‌ها (پارامترهای ثابت) هرگز کپی نمی‌شوند
+        memo[id(self.arrays)] = self.arrays.fork()
+        memo[id(self._country_buf)] = self._country_buf.fork()
+        memo[id(self._edge_buf)] = self._edge_buf.fork()
+        # ردیف‌های ثبت‌شده بعد از افزودن تغییر نمی‌کنند: فقط ظرف‌ها کپی می‌شوند (کپی عمیق
+        # فهرست‌های بلند، هزینه clone را با طول افق بالا می‌برد).
+        summary = copy.copy(self.summary)
+        summary.rows = {k: list(v) for k, v in self.summary.rows.items()}
+        summary.sink = None
+        memo[id(self.summary)] = summary
+        # تاریخچه‌ای که روی دیسک جریان دارد در نسخه کپی فقط با دنباله درون حافظه‌اش ادامه می‌یابد
+        memo[id(self.history)] = list(self.history) if isinstance(self.history, list) else self.history.recent()
+        if self.bayes_executor is not None:
+            # صف کارهای executor قابل کپی نیست: هر دو جهان از همان استخر استفاده می‌کنند
+            memo[id(self.bayes_executor)] = self.bayes_executor
+        if self._bayes_job is not None:
+            # Future قابل کپی نیست: نسخه کپی Future خودش را می‌گیرد که با کپی نتیجه برازش
+            # در حال اجرا کامل می‌شود (بدون انتظار و بدون دست زدن به کار جهان اصلی)
+            t_due, fut = self._bayes_job
+            memo[id(self._bayes_job)] = (t_due, _copied_future(fut))
+        new = copy.deepcopy(self, memo)
+        if seed is not None:
+            new.streams = RandomStreams(seed, antithetic=self.streams.antithetic if antithetic is None else antithetic)
+        return new
+
+    FORK_SETTINGS = ("doctrine_update_every", "doctrine_rules", "bayes_update_every", "bayes_min_samples")
+
+    def fork(self, modifications: dict = None, seed=None, antithetic=None) -> "MultiAgentWorld":
+        """What-if branch from the current state: a copy-on-write :meth:`clone` with changes applied.
+
+        ``modifications`` may hold:
+
+        - ``"countries"``: ``{name or index: {AgentArrays field: value}}``, e.g.
+          ``{"A": {"rho_c": 0.8, "omega_a": [0.2, 0.2, 0.6]}}`` (``omega_S``/``omega_a`` are
+          normalized like in the agent constructor);
+        - ``"esc"``: ``{EscalationCoeffs field: value}`` for the pooled coefficients;
+        - ``"W"``: a full signed matrix or ``{(src, dst): w}`` (worlds with a dense ``W`` only);
+        - ``"settings"``: values for any of ``FORK_SETTINGS``.
+
+        Many forks can be taken from the same world and run independently; the recorded prefix is
+        shared, never re-simulated. Without ``seed`` a vectorized fork continues the parent's
+        random streams (common random numbers: an empty fork reproduces the parent exactly). For
+        the loop engine the global ``np.random`` state at fork time is saved (or drawn from
+        ``seed``); a fork of a fork that has not been resumed yet inherits its saved state, so
+        checkpoints can be branched any number of times. Call :meth:`resume_random` before
+        running the branch to use it.
+        """
+        new = self.clone(seed=seed, antithetic=antithetic)
+        if self.engine == "loop":
+            if seed is not None:
+                new.np_random_state = np.random.RandomState(int(seed)).get_state()
+            elif self.np_random_state is None:
+                new.np_random_state = np.random.get_state()
+        new._apply_modifications(modifications or {})
+        return new
+
+    def replicate(self, copies: int, seed=None, crn_blocks: int = 1) -> "MultiAgentWorld":
+        """Vectorized world holding ``copies`` independent copies of the current state.
+
+        Copy c owns rows ``c·N … c·N + N − 1`` and targets only inside its block (see
+        :meth:`InteractionGraph.replicate`), so one step of the result advances every copy at
+        the cost of one batched step. Coefficients are frozen (``bayes_update_every=0``);
+        per-country α/η rows are repeated and nothing is recorded (callers read ``arrays`` or the
+        values :meth:`step` returns). With ``crn_blocks=B`` the copies form B equal groups
+        that draw the same random numbers (:class:`RandomStreams` ``tile``), e.g. B candidate
+        configurations × R replicas with common random numbers.
+        """
+        n, copies = self.arrays.n, int(copies)
+        graph = self.interaction if self.interaction is not None else InteractionGraph.from_dense(self.W)
+        big = MultiAgentWorld.from_arrays(
+            self.arrays.take(np.tile(np.arange(n), copies)), graph.replicate(copies),
+            esc_coeffs=self.esc, action_bases=self.action_bases, dyn_coeffs=self.dyn,
+            doctrine_update_every=self.doctrine_update_every, doctrine_rules=self.doctrine_rules,
+            bayes_update_every=0, recording=RecordingSpec("none"),
+        )
+        big.streams = RandomStreams(seed, tile=crn_blocks)
+        if self.alpha_c is not None:
+            big.alpha_c = np.tile(self.alpha_c, (copies, 1))
+            big.eta_c = np.tile(self.eta_c, (copies, 1))
+        return big
+
+    def resume_random(self):
+        """Load the global ``np.random`` state saved by :meth:`fork` (loop engine branches).
+
+        The saved state is consumed: from here on the world follows the global stream again.
+        """
+        if self.np_random_state is not None:
+            np.random.set_state(self.np_random_state)
+            self.np_random_state = None
+        return self
+
+    def _apply_modifications(self, mods: dict):
+        unknown = set(mods) - {"countries", "esc", "W", "settings"}
+        if unknown:
+            raise ValueError(f"unknown modification keys: {sorted(unknown)}")
+        arr = self.arrays
+        for who, fields in (mods.get("countries") or {}).items():
+            i = arr.names.index(who) if isinstance(who, str) else int(who)
+            for f, value in fields.items():
+                if f not in arr.FIELDS:
+                    raise ValueError(f"unknown country field {f!r}")
+                value = np.asarray(value, dtype=getattr(arr, f).dtype)
+                if f in ("omega_S", "omega_a"):
+                    value = value / (value.sum() + 1e-12)
+                arr.own(f)
+                getattr(arr, f)[i] = value
+            if {"p_ab", "r_ab"} & set(fields):
+                arr.refresh_beliefs(i)
+        for f, value in (mods.get("esc") or {}).items():
+            if not hasattr(self.esc, f):
+                raise ValueError(f"unknown escalation coefficient {f!r}")
+            setattr(self.esc, f, np.array(value, dtype=float) if np.ndim(value) else float(value))
+        if mods.get("W") is not None:
+            if self.W is None:
+                raise ValueError("W modifications need a world with a dense interaction matrix")
+            W = mods["W"]
+            if isinstance(W, dict):
+                W0 = self.W.copy()
+                for (src, dst), w in W.items():
+                    src = arr.names.index(src) if isinstance(src, str) else int(src)
+                    dst = arr.names.index(dst) if isinstance(dst, str) else int(dst)
+                    W0[src, dst] = w
+                W = W0
+            W = np.clip(np.array(W, dtype=float), -1.0, 1.0)
+            np.fill_diagonal(W, 0.0)
+            self.W = W
+            if self.engine in ("vectorized", "mean_field"):
+                self.interaction = InteractionGraph.from_dense(W)
+        for k, value in (mods.get("settings") or {}).items():
+            if k not in self.FORK_SETTINGS:
+                raise ValueError(f"setting {k!r} cannot be changed in a fork; one of {self.FORK_SETTINGS}")
+            setattr(self, k, value if k == "doctrine_rules" else int(value))
+
     @staticmethod
     def _w_signed_to_weight01(w_signed: float) -> float:
         """Convert signed W in [-1,+1] to a nonnegative weight in [0,1].
@@ -1065,37 +2537,100 @@ class MultiAgentWorld:
 
         This is the minimal correction requested when someone says:
         'the booklet's posterior update for α/η is not implemented in the code'.
+
+        With ``bayes_posterior="laplace"`` the MAP is kept as the centre of a Laplace
+        approximation ``N(MAP, H⁻¹)`` (``self.esc_posterior``) and the simulation uses a draw
+        from it: a fresh one at every update, or with ``posterior_draws="replica"`` the same
+        standard-normal quantile for the whole run.
+
+        With ``bayes_async="deterministic"`` / ``"eager"`` the fit runs on a snapshot of the
+        windows in a background worker while stepping continues, and is swapped in at most
+        ``bayes_staleness`` steps later (exactly then in deterministic mode, so runs stay
+        reproducible). ``"off"`` fits inline as before.
         """
-        if self.bayes_update_every <= 0:
+        if self.bayes_update_every <= 0 or self.bayes_pooled:
             return
+        if self._bayes_job is not None:
+            self._poll_bayes_job(t)
         if t <= 0:
             return
         if (t % self.bayes_update_every) != 0:
             return
 
         # need enough samples to avoid noisy updates
-        if (len(self._edge_y) < self.bayes_min_samples) or (len(self._country_y) < self.bayes_min_samples):
+        if (len(self._edge_buf) < self.bayes_min_samples) or (len(self._country_buf) < self.bayes_min_samples):
             return
 
-        # ---- update α (11-dim) ----
-        Xc = np.vstack(self._country_X)
-        yc = np.asarray(self._country_y, dtype=float)
-
-        w0_alpha = np.concatenate([self.esc.alpha_S, self.esc.alpha_O, self.esc.alpha_T, self.esc.delta])
-        w_alpha = fit_logistic_map(Xc, yc, w0=w0_alpha, l2=0.8, lr=0.25, iters=160)
-
+        args = self._fit_args()
+        if self.bayes_async == "off" or self.bayes_staleness <= 0:
+            self._apply_escalation_fit(fit_escalation_coeffs(*args))
+            return
+        if self._bayes_job is not None:
+            # برازش قبلی هنوز اعمال نشده: همین حالا (با انتظار) اعمال می‌شود تا سقف کهنگی حفظ شود
+            self._apply_escalation_fit(self._bayes_job[1].result())
+            self._bayes_job = None
+        executor = self.bayes_executor if self.bayes_executor is not None else _fit_executor()
+        self._bayes_job = (t + self.bayes_staleness, executor.submit(fit_escalation_coeffs, *args))
+
+    def _fit_args(self, country_buf: RowBuffer = None, edge_buf: RowBuffer = None) -> tuple:
+        """Arguments of :func:`fit_escalation_coeffs`: snapshot of the windows + warm start."""
+        country_buf = country_buf if country_buf is not None else self._country_buf
+        edge_buf = edge_buf if edge_buf is not None else self._edge_buf
+        # snapshot پنجره‌ها (data() کپی برمی‌گرداند) + نقطه شروع گرم
+        Xc, yc = country_buf.data()
+        Xe, ye = edge_buf.data()
+        if self._coef_map is not None:
+            w0_alpha, w0_eta = self._coef_map
+        else:
+            w0_alpha, w0_eta = self.esc.alpha_vector(), self.esc.eta_vector()
+        hierarchy = None
+        if self.alpha_c is not None:
+            a0, e0 = self._coef_map_c if self._coef_map_c is not None else (self.alpha_c, self.eta_c)
+            hierarchy = dict(groups_c=country_buf.groups(), groups_e=edge_buf.groups(),
+                             n_groups=self.arrays.n, alpha_c=a0.copy(), eta_c=e0.copy(),
+                             shrinkage=self.bayes_shrinkage)
+        return Xc, yc, Xe, ye, w0_alpha, w0_eta, self.BAYES_L2, self.bayes_posterior == "laplace", hierarchy
+
+    def _poll_bayes_job(self, t: int):
+        """Swap in a background fit: at ``t_submit + staleness`` exactly ("deterministic"), or as
+        soon as it is ready and no later than that ("eager")."""
+        t_due, fut = self._bayes_job
+        if t >= t_due or (self.bayes_async == "eager" and fut.done()):
+            self._bayes_job = None
+            self._apply_escalation_fit(fut.result())
+
+    def _apply_escalation_fit(self, fit: dict):
+        """Install a fit result into ``self.esc`` (and the per-country rows) between steps, on the
+        simulation thread."""
+        w_alpha, w_eta = fit["alpha"], fit["eta"]
+        A, E = fit.get("alpha_c"), fit.get("eta_c")
+        if self.bayes_posterior == "laplace":
+            # ضرایب شبیه‌سازی = نمونه‌ای از N(MAP, H⁻¹)؛ برازش بعدی از خود MAP شروع می‌شود
+            self._coef_map = (w_alpha, w_eta)
+            post_a, post_e = fit["alpha_posterior"], fit["eta_posterior"]
+            self.esc_posterior = {"alpha": post_a, "eta": post_e}
+            da, de = len(w_alpha), len(w_eta)
+            n_c = 0 if A is None else A.size + E.size
+            z = self._posterior_normals(da + de + n_c)
+            w_alpha = post_a.sample(z[:da])
+            w_eta = post_e.sample(z[da:da + de])
+            if A is not None:
+                self._coef_map_c = (A, E)
+                post_ac, post_ec = fit["alpha_c_posterior"], fit["eta_c_posterior"]
+                self.esc_posterior.update(alpha_c=post_ac, eta_c=post_ec)
+                zc = z[da + de:]
+                A = post_ac.sample(zc[:A.size].reshape(A.shape))
+                E = post_ec.sample(zc[A.size:].reshape(E.shape))
+        if A is not None:
+            self.alpha_c, self.eta_c = A, E
+
+        # ---- α (11-dim) ----
         self.esc.alpha_S = w_alpha[0:3].astype(float)
         self.esc.alpha_O = w_alpha[3:6].astype(float)
         self.esc.alpha_T = w_alpha[6:9].astype(float)
         self.esc.delta = w_alpha[9:11].astype(float)
 
-        # ---- update η (5-dim) ----
-        Xe = np.vstack(self._edge_X)
-        ye = np.asarray(self._edge_y, dtype=float)
-
-        w0_eta = np.array([self.esc.eta1, self.esc.eta2, self.esc.eta3, self.esc.eta_W, self.esc.eta_bias], dtype=float)
-        w_eta = fit_logistic_map(Xe, ye, w0=w0_eta, l2=0.8, lr=0.25, iters=160)
-
+        # ---- η (5-dim) ----
         self.esc.eta1 = float(w_eta[0])
         self.esc.eta2 = float(w_eta[1])
         self.esc.eta3 = float(w_eta[2])
@@ -1103,6 +2638,31 @@ class MultiAgentWorld:
         # note: last weight multiplies constant 1.0 feature, so it's a bias term
         self.esc.eta_bias = float(w_eta[4])
 
+    def _esc_for(self, i: int) -> EscalationCoeffs:
+        """Coefficients country ``i`` acts with: ``self.esc`` unless ``bayes_hierarchy="country"``."""
+        if self.alpha_c is None:
+            return self.esc
+        return self.esc.with_weights(self.alpha_c[i], self.eta_c[i])
+
+    def _eta_terms(self):
+        """(η1, η2, η3, ηW, η_bias): scalars, or (N,) arrays indexed by source country."""
+        if self.eta_c is None:
+            e = self.esc
+            return e.eta1, e.eta2, e.eta3, e.eta_W, e.eta_bias
+        return tuple(self.eta_c.T)
+
+    def _posterior_normals(self, d: int) -> np.ndarray:
+        """Standard normals for a posterior draw: fresh per update, or fixed for the whole replica."""
+        if self.posterior_draws == "replica" and self._posterior_z is not None:
+            return self._posterior_z
+        if self.engine == "loop":
+            z = np.random.standard_normal(d)
+        else:
+            z = self.streams.normal("posterior", d)
+        if self.posterior_draws == "replica":
+            self._posterior_z = z
+        return z
+
     def _dyad_tension(self, psi_i: float, psi_j: float, w_ij: float) -> float:
         """Pairwise (directed) tension proxy in [0,1].
 
@@ -1122,7 +2682,104 @@ class MultiAgentWorld:
         )
         return float(sigmoid(base))
 
+    def _dyad_tension_matrix(self, psi) -> np.ndarray:
+        """Vectorized :meth:`_dyad_tension` for all ordered pairs; diagonal is 0."""
+        psi = np.asarray(psi, dtype=float)
+        w01 = np.clip((1.0 - self.W) / 2.0, 0.0, 1.0)
+        e1, e2, e3, eW, eb = (np.reshape(e, (-1, 1)) if np.ndim(e) else float(e) for e in self._eta_terms())
+        base = (
+                (e1 * psi[:, None])
+                + (e2 * psi[None, :])
+                + (e3 * psi[:, None] * psi[None, :])
+                + eb
+                + (eW * (w01 - 0.5))
+        )
+        D = sigmoid(base)
+        np.fill_diagonal(D, 0.0)
+        return D
+
+    TENSOR_SERIES = ("DyadTension", "CrisisProb", "Crisis")
+
+    def history_tensors(self) -> dict:
+        """Stacked (T, N, N) arrays: DyadTension, CrisisProb, Crisis (indexed [t, src, dst]).
+
+        Built on demand from the dyadic ``history`` columns, which are the only recorded copy;
+        a family the recording does not keep gives a (0, N, N) array. Missing pairs (the
+        diagonal of DyadTension) are 0.
+        """
+        import pandas as pd
+        names = self.arrays.names
+        n = len(names)
+        out = {}
+        for family in self.TENSOR_SERIES:
+            rows = self.history if self.engine == "loop" and self.recording.keeps(family) else []
+            cols = [f"{family}_{src}_{dst}" for src in names for dst in names]
+            # هر خانواده یک بار به صورت بلوک جمع می‌شود (بدون حلقه پایتون روی زوج‌ها)
+            block = pd.DataFrame(rows, columns=cols).to_numpy(dtype=float, na_value=0.0)
+            out[family] = block.reshape(-1, n, n)
+        return out
+
+    def recording_estimate(self, steps: int) -> dict:
+        """Approximate memory (bytes) of what ``steps`` more steps will record (see :meth:`RecordingSpec.estimate`)."""
+        return self.recording.estimate(self.arrays.n, steps, self.engine, self.arrays.n_actions, self.summary.n_blocs)
+
+    def stream_output(self, path: str, chunk_rows: int = 4096, fmt: str = "npy", tail: int = 0,
+                      max_pending: int = 2) -> "MultiAgentWorld":
+        """Write recorded rows to disk from now on instead of keeping them all in memory.
+
+        ``history`` rows (levels ``"agent"``/``"full"``) go to ``path/history`` and summary rows to
+        ``path/summary``, each through a :class:`history_store.ChunkedHistoryWriter` (background
+        thread, ``chunk_rows`` rows per file, ``fmt`` ``"npy"``/``"parquet"``/``"arrow"``); rows
+        recorded so far are written first. Afterwards ``history`` and ``summary.rows`` hold only
+        the last ``tail`` rows (at least the steady-state window, so :meth:`fast_forward` keeps
+        working). Dyad tensors have no disk form, so recordings with dyadic series are refused.
+        Finish with :meth:`close_output`; a :meth:`clone` records in memory again.
+        """
+        from history_store import ChunkedHistoryWriter
+
+        if self.recording.dyadic:
+            raise ValueError("dyadic series are kept in memory; stream a recording without DYAD_SERIES "
+                             "(e.g. RecordingSpec('agent'))")
+        if self.summary.sink is not None:
+            raise ValueError("output is already streamed; call close_output() first")
+        tail = max(int(tail), self.steady.window if self.steady is not None else 0)
+        opts = dict(chunk_rows=chunk_rows, fmt=fmt, tail=tail, max_pending=max_pending)
+        if self.recording.rows:
+            writer = ChunkedHistoryWriter(os.path.join(path, "history"), **opts)
+            writer.extend(self.history)
+            self.history = writer
+        sink = ChunkedHistoryWriter(os.path.join(path, "summary"), **opts)
+        rows = self.summary.rows
+        for i in range(len(rows.get("Time", ()))):
+            sink.append({k: v[i] for k, v in rows.items()})
+        for v in rows.values():
+            del v[:max(0, len(v) - tail)]
+        self.summary.sink, self.summary.keep = sink, tail
+        return self
+
+    def close_output(self) -> dict:
+        """Flush and close the writers of :meth:`stream_output`.
+
+        Returns ``{"history": HistoryStore, "summary": HistoryStore}`` (``history`` only if it
+        was streamed). Later steps record in memory again, after the kept tail.
+        """
+        out = {}
+        if not isinstance(self.history, list):
+            out["history"] = self.history.close()
+            self.history = self.history.recent()
+        if self.summary.sink is not None:
+            out["summary"] = self.summary.sink.close()
+            self.summary.sink, self.summary.keep = None, 0
+        return out
+
     def step(self, t: int):
+        if self.engine == "vectorized":
+            return self._step_vectorized(t)
+        if self.engine == "mean_field":
+            return self._step_mean_field(t)
+        if self.arrays._shared:
+            # بعد از fork: مسیر loop از طریق نماهای عامل می‌نویسد، پس همه ستون‌ها کپی می‌شوند
+            self.arrays.own()
         # اجرای یک گام زمانی t:
         # اینجا سه فاز داریم:
         # 1) انتخاب action و target و محاسبه ψ_c
@@ -1130,10 +2787,13 @@ class MultiAgentWorld:
         # 3) یادگیری + آپدیت حالت (تنش/منابع)
 
         step_data = {"Time": t}
+        keep = self.recording.records(t)
+        dyadic = keep and self.recording.dyadic
+        # ستون‌ها و ماتریس‌های دوتایی (O(N²)) فقط در گام‌های ثبت‌شده با سطح full ساخته می‌شوند
 
         # --- initialize crisis attribution matrix for this timestep ---
         # Crisis_{src}_{dst} in {0,1}  and CrisisProb_{src}_{dst} in [0,1]
-        _names = [ag.name for ag in self.agents]
+        _names = [ag.name for ag in self.agents] if dyadic else []
         for _src in _names:
             for _dst in _names:
                 step_data[f"Crisis_{_src}_{_dst}"] = 0
@@ -1170,7 +2830,7 @@ class MultiAgentWorld:
             U = ag.utilities()
             # محاسبه Utility های سه اقدام (کتابچه: U=... صفحات 11-13).
 
-            psi = ag.psi_c(a, self.esc)
+            psi = ag.psi_c(a, self._esc_for(i))
             # محاسبه ψ_c برای همین اقدام انتخاب‌شده (کتابچه: ψ_c صفحه 17).
 
             j = self._pick_target(i)
@@ -1179,7 +2839,7 @@ class MultiAgentWorld:
             # اما همان مفهوم تعامل i و j را عملیاتی می‌کند.
 
             # record action for doctrine update
-            ag.record_action_and_maybe_update_doctrine(a, self.doctrine_update_every)
+            ag.record_action_and_maybe_update_doctrine(a, self.doctrine_update_every, self.doctrine_rules)
             # شمارش اقدام و اگر به N رسید ⇒ تغییر دکترین (این بخش افزوده‌ی مهندسی طبق درخواست توست).
 
             actions[i] = a
@@ -1197,7 +2857,7 @@ class MultiAgentWorld:
             psi_list[i] = psi
             # ذخیره ψ_c کشور i.
 
-            step_data[f"Action_{ag.name}"] = ACT_MAP[a]
+            step_data[f"Action_{ag.name}"] = self.action_bases.codes[a]
             # ثبت اقدام به شکل P/S/R در تاریخچه (برای نمودارها).
 
             step_data[f"Target_{ag.name}"] = self.agents[j].name
@@ -1214,17 +2874,15 @@ class MultiAgentWorld:
 
         # --- NEW OUTPUT: directed dyadic tension matrix (all pairs) ---
         # DyadTension_{src}_{dst} in [0,1]
-        for i in range(n):
+        dyad_T = self._dyad_tension_matrix(psi_list) if dyadic else None
+        crisis_Y = np.zeros((n, n), dtype=float)
+        for i in range(n if dyadic else 0):
             src = self.agents[i].name
             for j in range(n):
                 if j == i:
                     continue
                 dst = self.agents[j].name
-                step_data[f"DyadTension_{src}_{dst}"] = self._dyad_tension(
-                    psi_list[i],
-                    psi_list[j],
-                    self.W[i, j],
-                )
+                step_data[f"DyadTension_{src}_{dst}"] = float(dyad_T[i, j])
 
         # Phase 2: directed dyadic escalation ψ_ij + Y_ij (only for chosen targets)
         escalated_any_for_agent = [False] * n
@@ -1234,6 +2892,9 @@ class MultiAgentWorld:
         global_escalation = 0
         # یک پرچم کلی: اگر حداقل یک یال تشدید شد، این 1 می‌شود (برای نمودار global).
 
+        edge_psi = np.zeros(n)
+        # ψ_ij یال انتخاب‌شده هر کشور (برای ردیف خلاصه)
+
         for i in range(n):
             # روی هر کشور i:
 
@@ -1252,13 +2913,16 @@ class MultiAgentWorld:
             w_ij = self._w_signed_to_weight01(w_ij_signed)
             # تبدیل برای استفاده در ψ_ij (بازه 0..1)
 
-            base = (self.esc.eta1 * psi_i) + (self.esc.eta2 * psi_j) + (
-                        self.esc.eta3 * psi_i * psi_j) + self.esc.eta_bias
+            esc_i = self._esc_for(i)
+            # ضرایب η کشور مبدأ (در حالت pooled همان self.esc)
+
+            base = (esc_i.eta1 * psi_i) + (esc_i.eta2 * psi_j) + (
+                        esc_i.eta3 * psi_i * psi_j) + esc_i.eta_bias
             # ساختن ورودی پایه ψ_ij طبق کتابچه:
             # ψ_ij = σ(η1 ψ_i + η2 ψ_j + η3 ψ_i ψ_j)  (کتابچه: صفحه 17)
             # هنوز سیگموید را اعمال نکردیم؛ فعلاً base = داخل σ.
 
-            base = base + (self.esc.eta_W * (w_ij - 0.5))
+            base = base + (esc_i.eta_W * (w_ij - 0.5))
             # این جمله در کتابچه نیست (اصلاح مهندسی):
             # اثر وزن تعامل W_ij را اضافه می‌کند.
             # - اگر w_ij=0.5 ⇒ اثر صفر (خنثی)
@@ -1274,29 +2938,24 @@ class MultiAgentWorld:
             # با احتمال ψ_ij تشدید رخ می‌دهد (Y=1)، وگرنه رخ نمی‌دهد (Y=0).
             # این منطق همان Bernoulli observation در کتابچه است (تعامل مشاهده‌ای y_ij).
 
-            step_data[f"PsiEdge_{self.agents[i].name}_{self.agents[j].name}"] = psi_ij
-            # ذخیره احتمال یال برای استفاده در UI/تحلیل (اختیاری ولی مفید).
+            if dyadic:
+                step_data[f"PsiEdge_{self.agents[i].name}_{self.agents[j].name}"] = psi_ij
+                # ذخیره احتمال یال برای استفاده در UI/تحلیل (اختیاری ولی مفید).
 
-            step_data[f"Y_{self.agents[i].name}_{self.agents[j].name}"] = int(y_ij)
+                step_data[f"Y_{self.agents[i].name}_{self.agents[j].name}"] = int(y_ij)
 
-            # --- New: directed crisis attribution (matrix-friendly) ---
-            # برای اینکه UI بتواند یک ماتریس N×N از «عامل بحران» بسازد،
-            # همین رخداد یال i→j را داخل ستون‌های Crisis_* ذخیره می‌کنیم.
-            step_data[f"CrisisProb_{self.agents[i].name}_{self.agents[j].name}"] = float(psi_ij)
-            step_data[f"Crisis_{self.agents[i].name}_{self.agents[j].name}"] = int(y_ij)
+                # --- New: directed crisis attribution (matrix-friendly) ---
+                # برای اینکه UI بتواند یک ماتریس N×N از «عامل بحران» بسازد،
+                # همین رخداد یال i→j را داخل ستون‌های Crisis_* ذخیره می‌کنیم.
+                step_data[f"CrisisProb_{self.agents[i].name}_{self.agents[j].name}"] = float(psi_ij)
+                step_data[f"Crisis_{self.agents[i].name}_{self.agents[j].name}"] = int(y_ij)
+            edge_psi[i] = psi_ij
+            crisis_Y[i, j] = y_ij
 
             # --- booklet-style data for η (edge-level Bernoulli-Logit) ---
             if self.bayes_update_every > 0:
                 Xij = np.array([psi_i, psi_j, psi_i * psi_j, (w_ij - 0.5), 1.0], dtype=float)
-                self._edge_X.append(Xij)
-                self._edge_y.append(float(y_ij))
-
-                # keep buffers bounded
-                if len(self._edge_y) > self.bayes_window:
-                    excess = len(self._edge_y) - self.bayes_window
-                    if excess > 0:
-                        del self._edge_X[:excess]
-                        del self._edge_y[:excess]
+                self._edge_buf.append(Xij, float(y_ij), i)  # bounded ring buffer (گروه = کشور مبدأ)
             # ذخیره رخداد واقعی تشدید روی یال i→j برای گراف:
             # Y=1 یعنی تشدید رخ داده، Y=0 یعنی رخ نداده.
 
@@ -1326,21 +2985,16 @@ class MultiAgentWorld:
                 Z = np.array([ag.v_c, resource_norm], dtype=float)
                 Xc = np.concatenate([S, O, T, Z])  # 11-dim
                 yc = 1.0 if escalated_any_for_agent[i] else 0.0
-                self._country_X.append(Xc)
-                self._country_y.append(yc)
-
-            # keep buffers bounded
-            if len(self._country_y) > self.bayes_window:
-                excess = len(self._country_y) - self.bayes_window
-                if excess > 0:
-                    del self._country_X[:excess]
-                    del self._country_y[:excess]
+                self._country_buf.append(Xc, yc, i)  # bounded ring buffer
         # ثبت وضعیت کلی تشدید برای نمودار global escalation.
 
         # Phase 3: feedback + learning + state update
         # booklet-style MAP update for escalation coefficients (α, η)
         self._maybe_update_escalation_coeffs(t)
 
+        ab = self.action_bases
+        # احتمال موفقیت و جریمه تشدید هر اقدام از تعریف اعلانی فضای اقدام خوانده می‌شود.
+
         for i, ag in enumerate(self.agents):
             # روی هر کشور برای یادگیری و آپدیت حالت:
 
@@ -1353,15 +3007,15 @@ class MultiAgentWorld:
             a = actions[i]
             # اقدام انتخابی واقعی در این گام.
 
-            base_success = 0.82 if a != 2 else 0.60
-            # احتمال موفقیت پایه برای اقدام:
+            base_success = float(ab.success[a])
+            # احتمال موفقیت پایه برای اقدام (ActionBases.success_base):
             # - P/S موفق‌تر و آسان‌تر (0.82)
             # - R سخت‌تر و پرریسک‌تر (0.60)
             # این یک تقریب مهندسی است چون محیط واقعی نداریم؛ ولی منطقی است.
 
-            if escalated_any_for_agent[i] and a == 2:
-                # اگر کشور در شرایط تشدید بوده و اقدامش هم R بوده:
-                base_success -= 0.08
+            if escalated_any_for_agent[i] and ab.penalty[a] != 0.0:
+                # اگر کشور در شرایط تشدید بوده و اقدامش سخت است (پیش‌فرض فقط R):
+                base_success -= float(ab.penalty[a])
                 # موفقیت کمتر می‌شود چون درگیری واقعی سخت‌تر است.
 
             base_success = max(0.05, min(0.95, base_success))
@@ -1386,5 +3040,318 @@ class MultiAgentWorld:
             # - تنش با فرمول سیگموید (کتابچه)
             # - منابع با درآمد - خرج (اصلاح مهندسی برای واقعی‌تر شدن)
 
-        self.history.append(step_data)
-        # ثبت همه اطلاعات این گام در history تا بعداً DataFrame ساخته شود.
+        if keep:
+            rec = self.recording
+            if rec.rows:
+                self.history.append(rec.filter(step_data))
+                # ثبت اطلاعات این گام در history تا بعداً DataFrame ساخته شود.
+            y_src = crisis_Y[np.arange(n), targets]
+            self.summary.record(t, self.arrays, np.asarray(actions), np.asarray(psi_list), y_src, psi_edge=edge_psi)
+
+        if self.steady is not None:
+            self.steady.observe(t, self.arrays, probs_list)
+
+    # ---------- vectorized engine (large worlds) ----------
+    def _step_vectorized(self, t: int):
+        """One step of the same model with every agent updated at once (no per-agent Python loop).
+
+        Randomness comes from ``self.streams`` (one stream per decision); per-step output goes to
+        ``self.summary``, including the Rao-Blackwellized escalation columns.
+        """
+        arr, esc, rs = self.arrays, self.esc, self.streams
+        arr.own(*arr.DYNAMIC)
+        n = arr.n
+        rows = np.arange(n)
+
+        # Phase 1: utilities, logit choice, ψ_c, targets
+        U, S, O, T = batch_utilities(arr, self.action_bases)
+        logits = arr.beta_c[:, None] * U + arr.omega_a
+        logits = logits - logits.max(axis=1, keepdims=True)
+        ex = np.exp(logits)
+        probs = ex / (ex.sum(axis=1, keepdims=True) + 1e-12)
+        actions = sample_categorical(probs, rs.uniform("action", n))
+
+        resource_norm = arr.resource / (arr.resource + 1000.0)
+        if self.alpha_c is None:
+            lin = (S[rows, actions] @ esc.alpha_S + O[rows, actions] @ esc.alpha_O + T[rows, actions] @ esc.alpha_T
+                   + esc.delta[0] * arr.v_c + esc.delta[1] * resource_norm)
+        else:
+            A = self.alpha_c
+            lin = (np.einsum("nd,nd->n", S[rows, actions], A[:, 0:3]) + np.einsum("nd,nd->n", O[rows, actions], A[:, 3:6])
+                   + np.einsum("nd,nd->n", T[rows, actions], A[:, 6:9]) + A[:, 9] * arr.v_c + A[:, 10] * resource_norm)
+        psi = sigmoid(esc.psi_scale * (lin - esc.psi_bias))
+
+        targets, w_signed = self.interaction.sample(rs.uniform("target", n))
+        self.doctrine_rules.apply(arr, actions, self.doctrine_update_every)
+
+        # Phase 2: ψ_ij on chosen edges + Bernoulli Y_ij
+        w01 = np.clip((1.0 - w_signed) / 2.0, 0.0, 1.0)
+        psi_j = psi[targets]
+        e1, e2, e3, eW, eb = self._eta_terms()
+        psi_ij = sigmoid(e1 * psi + e2 * psi_j + e3 * psi * psi_j + eb + eW * (w01 - 0.5))
+        y = rs.uniform("escalation", n) < psi_ij
+        escalated = y.copy()
+        escalated[targets[y]] = True
+
+        if self.bayes_update_every > 0:
+            keep = rows if n <= self.bayes_window else np.sort(
+                rs.generator("bayes").choice(n, self.bayes_window, replace=False))
+            self._edge_buf.append(
+                np.column_stack([psi, psi_j, psi * psi_j, w01 - 0.5, np.ones(n)])[keep], y[keep].astype(float), keep)
+            # ویژگی‌های کشور بعد از تغییر دکترین (مثل مسیر loop)
+            S2, O2, T2 = batch_feature_maps(arr, self.action_bases)
+            Xc = np.concatenate([S2[rows, actions], O2[rows, actions], T2[rows, actions],
+                                 arr.v_c[:, None], resource_norm[:, None]], axis=1)
+            self._country_buf.append(Xc[keep], escalated[keep].astype(float), keep)
+
+        # Phase 3: coefficient update, learning, state dynamics
+        self._maybe_update_escalation_coeffs(t)
+
+        ab = self.action_bases
+        base_success = ab.success[actions] - ab.penalty[actions] * escalated
+        success = rs.uniform("success", n) < np.clip(base_success, 0.05, 0.95)
+
+        lr = 0.05
+        onehot = np.zeros_like(arr.omega_a)
+        onehot[rows, actions] = 1.0
+        arr.omega_a[:] = (1 - lr) * arr.omega_a + lr * onehot
+        arr.omega_a /= arr.omega_a.sum(axis=1, keepdims=True) + 1e-12
+        arr.p_ab[:, 0] += success
+        arr.p_ab[:, 1] += ~success
+        hurt = escalated & ~success
+        arr.r_ab[:, 1] += hurt
+        arr.r_ab[:, 0] += 0.3 * ~hurt
+        arr.refresh_beliefs()
+
+        E_U = (probs * U).sum(axis=1)
+        dyn = self.dyn
+        t_next = sigmoid(dyn.alpha0 + dyn.alpha_v * arr.v_c + dyn.alpha_psi * psi + dyn.alpha_a * E_U
+                         - dyn.alpha_r * resource_norm)
+        base_cost = ab.table[actions, 2]
+        spend = arr.chi_c * base_cost * (50.0 * (arr.resource / 1000.0))
+        rec = self.recording
+        if rec.rows and rec.records(t):
+            # مثل مسیر loop: اقدام، هدف، ψ_c و حالت ابتدای گام
+            row = {"Time": int(t), "Global_Escalation": int(y.any())}
+            names, codes = arr.names, self.action_bases.codes
+            for family, values in (("Action", [codes[a] for a in actions]), ("Target", [names[j] for j in targets]),
+                                   ("Tension", arr.tension.tolist()), ("Resource", arr.resource.tolist()),
+                                   ("Psi", psi.tolist())):
+                if rec.keeps(family):
+                    row.update(zip((f"{family}_{name}" for name in names), values))
+            self.history.append(row)
+        arr.resource[:] = np.maximum(0.0, arr.resource + arr.income_c - spend)
+        arr.tension[:] = np.clip(t_next, 0.0, 1.0)
+
+        if rec.records(t):
+            self.summary.record(t, arr, actions, psi, y, psi_edge=psi_ij)
+        if self.steady is not None:
+            self.steady.observe(t, arr, probs)
+        return actions, targets, psi, y
+
+    # ---------- mean-field engine (expected-value propagation) ----------
+    def _step_mean_field(self, t: int):
+        """Deterministic step that propagates expectations instead of samples.
+
+        Action choice stays a probability vector, targets a probability over neighbours, ψ_ij is
+        averaged over both sides' actions, and learning/state updates use expected increments.
+        Closure: the next step is evaluated at the expected state (tension, resource, beliefs),
+        so nonlinear feedback between steps is approximated; within a step the expectations over
+        actions are exact. Escalation events on different edges are treated as independent, and
+        the Bayesian refit of (α, η) is not run (coefficients stay as they are).
+        """
+        arr, esc, ab = self.arrays, self.esc, self.action_bases
+        arr.own(*arr.DYNAMIC)
+        n, K = arr.n, ab.n_actions
+
+        # Phase 1: action probabilities and ψ_c per action
+        U, S, O, T = batch_utilities(arr, ab)
+        logits = arr.beta_c[:, None] * U + arr.omega_a
+        logits = logits - logits.max(axis=1, keepdims=True)
+        ex = np.exp(logits)
+        probs = ex / (ex.sum(axis=1, keepdims=True) + 1e-12)
+
+        resource_norm = arr.resource / (arr.resource + 1000.0)
+        if self.alpha_c is None:
+            lin = (S @ esc.alpha_S + O @ esc.alpha_O + T @ esc.alpha_T
+                   + (esc.delta[0] * arr.v_c + esc.delta[1] * resource_norm)[:, None])
+        else:
+            A = self.alpha_c
+            lin = (np.einsum("nkd,nd->nk", S, A[:, 0:3]) + np.einsum("nkd,nd->nk", O, A[:, 3:6])
+                   + np.einsum("nkd,nd->nk", T, A[:, 6:9]) + (A[:, 9] * arr.v_c + A[:, 10] * resource_norm)[:, None])
+        psi_a = sigmoid(esc.psi_scale * (lin - esc.psi_bias))  # (N, K)
+        psi = (probs * psi_a).sum(axis=1)
+
+        # Phase 2: expected ψ_ij over target and both actions
+        G = self.interaction
+        nbr, P_t = G.neighbors, G.target_probs()
+        w01 = np.clip((1.0 - G.w_signed) / 2.0, 0.0, 1.0)
+        iso = G.isolated
+        if len(iso):
+            # کشور بدون همسایه: هدف یکنواخت از بقیه با رابطه خنثی (مثل InteractionGraph.sample)
+            extra = max(0, n - 1 - nbr.shape[1])
+            nbr = np.concatenate([nbr, np.full((n, extra), -1, dtype=nbr.dtype)], axis=1)
+            P_t = np.concatenate([P_t, np.zeros((n, extra))], axis=1)
+            w01 = np.concatenate([w01, np.zeros((n, extra))], axis=1)
+            for i in iso:
+                nbr[i] = -1
+                nbr[i, :n - 1] = np.delete(np.arange(n), i)
+                P_t[i] = 0.0
+                P_t[i, :n - 1] = 1.0 / (n - 1)
+                w01[i] = 0.5
+        valid = nbr >= 0
+        j = np.where(valid, nbr, 0)
+        pi_a = psi_a[:, None, :, None]  # (N, 1, K, 1)
+        pj_b = psi_a[j][:, :, None, :]  # (N, k, 1, K)
+        e1, e2, e3, eW, eb = (np.reshape(e, (-1, 1, 1, 1)) if np.ndim(e) else e for e in self._eta_terms())
+        z = e1 * pi_a + e2 * pj_b + e3 * pi_a * pj_b + eb + eW * (w01 - 0.5)[:, :, None, None]
+        edge_a = (sigmoid(z) * probs[j][:, :, None, :]).sum(axis=3)  # (N, k, K): E[ψ_ij | a_i = a]
+        edge_a *= valid[:, :, None]
+
+        own_a = np.einsum("nk,nka->na", P_t, edge_a)  # P(own edge escalates | a)
+        own = (probs * own_a).sum(axis=1)
+        q = P_t * np.einsum("na,nka->nk", probs, edge_a)  # P(i targets slot k and it escalates)
+        log_none = np.zeros(n)
+        np.add.at(log_none, j[valid], np.log1p(-np.clip(q[valid], 0.0, 1.0 - 1e-15)))
+        p_in = -np.expm1(log_none)  # P(someone escalates against i)
+        p_esc_a = 1.0 - (1.0 - own_a) * (1.0 - p_in)[:, None]
+
+        self.doctrine_rules.apply_expected(arr, probs, self.doctrine_update_every)
+
+        # Phase 3: expected learning and state dynamics
+        s_ok = np.clip(ab.success, 0.05, 0.95)[None, :]
+        s_pen = np.clip(ab.success - ab.penalty, 0.05, 0.95)[None, :]
+        succ_a = (1.0 - p_esc_a) * s_ok + p_esc_a * s_pen
+        e_success = (probs * succ_a).sum(axis=1)
+        p_hurt = (probs * p_esc_a * (1.0 - s_pen)).sum(axis=1)
+
+        lr = 0.05
+        arr.omega_a[:] = (1 - lr) * arr.omega_a + lr * probs
+        arr.omega_a /= arr.omega_a.sum(axis=1, keepdims=True) + 1e-12
+        arr.p_ab[:, 0] += e_success
+        arr.p_ab[:, 1] += 1.0 - e_success
+        arr.r_ab[:, 1] += p_hurt
+        arr.r_ab[:, 0] += 0.3 * (1.0 - p_hurt)
+        arr.refresh_beliefs()
+
+        tension_prev, resource_prev = arr.tension.copy(), arr.resource.copy()
+        # ستون‌های هر کشور مثل مسیر loop حالتِ ابتدای گام را ثبت می‌کنند.
+        E_U = (probs * U).sum(axis=1)
+        dyn = self.dyn
+        base = dyn.alpha0 + dyn.alpha_v * arr.v_c + dyn.alpha_a * E_U - dyn.alpha_r * resource_norm
+        t_next = (probs * np.clip(sigmoid(base[:, None] + dyn.alpha_psi * psi_a), 0.0, 1.0)).sum(axis=1)
+        spend_a = arr.chi_c[:, None] * ab.table[None, :, 2] * (50.0 * (arr.resource / 1000.0))[:, None]
+        r_next = (probs * np.maximum(0.0, (arr.resource + arr.income_c)[:, None] - spend_a)).sum(axis=1)
+        arr.resource[:] = r_next
+        arr.tension[:] = t_next
+
+        rec = self.recording
+        if rec.records(t):
+            self.summary.record_expected(t, arr, probs, psi, own)
+        if rec.rows and rec.records(t):
+            row = {"Time": int(t), "Global_Escalation": float(-np.expm1(np.log1p(-np.clip(own, 0.0, 1.0 - 1e-15)).sum()))}
+            for i, name in enumerate(arr.names):
+                for family, value in (("Tension", tension_prev[i]), ("Resource", resource_prev[i]), ("Psi", psi[i])):
+                    if rec.keeps(family):
+                        row[f"{family}_{name}"] = float(value)
+                if rec.keeps("ActionProb"):
+                    for a in range(K):
+                        row[f"ActionProb_{ab.codes[a]}_{name}"] = float(probs[i, a])
+            self.history.append(row)
+        if self.steady is not None:
+            self.steady.observe(t, arr, probs)
+        return probs, psi, own
+
+    def run(self, steps: int, t0: int = 0, fast_forward: bool = False):
+        """Advance ``steps`` steps starting at time ``t0``.
+
+        With ``fast_forward=True`` (and ``steady_tol > 0``) the rest of the horizon is skipped
+        with :meth:`fast_forward` as soon as a steady state is detected.
+        """
+        end = int(t0) + int(steps)
+        for t in range(int(t0), end):
+            self.step(t)
+            if fast_forward and self.steady is not None and self.steady.steady and t + 1 < end:
+                return self.fast_forward(end - t - 1, t + 1)
+        return self
+
+    # ---------- fast-forward of a stationary regime ----------
+    def fast_forward(self, steps: int, t0: int):
+        """Skip ``steps`` steps from ``t0`` using the detected stationary regime instead of simulating.
+
+        Resources: for a fixed action distribution the recurrence ``r ← r + μ_c − spend`` is linear,
+        ``E[r'] = μ_c + (1 − k_c) r`` with ``k_c = 0.05 · χ_c · Σ_a p_a cost_a``, so it is rolled
+        forward in closed form ``r_s = r* + (1 − k_c)^s (r_0 − r*)``, ``r* = μ_c / k_c`` (p = the
+        current choice probabilities). Other per-step outputs (history rows, summary rows, dyad
+        tensors) are resampled from the last ``window`` recorded steps, with their resource
+        columns replaced by the closed-form path. Belief and action counters advance at their
+        observed per-step rate; doctrine drift and (α, η) refits are frozen over the skipped
+        stretch. With refits on, the coefficients keep wandering in a full run (each fit re-learns
+        from data its predecessor generated), so long fast-forwarded horizons are only as good as
+        the frozen coefficients. Logs a ``fast_forward`` event in ``self.steady.events``.
+        """
+        det = self.steady
+        if det is None or not det.steady:
+            raise ValueError("fast_forward needs a detected steady state (steady_tol > 0)")
+        steps, t0 = int(steps), int(t0)
+        if steps <= 0:
+            return self
+        arr, ab = self.arrays, self.action_bases
+        arr.own(*arr.DYNAMIC)
+
+        # منابع: بازگشت خطی با توزیع اقدام ثابت، حل بسته
+        probs = batch_choice_probs(arr, ab)
+        k = np.clip(0.05 * arr.chi_c * (probs @ ab.table[:, 2]), 0.0, 1.0)
+        s = np.arange(steps + 1)[:, None]
+        r0 = arr.resource[None, :]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            r_star = np.where(k > 0, arr.income_c / k, 0.0)
+            path = np.where(k > 0, r_star + (1.0 - k) ** s * (r0 - r_star), r0 + s * arr.income_c)
+        path = np.maximum(path, 0.0)  # path[s] = منابع قبل از گام t0 + s
+
+        # شمارنده‌ها با نرخ مشاهده‌شده در پنجره‌های اخیر
+        rates = det.rates(t0 - 1, arr)
+        arr.p_ab += rates["p_ab"] * steps
+        arr.r_ab += rates["r_ab"] * steps
+        arr.action_counts += np.rint(rates["action_counts"] * steps).astype(arr.action_counts.dtype)
+        arr.refresh_beliefs()
+        arr.resource[:] = path[-1]
+
+        # خروجی‌های هر گام: نمونه‌گیری از پنجره پایا
+        if self.engine == "loop":
+            def draw(m):
+                return np.random.randint(0, m, size=steps)
+        else:
+            gen = self.streams.generator("steady")
+
+            def draw(m):
+                return gen.integers(0, m, size=steps)
+        names = arr.names
+        recorded = self.recording.records
+        # فقط گام‌هایی که با stride ثبت می‌شدند ردیف می‌گیرند (قرعه‌ها همان تعداد می‌مانند)
+        if self.history:
+            src = self.history[-det.window:]
+            idx = draw(len(src))
+            for j, i in enumerate(idx):
+                if not recorded(t0 + j):
+                    continue
+                row = dict(src[i])
+                row["Time"] = t0 + j
+                for c, name in enumerate(names):
+                    if f"Resource_{name}" in row:
+                        row[f"Resource_{name}"] = float(path[j, c])
+                self.history.append(row)
+        if self.summary.rows:
+            rows = self.summary.rows
+            src = {key: v[-det.window:] for key, v in rows.items()}
+            idx = draw(len(src["Time"]))
+            for j, i in enumerate(idx):
+                if not recorded(t0 + j):
+                    continue
+                for key, v in src.items():
+                    rows[key].append(v[i])
+                rows["Time"][-1] = t0 + j
+                rows["Mean_Resource"][-1] = float(path[j + 1].mean())
+                self.summary._emit()
+        det.events.append({"Time": t0, "event": "fast_forward", "drift": det.drift, "steps": steps})
+        return self
@@ -0,0 +1,219 @@
+# policy_search.py
+# -------------------------------------------------------------------
+# جستجوی سیاست: کدام پارامترهای دکترین/راهبرد یک کشور (مثلاً rho_c، d_c، omega_S)
+# تنش مورد انتظارش را کمینه می‌کند و منابعش را بالای یک کف نگه می‌دارد؟
+# - روش: cross-entropy (CEM) روی مختصات بدون قید (sigmoid برای بازه‌ها، softmax برای وزن‌ها).
+# - ارزیابی دسته‌ای: C نامزد × R تکرار Monte Carlo در یک جهان برداری C·R·N ردیفی
+#   (MultiAgentWorld.replicate) اجرا می‌شوند؛ همه نامزدها همان R سناریوی تصادفی را می‌بینند
+#   (اعداد تصادفی مشترک، CRN) پس تفاوت نامزدها نویز نمونه‌گیری کمتری دارد.
+# - دسته‌ها (batch_size نامزد) روی Executor دلخواه (مثلاً ProcessPoolExecutor) پخش می‌شوند.
+# - خروجی: همه نامزدهای ارزیابی‌شده، جبهه پارتو (تنش ↓، کمینه منابع ↑) و بهترین نامزد مجاز.
+# -------------------------------------------------------------------
+
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from model5 import AgentArrays, sigmoid
+
+SIMPLEX_FIELDS = ("omega_S", "omega_C", "omega_R", "omega_a")
+# وزن‌های نرمال‌شده (جمع = 1)
+
+
+class PolicySpace:
+    """Searchable parameters of one country and their unconstrained coordinates ``z``.
+
+    Scalar ``AgentArrays`` fields map through ``lo + (hi − lo)·σ(z)`` (``bounds[field] = (lo, hi)``);
+    weight vectors in ``SIMPLEX_FIELDS`` through a softmax of one coordinate per component.
+    """
+
+    def __init__(self, world, country, params=("rho_c", "d_c", "omega_S"), bounds=None):
+        names = list(world.names)
+        self.country = country
+        self.row = names.index(country) if not isinstance(country, (int, np.integer)) else int(country)
+        self.params = tuple(params)
+        self.bounds, self.slices, self.labels = {}, {}, []
+        k = 0
+        for f in self.params:
+            value = np.asarray(getattr(world.arrays, f)[self.row], dtype=float)
+            if f in SIMPLEX_FIELDS:
+                self.slices[f] = slice(k, k + value.size)
+                self.labels += [f"{f}[{j}]" for j in range(value.size)]
+                k += value.size
+                continue
+            if f not in AgentArrays.SCALARS:
+                raise ValueError(f"unknown AgentArrays field {f!r}")
+            # پارامترهای بازه [0,1] همان بازه را می‌گیرند؛ بقیه پیش‌فرض نصف تا دو برابر مقدار فعلی
+            lo, hi = (bounds or {}).get(f, (0.0, 1.0) if f in AgentArrays.UNIT_FIELDS
+                                        else (0.5 * float(value), 2.0 * float(value)))
+            self.bounds[f] = (float(lo), float(hi))
+            self.slices[f] = slice(k, k + 1)
+            self.labels.append(f)
+            k += 1
+        self.dim = k
+
+    def decode(self, Z) -> dict:
+        """(C, dim) coordinates → ``{field: (C,) or (C, K) values}``."""
+        Z = np.atleast_2d(np.asarray(Z, dtype=float))
+        out = {}
+        for f, sl in self.slices.items():
+            z = Z[:, sl]
+            if f in SIMPLEX_FIELDS:
+                ex = np.exp(z - z.max(axis=1, keepdims=True))
+                out[f] = ex / ex.sum(axis=1, keepdims=True)
+            else:
+                lo, hi = self.bounds[f]
+                out[f] = lo + (hi - lo) * sigmoid(z[:, 0])
+        return out
+
+    def encode(self, values: dict) -> np.ndarray:
+        """Inverse of :meth:`decode` for one candidate ``{field: value}``."""
+        z = np.zeros(self.dim)
+        for f, sl in self.slices.items():
+            v = np.asarray(values[f], dtype=float)
+            if f in SIMPLEX_FIELDS:
+                z[sl] = np.log(np.maximum(v / v.sum(), 1e-9))
+            else:
+                lo, hi = self.bounds[f]
+                p = np.clip((float(v) - lo) / (hi - lo), 1e-6, 1.0 - 1e-6)
+                z[sl] = np.log(p) - np.log1p(-p)
+        return z
+
+    def current(self, world) -> np.ndarray:
+        return self.encode({f: getattr(world.arrays, f)[self.row] for f in self.params})
+
+    def frame(self, Z) -> pd.DataFrame:
+        vals = self.decode(Z)
+        cols = {}
+        for f in self.params:
+            v = vals[f]
+            if v.ndim == 1:
+                cols[f] = v
+            else:
+                cols.update({f"{f}[{j}]": v[:, j] for j in range(v.shape[1])})
+        return pd.DataFrame(cols)
+
+
+# -------------------------------------------------------------------
+# ارزیابی دسته‌ای با CRN
+# -------------------------------------------------------------------
+def evaluate_candidates(world, space: PolicySpace, Z, replicas: int = 8, horizon: int = 70, t0: int = 0,
+                        seed=0, floor: float = 0.0) -> pd.DataFrame:
+    """Run every candidate in ``Z`` (C, dim) for ``replicas`` Monte Carlo runs in one batched world.
+
+    All candidates see the same ``replicas`` random scenarios (CRN), so the same ``seed`` gives
+    comparable numbers across calls. Per candidate, for the searched country: ``tension`` (mean
+    over runs and steps) and its standard error over runs, ``resource_min`` (mean over runs of
+    the lowest resource), ``resource_final``, and ``p_breach`` (share of runs that went below
+    ``floor``).
+    """
+    Z = np.atleast_2d(np.asarray(Z, dtype=float))
+    C, R, n = len(Z), int(replicas), world.arrays.n
+    big = world.replicate(C * R, seed=seed, crn_blocks=C)
+    rows = np.arange(C * R) * n + space.row
+    arr = big.arrays
+    for f, v in space.decode(Z).items():
+        getattr(arr, f)[rows] = np.repeat(v, R, axis=0)
+    tension = np.zeros(C * R)
+    res_min = arr.resource[rows].copy()
+    for t in range(int(t0), int(t0) + int(horizon)):
+        big.step(t)
+        arr = big.arrays
+        tension += arr.tension[rows]
+        np.minimum(res_min, arr.resource[rows], out=res_min)
+    tension = (tension / max(1, int(horizon))).reshape(C, R)
+    res_min = res_min.reshape(C, R)
+    se = tension.std(axis=1, ddof=1) / np.sqrt(R) if R > 1 else np.zeros(C)
+    return pd.DataFrame({
+        "tension": tension.mean(axis=1), "tension_se": se,
+        "resource_min": res_min.mean(axis=1), "resource_final": arr.resource[rows].reshape(C, R).mean(axis=1),
+        "p_breach": (res_min < float(floor)).mean(axis=1),
+    })
+
+
+def _evaluate_chunk(args):
+    world, space, Z, kwargs = args
+    return evaluate_candidates(world, space, Z, **kwargs)
+
+
+def evaluate_batched(world, space: PolicySpace, Z, batch_size: int = 256, executor=None, **kwargs) -> pd.DataFrame:
+    """:func:`evaluate_candidates` in chunks of ``batch_size`` candidates, optionally on an executor.
+
+    Every chunk uses the same seed, so CRN holds across chunks and workers.
+    """
+    Z = np.atleast_2d(np.asarray(Z, dtype=float))
+    jobs = [(world, space, Z[i:i + int(batch_size)], kwargs) for i in range(0, len(Z), int(batch_size))]
+    parts = executor.map(_evaluate_chunk, jobs) if executor is not None else map(_evaluate_chunk, jobs)
+    return pd.concat(list(parts), ignore_index=True)
+
+
+def pareto_front(df: pd.DataFrame, minimize: str = "tension", maximize: str = "resource_min") -> pd.DataFrame:
+    """Non-dominated rows for two objectives (``minimize`` lower is better, ``maximize`` higher)."""
+    order = np.lexsort((-df[maximize].to_numpy(), df[minimize].to_numpy()))
+    best = -np.inf
+    keep = []
+    for i in order:
+        v = df[maximize].iat[i]
+        if v > best:
+            keep.append(i)
+            best = v
+    return df.iloc[keep]
+
+
+# -------------------------------------------------------------------
+# جستجوی cross-entropy
+# -------------------------------------------------------------------
+@dataclass
+class PolicySearchResult:
+    candidates: pd.DataFrame  # همه نامزدهای ارزیابی‌شده (generation، پارامترها، معیارها، score)
+    pareto: pd.DataFrame  # جبهه پارتو تنش ↓ / کمینه منابع ↑
+    best: pd.Series  # کمترین تنش با منابع بالای کف (یا کمترین score اگر هیچ نامزدی مجاز نبود)
+    baseline: pd.Series  # پارامترهای فعلی کشور با همان سناریوها
+
+    @property
+    def evaluations(self) -> int:
+        return len(self.candidates)
+
+
+def cross_entropy_search(world, country, params=("rho_c", "d_c", "omega_S"), floor: float = 0.0,
+                         population: int = 200, generations: int = 10, elite: float = 0.1, replicas: int = 8,
+                         horizon: int = 70, t0: int = 0, seed=0, bounds=None, penalty: float = 10.0,
+                         smoothing: float = 0.7, batch_size: int = 256, executor=None) -> PolicySearchResult:
+    """Cross-entropy search for ``country``'s ``params`` from ``world``'s current state.
+
+    Each generation samples ``population`` candidates from a diagonal Gaussian over the
+    unconstrained coordinates, evaluates them with :func:`evaluate_batched` (CRN: the same
+    ``replicas`` scenarios for every candidate and generation) and refits the Gaussian to the
+    best ``elite`` share by ``score = tension + penalty · max(0, floor − resource_min) / scale``
+    with ``scale = max(|floor|, 1)``, so a floor of at most 1 (including the default 0) penalises
+    the raw shortfall (new parameters = ``smoothing`` · elite fit + the rest · old). The Pareto
+    front is taken over every evaluated candidate.
+    """
+    space = PolicySpace(world, country, params, bounds)
+    rng = np.random.default_rng(seed)
+    kwargs = dict(replicas=replicas, horizon=horizon, t0=t0, seed=seed, floor=floor)
+    mean, sd = space.current(world), np.full(space.dim, 1.0)
+    n_elite = max(2, int(round(float(elite) * int(population))))
+    scale = max(abs(float(floor)), 1.0)
+
+    def score(m):
+        return m["tension"] + float(penalty) * np.maximum(0.0, float(floor) - m["resource_min"]) / scale
+
+    frames = []
+    for g in range(int(generations)):
+        Z = mean + sd * rng.standard_normal((int(population), space.dim))
+        if g == 0:
+            Z[0] = mean
+        m = evaluate_batched(world, space, Z, batch_size=batch_size, executor=executor, **kwargs)
+        m["score"] = score(m)
+        frames.append(pd.concat([pd.DataFrame({"generation": g}, index=m.index), space.frame(Z), m], axis=1))
+        top = Z[np.argsort(m["score"].to_numpy())[:n_elite]]
+        mean = smoothing * top.mean(axis=0) + (1.0 - smoothing) * mean
+        sd = smoothing * top.std(axis=0) + (1.0 - smoothing) * sd
+
+    cand = pd.concat(frames, ignore_index=True)
+    ok = cand[cand["resource_min"] >= float(floor)]
+    best = (ok.loc[ok["tension"].idxmin()] if len(ok) else cand.loc[cand["score"].idxmin()])
+    base = evaluate_candidates(world, space, space.current(world)[None], **kwargs).iloc[0]
+    return PolicySearchResult(cand, pareto_front(cand), best, pd.concat([space.frame(space.current(world)[None]).iloc[0], base]))
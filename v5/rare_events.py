@@ -0,0 +1,223 @@
+# rare_events.py
+# -------------------------------------------------------------------
+# برآورد احتمال رویدادهای نادر (مثل «k گام پیاپی با تشدید در دست‌کم m دوتایی»)
+# با روش تقسیم چندمرحله‌ای (multilevel splitting، نسخه fixed-effort):
+# - یک «امتیاز مسیر» غیرنزولی تعریف می‌شود (بیشینه تنش، تعداد تجمعی تشدید، طول رشته تشدید).
+# - آستانه‌های میانی L1 < L2 < ... < Lm (= رویداد هدف) انتخاب می‌شوند.
+# - از مسیرهایی که به آستانه k رسیده‌اند (با clone وضعیت جهان) n مسیر تازه ساخته می‌شود
+#   و فقط تا رسیدن به آستانه بعد یا پایان افق ادامه می‌یابند.
+# - برآورد = حاصل‌ضرب کسر موفق هر مرحله (نااریب) به‌همراه خطای استاندارد.
+# نمونه‌گیری مستقیم برای p ~ 1e-4 حدود 1e6 اجرا لازم دارد؛ اینجا هزینه از مرتبه n·m اجرا است.
+# -------------------------------------------------------------------
+
+import copy
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+
+# -------------------------------------------------------------------
+# امتیاز مسیر: هر کلاس وضعیت خودش را نگه می‌دارد و با clone جهان کپی می‌شود.
+# update بعد از هر گام صدا زده می‌شود و مقدار جاری (غیرنزولی) را برمی‌گرداند.
+# امتیازها آخرین سطر summary را می‌خوانند، پس جهان باید هر گام را ثبت کند (_check_world).
+# -------------------------------------------------------------------
+def _last(world, column: str) -> float:
+    col = world.summary.rows.get(column)
+    if not col:
+        raise KeyError(f"summary column {column!r} not recorded; use engine='vectorized'")
+    return float(col[-1])
+
+
+def _check_world(world):
+    if world.engine != "vectorized":
+        raise ValueError("multilevel splitting needs engine='vectorized' (cloneable random streams)")
+    rec = world.recording
+    if rec.level == "none" or int(rec.stride) != 1:
+        # با stride > 1 گام‌های ثبت‌نشده سطر قبلی را دوباره می‌خوانند (رشته و مجموع چند بار شمرده می‌شوند)
+        raise ValueError("path scores need a summary row every step: use a recording with stride=1 "
+                         f"and level other than 'none' (got level={rec.level!r}, stride={rec.stride})")
+
+
+class PathScore(ABC):
+    """Running, nondecreasing score of one trajectory (read from the world's summary after each step)."""
+
+    def __init__(self):
+        self.value = 0.0
+
+    @abstractmethod
+    def observe(self, world) -> float:
+        """Score contribution of the step just taken."""
+
+    def update(self, world) -> float:
+        self.value = max(self.value, self.observe(world))
+        return self.value
+
+
+class EscalationStreak(PathScore):
+    """Longest run of consecutive steps with at least ``min_dyads`` escalated dyads.
+
+    Reaching level ``k`` is the event "≥ k consecutive steps with escalation across ≥ m dyads".
+    """
+
+    def __init__(self, min_dyads: int = 1, column: str = "Escalations"):
+        super().__init__()
+        self.min_dyads = min_dyads
+        self.column = column
+        self.streak = 0
+
+    def observe(self, world) -> float:
+        self.streak = self.streak + 1 if _last(world, self.column) >= self.min_dyads else 0
+        return float(self.streak)
+
+
+class MaxTension(PathScore):
+    """Largest mean tension (or, with ``per_country=True``, largest single-country tension) so far."""
+
+    def __init__(self, per_country: bool = False):
+        super().__init__()
+        self.per_country = per_country
+
+    def observe(self, world) -> float:
+        return float(world.arrays.tension.max()) if self.per_country else _last(world, "Mean_Tension")
+
+
+class CumulativeEscalations(PathScore):
+    """Total escalated dyads since the start of the trajectory."""
+
+    def __init__(self, column: str = "Escalations"):
+        super().__init__()
+        self.column = column
+        self.total = 0.0
+
+    def observe(self, world) -> float:
+        self.total += _last(world, self.column)
+        return self.total
+
+
+# -------------------------------------------------------------------
+@dataclass
+class SplittingResult:
+    estimate: float
+    se: float
+    level_probs: np.ndarray  # کسر موفق هر مرحله (برای تکرارها: میانگین)
+    levels: tuple
+    n_particles: int
+    steps: int  # هزینه کل بر حسب «گام جهان»
+    horizon: int
+    runs: np.ndarray = field(default_factory=lambda: np.zeros(0))  # برآورد هر تکرار مستقل
+
+    @property
+    def relative_error(self) -> float:
+        return self.se / self.estimate if self.estimate > 0 else np.inf
+
+    @property
+    def naive_steps(self) -> float:
+        """World steps direct sampling would need for the same standard error: ``horizon · p(1-p) / se²``."""
+        p = self.estimate
+        return self.horizon * p * (1.0 - p) / self.se ** 2 if self.se > 0 else np.inf
+
+    @property
+    def speedup(self) -> float:
+        return self.naive_steps / max(1, self.steps)
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame({"level": list(self.levels), "cond_prob": self.level_probs,
+                             "cum_prob": np.cumprod(self.level_probs)})
+
+
+@dataclass
+class _Particle:
+    world: object
+    score: PathScore
+    t: int
+
+
+def _advance(p: _Particle, level: float, t_end: int) -> tuple:
+    """Step particle until its score reaches ``level`` or time runs out; returns (hit, steps used)."""
+    used = 0
+    while p.t < t_end:
+        p.world.step(p.t)
+        p.t += 1
+        used += 1
+        if p.score.update(p.world) >= level:
+            return True, used
+    return p.score.value >= level, used
+
+
+def _split_once(world, make_score, levels, horizon, n, rng, t0):
+    def seeds(k):
+        return rng.integers(0, 2 ** 63 - 1, size=k)
+
+    particles = [_Particle(world.clone(seed=int(s)), make_score(), int(t0)) for s in seeds(n)]
+    t_end = int(t0) + int(horizon)
+    probs, steps = [], 0
+    for k, level in enumerate(levels):
+        hits = []
+        for p in particles:
+            hit, used = _advance(p, level, t_end)
+            steps += used
+            if hit:
+                hits.append(p)
+        probs.append(len(hits) / n)
+        if not hits:
+            probs.extend([0.0] * (len(levels) - k - 1))
+            break
+        if k + 1 < len(levels):
+            # بازنمونه‌گیری متوازن: هر بازمانده floor(n/r) فرزند، باقی‌مانده به‌تصادف
+            r = len(hits)
+            reps = np.full(r, n // r)
+            reps[rng.choice(r, n - reps.sum(), replace=False)] += 1
+            particles = [_Particle(h.world.clone(seed=int(s)), copy.deepcopy(h.score), h.t)
+                         for h, c in zip(hits, reps) for s in seeds(c)]
+    return np.asarray(probs, dtype=float), steps
+
+
+def multilevel_splitting(world, make_score, levels, horizon: int, n_particles: int = 200,
+                         n_repeats: int = 1, seed=None, t0: int = 0) -> SplittingResult:
+    """Fixed-effort multilevel splitting estimate of ``P(score reaches levels[-1] within horizon steps)``.
+
+    ``world`` is the starting state (vectorized engine recording a summary row every step; left
+    untouched, particles are clones with fresh random streams),
+    ``make_score()`` returns a new :class:`PathScore`, ``levels`` increasing thresholds whose last
+    entry defines the event. Each stage keeps the particles that hit the next threshold and
+    resamples ``n_particles`` clones from them at their hitting state; the product of stage
+    fractions is unbiased. The SE comes from ``n_repeats`` independent repetitions when > 1,
+    otherwise from the usual approximation ``Var ≈ p² · Σ (1 - p_k) / (n p_k)``.
+    """
+    _check_world(world)
+    levels = tuple(float(v) for v in levels)
+    if any(b <= a for a, b in zip(levels, levels[1:])):
+        raise ValueError("levels must be strictly increasing")
+    n = int(n_particles)
+    rng = np.random.default_rng(seed)
+    runs, stage, steps = [], [], 0
+    for _ in range(max(1, int(n_repeats))):
+        probs, used = _split_once(world, make_score, levels, horizon, n, rng, t0)
+        runs.append(float(np.prod(probs)))
+        stage.append(probs)
+        steps += used
+    runs = np.asarray(runs)
+    est = float(runs.mean())
+    if len(runs) > 1:
+        se = float(runs.std(ddof=1) / np.sqrt(len(runs)))
+    else:
+        pk = stage[0]
+        se = est * float(np.sqrt(np.sum((1.0 - pk) / (n * pk)))) if est > 0 else 0.0
+    return SplittingResult(estimate=est, se=se, level_probs=np.mean(stage, axis=0), levels=levels,
+                           n_particles=n, steps=steps, horizon=int(horizon), runs=runs)
+
+
+def naive_probability(world, make_score, level: float, horizon: int, n_runs: int, seed=None, t0: int = 0):
+    """Direct Monte Carlo estimate of the same event → ``(p, se, steps)``; runs stop early once it occurs."""
+    _check_world(world)
+    rng = np.random.default_rng(seed)
+    hits, steps = 0, 0
+    for s in rng.integers(0, 2 ** 63 - 1, size=int(n_runs)):
+        p = _Particle(world.clone(seed=int(s)), make_score(), int(t0))
+        hit, used = _advance(p, float(level), int(t0) + int(horizon))
+        hits += hit
+        steps += used
+    p = hits / int(n_runs)
+    return p, float(np.sqrt(p * (1.0 - p) / int(n_runs))), steps
@@ -0,0 +1,239 @@
+# registry.py
+# -------------------------------------------------------------------
+# دفتر محلی آزمایش‌ها (experiment registry):
+# - فهرست SQLite (registry.sqlite): هر اجرا با کلید هش canonical پیکربندی، نوع اجرا، سناریو،
+#   seed، نسخه موتور، زمان ثبت/اجرا و معیارهای خلاصه؛ پارامترها و معیارها در جدول run_values
+#   (کلید، نقش، کشور، نام، مقدار) تا پرس‌وجوهایی مثل «همه اجراهای scenario_3 با rho > 0.5» ممکن باشد.
+# - فایل‌های نتیجه ستونی: هر DataFrame در runs/<key>/<نام>/ با ChunkedHistoryWriter (npy)؛
+#   بقیه نتیجه (meta) pickle می‌شود.
+# - برخلاف ResultCache چیزی حذف نمی‌شود: نتایج بعد از پایان نشست و پاک شدن کش هم می‌مانند و
+#   پیش از شبیه‌سازی با همان کلید پیدا می‌شوند.
+# DuckDB لازم نیست: sqlite3 جزو کتابخانه استاندارد است.
+# -------------------------------------------------------------------
+
+import json
+import os
+import pickle
+import re
+import shutil
+import sqlite3
+import threading
+from contextlib import closing
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from history_store import ChunkedHistoryWriter, HistoryStore
+from result_cache import canonical_json
+
+OPS = ("<=", ">=", "!=", "<", ">", "=")
+# عملگرهای مجاز شرط‌ها (ترتیب مهم است: عملگرهای دوحرفی اول)
+RUN_COLUMNS = ("key", "kind", "scenario", "seed", "n_runs", "steps", "engine", "created", "elapsed")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    key TEXT PRIMARY KEY, kind TEXT, scenario TEXT, seed INTEGER, n_runs INTEGER, steps INTEGER,
+    engine TEXT, created TEXT, elapsed REAL, frames TEXT, config TEXT
+);
+CREATE TABLE IF NOT EXISTS run_values (
+    key TEXT NOT NULL, role TEXT NOT NULL, country TEXT NOT NULL, name TEXT NOT NULL, value REAL
+);
+CREATE INDEX IF NOT EXISTS run_values_name ON run_values (name, value);
+CREATE INDEX IF NOT EXISTS run_values_key ON run_values (key);
+CREATE INDEX IF NOT EXISTS runs_scenario ON runs (scenario, kind);
+"""
+
+_CONDITION = re.compile(r"^\s*([A-Za-z_][\w.]*)\s*(?:\[\s*([^\]]+?)\s*\])?\s*(<=|>=|!=|<|>|=)\s*(\S+)\s*$")
+
+
+def parse_conditions(text: str) -> list:
+    """``"rho > 0.5, Global_Escalation <= 0.3, rho[A] = 0.45"`` → ``[(name, country, op, value)]``.
+
+    Conditions are separated by commas or ``and``; ``name[country]`` restricts a per-country
+    parameter to one country (``None`` = any country).
+    """
+    out = []
+    for part in re.split(r",|،|\band\b", text or ""):
+        if not part.strip():
+            continue
+        m = _CONDITION.match(part)
+        if m is None:
+            raise ValueError(f"cannot read condition {part.strip()!r} (expected e.g. 'rho > 0.5')")
+        name, country, op, value = m.groups()
+        try:
+            out.append((name, country, op, float(value)))
+        except ValueError:
+            raise ValueError(f"condition {part.strip()!r} needs a number on the right") from None
+    return out
+
+
+def config_values(config: dict, prefix: str = "") -> list:
+    """Numeric leaves of a run configuration as ``(country, name, value)`` rows.
+
+    Lists of dicts with a ``"name"`` (agent configurations) become per-country rows; other
+    nested dicts are flattened with ``.`` (``steady.tol``).
+    """
+    out = []
+    for k, v in config.items():
+        name = f"{prefix}{k}"
+        if isinstance(v, dict):
+            out += config_values(v, f"{name}.")
+        elif isinstance(v, (list, tuple)) and v and all(isinstance(c, dict) and "name" in c for c in v):
+            for c in v:
+                out += [(str(c["name"]), f, float(x)) for f, x in c.items()
+                        if isinstance(x, (int, float, np.integer, np.floating)) and not isinstance(x, bool)]
+        elif isinstance(v, (bool, np.bool_, int, float, np.integer, np.floating)):
+            out.append(("", name, float(v)))
+    return out
+
+
+class ExperimentRegistry:
+    """Local, persistent catalog of simulation runs keyed by the canonical config hash.
+
+    Parameters
+    ----------
+    directory : str
+        Holds ``registry.sqlite`` and one ``runs/<key>/`` folder per run (columnar frames +
+        ``meta.pkl``). Nothing is evicted; :meth:`delete` removes a run.
+
+    :meth:`record` stores a finished run (files first, then the catalog row, so the catalog
+    never points at missing files), :meth:`load` returns it again, and :meth:`find` /
+    :meth:`sql` query the catalog. Every call opens its own SQLite connection, so one registry
+    can be shared between threads.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = str(directory)
+        os.makedirs(os.path.join(self.directory, "runs"), exist_ok=True)
+        self.db_path = os.path.join(self.directory, "registry.sqlite")
+        with closing(self._connect()) as con, con:
+            con.executescript(SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30.0)
+
+    def _run_dir(self, key: str) -> str:
+        return os.path.join(self.directory, "runs", key)
+
+    # ---------- ثبت و بازیابی ----------
+    def record(self, key: str, config: dict, frames: dict, meta=None, kind: str = "simulation", scenario: str = None,
+               seed=None, n_runs: int = 1, steps: int = None, engine: str = None, elapsed: float = None,
+               metrics: dict = None):
+        """Store a run: ``frames`` ``{name: DataFrame}`` as columnar files, ``meta`` pickled, and a
+        catalog row with ``config``'s numeric values (role ``param``) and ``metrics`` (role ``metric``;
+        ``{name: value}`` or ``{(country, name): value}``). Re-recording a key replaces the run."""
+        final = self._run_dir(key)
+        tmp = f"{final}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(tmp)
+            for name, df in frames.items():
+                with ChunkedHistoryWriter(os.path.join(tmp, name), chunk_rows=65536) as writer:
+                    writer.append_frame(df)
+            with open(os.path.join(tmp, "meta.pkl"), "wb") as fh:
+                pickle.dump(meta, fh, protocol=pickle.HIGHEST_PROTOCOL)
+            if os.path.exists(final):
+                shutil.rmtree(final)
+            os.replace(tmp, final)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        values = [(key, "param", c, n, v) for c, n, v in config_values(config)]
+        for name, v in (metrics or {}).items():
+            country, name = name if isinstance(name, tuple) else ("", name)
+            values.append((key, "metric", country, name, float(v)))
+        row = dict(key=key, kind=kind, scenario=scenario, seed=None if seed is None else int(seed), n_runs=int(n_runs),
+                   steps=None if steps is None else int(steps), engine=engine,
+                   created=datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                   elapsed=None if elapsed is None else float(elapsed),
+                   frames=json.dumps(list(frames)), config=canonical_json(config))
+        with closing(self._connect()) as con, con:
+            con.execute("DELETE FROM run_values WHERE key = ?", (key,))
+            con.execute(f"INSERT OR REPLACE INTO runs ({', '.join(row)}) VALUES ({', '.join('?' * len(row))})",
+                        tuple(row.values()))
+            con.executemany("INSERT INTO run_values VALUES (?, ?, ?, ?, ?)", values)
+
+    def load(self, key: str):
+        """``(frames, meta)`` of a recorded run, or ``None``. A run whose files are gone is dropped."""
+        with closing(self._connect()) as con:
+            hit = con.execute("SELECT frames FROM runs WHERE key = ?", (key,)).fetchone()
+        if hit is None:
+            return None
+        d = self._run_dir(key)
+        try:
+            frames = {name: HistoryStore(os.path.join(d, name)).to_frame() for name in json.loads(hit[0])}
+            with open(os.path.join(d, "meta.pkl"), "rb") as fh:
+                meta = pickle.load(fh)
+        except Exception:
+            # فایل‌ها حذف یا خراب شده‌اند: مثل نبودِ اجرا رفتار می‌کنیم
+            self.delete(key)
+            return None
+        return frames, meta
+
+    def __contains__(self, key: str) -> bool:
+        with closing(self._connect()) as con:
+            return con.execute("SELECT 1 FROM runs WHERE key = ?", (key,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        with closing(self._connect()) as con:
+            return con.execute("SELECT COUNT(*) FROM runs").fetchone()[0]
+
+    def delete(self, key: str):
+        with closing(self._connect()) as con, con:
+            con.execute("DELETE FROM run_values WHERE key = ?", (key,))
+            con.execute("DELETE FROM runs WHERE key = ?", (key,))
+        shutil.rmtree(self._run_dir(key), ignore_errors=True)
+
+    def config(self, key: str) -> dict:
+        with closing(self._connect()) as con:
+            hit = con.execute("SELECT config FROM runs WHERE key = ?", (key,)).fetchone()
+        return None if hit is None else json.loads(hit[0])
+
+    # ---------- پرس‌وجو ----------
+    def find(self, scenario: str = None, kind: str = None, engine: str = None, seed=None, where=None,
+             limit: int = None) -> pd.DataFrame:
+        """Catalog rows (newest first) with one column per scalar metric.
+
+        ``where`` is a list of ``(name, country, op, value)`` (see :func:`parse_conditions`) or the
+        condition text itself; a condition holds if any parameter or metric of that name (of
+        ``country`` if given) satisfies it, e.g. ``where="rho > 0.5"`` = some country has rho > 0.5.
+        """
+        if isinstance(where, str):
+            where = parse_conditions(where)
+        sql, args = [f"SELECT {', '.join(RUN_COLUMNS)} FROM runs WHERE 1 = 1"], []
+        for col, v in (("scenario", scenario), ("kind", kind), ("engine", engine), ("seed", seed)):
+            if v is not None:
+                sql.append(f"AND {col} = ?")
+                args.append(v)
+        for name, country, op, value in where or ():
+            if op not in OPS:
+                raise ValueError(f"operator must be one of {OPS}")
+            sql.append(f"AND EXISTS (SELECT 1 FROM run_values v WHERE v.key = runs.key AND v.name = ? "
+                       f"AND v.value {op} ?{' AND v.country = ?' if country is not None else ''})")
+            args += [name, float(value)] + ([country] if country is not None else [])
+        sql.append("ORDER BY created DESC, key")
+        if limit is not None:
+            sql.append(f"LIMIT {int(limit)}")
+        with closing(self._connect()) as con:
+            runs = pd.read_sql_query(" ".join(sql), con, params=args)
+            if runs.empty:
+                return runs
+            marks = ", ".join("?" * len(runs))
+            metrics = pd.read_sql_query(
+                f"SELECT key, name, value FROM run_values WHERE role = 'metric' AND country = '' AND key IN ({marks})",
+                con, params=list(runs["key"]))
+        if metrics.empty:
+            return runs
+        wide = metrics.pivot_table(index="key", columns="name", values="value", aggfunc="first")
+        return runs.merge(wide, left_on="key", right_index=True, how="left")
+
+    def values(self, key: str) -> pd.DataFrame:
+        """All parameters and metrics of one run (role, country, name, value)."""
+        with closing(self._connect()) as con:
+            return pd.read_sql_query("SELECT role, country, name, value FROM run_values WHERE key = ? "
+                                     "ORDER BY role, country, name", con, params=[key])
+
+    def sql(self, query: str, params=()) -> pd.DataFrame:
+        """Any read query on the catalog (tables ``runs`` and ``run_values``)."""
+        with closing(self._connect()) as con:
+            return pd.read_sql_query(query, con, params=list(params))
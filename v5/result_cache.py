@@ -0,0 +1,185 @@
+# result_cache.py
+# -------------------------------------------------------------------
+# کش نتایج شبیه‌سازی (content-addressed):
+# - کلید = هش canonical از پیکربندی کامل اجرا (عامل‌ها، W، گام‌ها، seed، ...)
+# - لایه ۱: حافظه (LRU)
+# - لایه ۲: دیسک (pickle) با حذف بر اساس حجم کل
+# - هر فراخوان کپی مستقل نتیجه را می‌گیرد؛ تغییر آن روی نسخه کش‌شده اثر ندارد
+# -------------------------------------------------------------------
+
+import copy
+import hashlib
+import json
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def _canonical(obj):
+    # تبدیل ورودی به ساختاری که JSON آن همیشه یکسان باشد
+    # (کلیدهای مرتب، numpy → list، float های مساوی → رشته یکسان).
+    if isinstance(obj, dict):
+        return {str(k): _canonical(v) for k, v in sorted(obj.items(), key=lambda kv: str(kv[0]))}
+    if isinstance(obj, (list, tuple)):
+        return [_canonical(v) for v in obj]
+    if isinstance(obj, np.ndarray):
+        return _canonical(obj.tolist())
+    if isinstance(obj, (bool, np.bool_)):
+        return bool(obj)
+    if isinstance(obj, (int, np.integer)):
+        return int(obj)
+    if isinstance(obj, (float, np.floating)):
+        x = float(obj)
+        # 1 و 1.0 باید یک کلید بدهند
+        return int(x) if x.is_integer() else repr(x)
+    return obj
+
+
+def canonical_json(config: dict) -> str:
+    """The JSON text :func:`config_hash` hashes (stable for equal configurations)."""
+    return json.dumps(_canonical(config), ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+
+def config_hash(config: dict) -> str:
+    """Canonical SHA-256 of a run configuration (order/type-insensitive for numbers)."""
+    return hashlib.sha256(canonical_json(config).encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """Two-tier result cache: in-memory LRU + on-disk pickle files with size-based eviction.
+
+    Parameters
+    ----------
+    directory : str or None
+        Where the disk tier lives. ``None`` disables the disk tier.
+    max_memory_items : int
+        Number of results kept in the in-memory LRU.
+    max_disk_bytes : int
+        Total size budget of the disk tier; least recently used files are removed first.
+
+    :meth:`get` returns a deep copy and :meth:`put` stores one, so callers may modify results
+    (e.g. add columns to a DataFrame) without changing what later callers receive.
+    """
+
+    def __init__(self, directory=None, max_memory_items: int = 32, max_disk_bytes: int = 512 * 1024 * 1024):
+        self.directory = directory
+        self.max_memory_items = int(max_memory_items)
+        self.max_disk_bytes = int(max_disk_bytes)
+        self._mem = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    # ---------- disk helpers ----------
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.pkl")
+
+    def _disk_files(self):
+        out = []
+        for fn in os.listdir(self.directory):
+            if not fn.endswith(".pkl"):
+                continue
+            p = os.path.join(self.directory, fn)
+            try:
+                st_ = os.stat(p)
+            except OSError:
+                continue
+            out.append((st_.st_mtime, st_.st_size, p))
+        return out
+
+    def _evict_disk(self):
+        files = self._disk_files()
+        total = sum(sz for _, sz, _ in files)
+        # قدیمی‌ترین دسترسی (mtime) زودتر حذف می‌شود
+        for _, sz, p in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(p)
+                total -= sz
+            except OSError:
+                pass
+
+    def _remember(self, key, value):
+        self._mem[key] = value
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_memory_items:
+            self._mem.popitem(last=False)
+
+    # ---------- public API ----------
+    def get(self, key: str, default=None):
+        with self._lock:
+            if key in self._mem:
+                self._mem.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return copy.deepcopy(self._mem[key])
+
+            if self.directory:
+                p = self._path(key)
+                if os.path.exists(p):
+                    try:
+                        with open(p, "rb") as fh:
+                            value = pickle.load(fh)
+                        os.utime(p)  # ثبت دسترسی برای LRU دیسک
+                    except Exception:
+                        # فایل خراب: حذف و ادامه مثل miss
+                        try:
+                            os.remove(p)
+                        except OSError:
+                            pass
+                    else:
+                        self._remember(key, copy.deepcopy(value))
+                        self.stats["disk_hits"] += 1
+                        return value
+
+            self.stats["misses"] += 1
+            return default
+
+    def put(self, key: str, value):
+        with self._lock:
+            self._remember(key, copy.deepcopy(value))
+            if not self.directory:
+                return
+            p = self._path(key)
+            tmp = f"{p}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp, "wb") as fh:
+                    pickle.dump(value, fh, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp, p)  # نوشتن اتمیک
+            except Exception:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+                return
+            self._evict_disk()
+
+    def get_or_compute(self, key: str, compute):
+        """Return the cached value for ``key``; otherwise call ``compute()`` and store it."""
+        _missing = object()
+        value = self.get(key, _missing)
+        if value is not _missing:
+            return value
+        value = compute()
+        self.put(key, value)
+        return value
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            if key in self._mem:
+                return True
+            return bool(self.directory) and os.path.exists(self._path(key))
+
+    def clear(self):
+        with self._lock:
+            self._mem.clear()
+            if self.directory:
+                for _, _, p in self._disk_files():
+                    try:
+                        os.remove(p)
+                    except OSError:
+                        pass
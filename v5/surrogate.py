@@ -0,0 +1,319 @@
+# surrogate.py
+# -------------------------------------------------------------------
+# شبیه‌ساز جایگزین (emulator) برای پاسخ فوری «چه می‌شد اگر»:
+# - طرح آزمایش: ابرمکعب لاتین (LHS) روی بازه پارامترهای انتخابی کشورها (مثلاً rho_c[A]).
+# - داده آموزش: M نقطه طرح × R تکرار در یک جهان برداری M·R·N ردیفی (MultiAgentWorld.replicate).
+#   تکرارها مستقل‌اند (بدون CRN): با سناریوهای مشترک خطای مشترک وارد سطح پاسخ می‌شد و نویز
+#   برازش‌شده مدل، نویز Monte Carlo یک اجرای تازه را کم برآورد می‌کرد.
+# - خروجی‌ها: میانگین نرخ تشدید و تشدید جهانی در طول اجرا، تنش و منابع هر کشور در گام آخر
+#   (همان ردیف آخر history اپ).
+# - مدل: فرایند گاوسی با هسته RBF و طول‌مقیاس جدا برای هر ورودی (ARD) برای هر خروجی؛
+#   ابرپارامترها (و نویز Monte Carlo) با صعود گرادیان روی درست‌نمایی حاشیه‌ای، برای همه خروجی‌ها
+#   یک‌جا (ماتریس‌های دسته‌ای).
+# - پیش‌بینی: میانگین و انحراف معیار با K⁻¹ و α ازپیش‌محاسبه (بدون حل دستگاه در زمان پرس‌وجو).
+# - دقت: باقی‌مانده‌های leave-one-out به فرم بسته (RMSE، R²، پوشش بازه ۹۵٪) و در صورت وجود،
+#   نقطه‌های آزمون جدا.
+# ضرایب α/η در جهان دسته‌ای ثابت‌اند (برازش بیزی خاموش)؛ اجرای واقعی اپ آن‌ها را به‌روز می‌کند،
+# پس مقایسه با اجرای واقعی بخشی از ارزیابی دقت است.
+# -------------------------------------------------------------------
+
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from model5 import AgentArrays
+
+
+def latin_hypercube(m: int, d: int, rng) -> np.ndarray:
+    """(m, d) Latin hypercube sample in [0, 1]: one point per row-stratum of every dimension."""
+    u = (np.arange(int(m))[:, None] + rng.random((int(m), int(d)))) / int(m)
+    for k in range(int(d)):
+        u[:, k] = u[rng.permutation(int(m)), k]
+    return u
+
+
+class DesignSpace:
+    """Emulator inputs: ``AgentArrays`` scalar fields of one country (``"rho_c[A]"``) or of
+    every country (``"rho_c"``), each with a range ``bounds[label or field] = (lo, hi)`` (default
+    [0, 1] for ``AgentArrays.UNIT_FIELDS``, half to twice the current value otherwise).
+    """
+
+    def __init__(self, world, names, bounds=None):
+        countries = list(world.names)
+        bounds = bounds or {}
+        self.labels, self.fields, self.rows, lo, hi = [], [], [], [], []
+        for spec in names:
+            f, _, who = spec.partition("[")
+            if f not in AgentArrays.SCALARS:
+                raise ValueError(f"unknown AgentArrays scalar field {f!r}")
+            rows = [countries.index(who.rstrip("]"))] if who else range(len(countries))
+            for i in rows:
+                label = f"{f}[{countries[i]}]"
+                value = float(getattr(world.arrays, f)[i])
+                default = (0.0, 1.0) if f in AgentArrays.UNIT_FIELDS else (0.5 * value, 2.0 * value)
+                a, b = bounds.get(label, bounds.get(f, default))
+                if not b > a:
+                    raise ValueError(f"empty range for {label}: ({a}, {b})")
+                self.labels.append(label)
+                self.fields.append(f)
+                self.rows.append(i)
+                lo.append(float(a))
+                hi.append(float(b))
+        self.lo, self.hi = np.array(lo), np.array(hi)
+
+    @property
+    def dim(self) -> int:
+        return len(self.labels)
+
+    def scale(self, X) -> np.ndarray:
+        """Parameter values (…, dim) → unit cube coordinates."""
+        return (np.asarray(X, dtype=float) - self.lo) / (self.hi - self.lo)
+
+    def unscale(self, U) -> np.ndarray:
+        return self.lo + np.asarray(U, dtype=float) * (self.hi - self.lo)
+
+    def current(self, world) -> np.ndarray:
+        return np.array([getattr(world.arrays, f)[i] for f, i in zip(self.fields, self.rows)], dtype=float)
+
+    def contains(self, x) -> bool:
+        x = np.asarray(x, dtype=float)
+        return bool(np.all(x >= self.lo - 1e-12) and np.all(x <= self.hi + 1e-12))
+
+    def sample(self, m: int, seed=None) -> np.ndarray:
+        """(m, dim) Latin hypercube design in parameter units."""
+        return self.unscale(latin_hypercube(m, self.dim, np.random.default_rng(seed)))
+
+
+# -------------------------------------------------------------------
+# داده آموزش: شبیه‌سازی دسته‌ای نقطه‌های طرح با CRN
+# -------------------------------------------------------------------
+def output_names(world) -> list:
+    return ["Escalation_Rate", "Global_Escalation"] + [f"{p}_{c}" for p in ("Tension", "Resource") for c in world.names]
+
+
+def simulate_design(world, space: DesignSpace, X, steps: int = 70, replicas: int = 4, t0: int = 0, seed=0,
+                    return_sd: bool = False):
+    """Run every design point in ``X`` (M, dim) for ``replicas`` independent Monte Carlo runs in one batched world.
+
+    Returns one row per point with the replica means of :func:`output_names`: escalation rate
+    and global escalation averaged over the steps, and every country's tension/resource in the
+    last history row (the state entering step ``t0 + steps − 1``). With ``return_sd=True`` also
+    returns the per-point SD of a single run (over the replicas).
+    """
+    X = np.atleast_2d(np.asarray(X, dtype=float))
+    M, R, n, steps = len(X), int(replicas), world.arrays.n, int(steps)
+    big = world.replicate(M * R, seed=seed)
+    arr = big.arrays
+    base = np.arange(M * R) * n
+    for j, (f, i) in enumerate(zip(space.fields, space.rows)):
+        getattr(arr, f)[base + i] = np.repeat(X[:, j], R)
+    rate, glob = np.zeros(M * R), np.zeros(M * R)
+    tension, resource = arr.tension, arr.resource
+    for t in range(int(t0), int(t0) + steps):
+        if t == int(t0) + steps - 1:
+            tension, resource = big.arrays.tension.copy(), big.arrays.resource.copy()
+        _, _, _, y = big.step(t)
+        y = np.asarray(y, dtype=float).reshape(M * R, n)
+        rate += y.mean(axis=1)
+        glob += y.max(axis=1)
+    out = {"Escalation_Rate": rate / max(1, steps), "Global_Escalation": glob / max(1, steps)}
+    for p, values in (("Tension", tension), ("Resource", resource)):
+        x = values.reshape(M * R, n)
+        for i, c in enumerate(world.names):
+            out[f"{p}_{c}"] = x[:, i]
+    means = pd.DataFrame({k: v.reshape(M, R).mean(axis=1) for k, v in out.items()})
+    if not return_sd:
+        return means
+    return means, pd.DataFrame({k: v.reshape(M, R).std(axis=1, ddof=1) if R > 1 else np.zeros(M) for k, v in out.items()})
+
+
+def _simulate_chunk(args):
+    world, space, X, kwargs = args
+    return simulate_design(world, space, X, return_sd=True, **kwargs)
+
+
+# -------------------------------------------------------------------
+# فرایند گاوسی (ARD-RBF) برای چند خروجی به‌صورت دسته‌ای
+# -------------------------------------------------------------------
+class GaussianProcess:
+    """Independent zero-mean GPs (one per output column) on standardized outputs.
+
+    Kernel ``k(x, x') = σ_f² exp(−½ Σ_d (x_d − x'_d)² / ℓ_d²)`` plus a noise nugget σ_n² on the
+    diagonal; hyperparameters maximize the log marginal likelihood (with a log-normal prior on
+    the lengthscales) by Adam on their logs, analytic gradients, all outputs at once. A known
+    noise variance (e.g. Monte Carlo variance of the replica mean) can be passed to :meth:`fit`
+    instead of learning σ_n².
+    """
+
+    LOG_BOUNDS = dict(ls=(np.log(0.05), np.log(50.0)), sf2=(np.log(1e-4), np.log(1e2)), sn2=(np.log(1e-6), np.log(2.0)))
+
+    def __init__(self, iters: int = 200, lr: float = 0.05, max_fit: int = 128, ls_prior_sd: float = 2.0,
+                 jitter: float = 1e-8, seed=0):
+        self.iters, self.lr, self.max_fit, self.jitter, self.seed = int(iters), float(lr), int(max_fit), float(jitter), seed
+        self.ls_prior_sd = float(ls_prior_sd)
+
+    def _kernels(self, D2, log_ls, log_sf2, log_sn2):
+        Kf = np.exp(log_sf2)[:, None, None] * np.exp(-0.5 * np.tensordot(np.exp(-2.0 * log_ls), D2, axes=(1, 0)))
+        K = Kf + (np.exp(log_sn2) + self.jitter)[:, None, None] * np.eye(D2.shape[1])
+        return Kf, K
+
+    def _optimize(self, X, Z, log_sn2=None):
+        # صعود Adam روی لگاریتم ابرپارامترها؛ هزینه هر تکرار O(O·m³) پس روی حداکثر max_fit نقطه
+        O, d = Z.shape[0], X.shape[1]
+        D2 = (X.T[:, :, None] - X.T[:, None, :]) ** 2  # (d, m, m)
+        theta0 = np.log(np.sqrt(d) / 2.0)
+        theta = np.concatenate([np.full((O, d), theta0), np.zeros((O, 1)),
+                                np.full((O, 1), np.log(0.3)) if log_sn2 is None else log_sn2[:, None]], axis=1)
+        lo = np.r_[[self.LOG_BOUNDS["ls"][0]] * d, self.LOG_BOUNDS["sf2"][0], self.LOG_BOUNDS["sn2"][0]]
+        hi = np.r_[[self.LOG_BOUNDS["ls"][1]] * d, self.LOG_BOUNDS["sf2"][1], self.LOG_BOUNDS["sn2"][1]]
+        m1, m2 = np.zeros_like(theta), np.zeros_like(theta)
+        for it in range(1, self.iters + 1):
+            Kf, K = self._kernels(D2, theta[:, :d], theta[:, d], theta[:, d + 1])
+            Kinv = np.linalg.inv(K)
+            alpha = np.einsum("omn,on->om", Kinv, Z)
+            A = alpha[:, :, None] * alpha[:, None, :] - Kinv
+            AK = A * Kf
+            g = np.empty_like(theta)
+            g[:, :d] = 0.5 * (AK.reshape(O, -1) @ D2.reshape(d, -1).T) * np.exp(-2.0 * theta[:, :d])
+            g[:, d] = 0.5 * AK.sum(axis=(1, 2))
+            g[:, d + 1] = 0.5 * np.exp(theta[:, d + 1]) * np.trace(A, axis1=1, axis2=2) if log_sn2 is None else 0.0
+            g[:, :d] -= (theta[:, :d] - theta0) / self.ls_prior_sd ** 2
+            m1 = 0.9 * m1 + 0.1 * g
+            m2 = 0.999 * m2 + 0.001 * g ** 2
+            step = self.lr * (m1 / (1 - 0.9 ** it)) / (np.sqrt(m2 / (1 - 0.999 ** it)) + 1e-8)
+            theta = np.clip(theta + step, lo, hi)
+        return theta
+
+    def fit(self, X, Y, noise_var=None):
+        """Fit hyperparameters on at most ``max_fit`` random points, then condition on all of ``X``.
+
+        ``noise_var`` (O,) fixes σ_n² in output units instead of fitting it.
+        """
+        X = np.asarray(X, dtype=float)
+        Y = np.asarray(Y, dtype=float)
+        self.X = X
+        self.y_mean = Y.mean(axis=0)
+        self.y_std = np.where(Y.std(axis=0) > 1e-12, Y.std(axis=0), 1.0)
+        Z = ((Y - self.y_mean) / self.y_std).T  # (O, M)
+        M, d = X.shape
+        sub = np.sort(np.random.default_rng(self.seed).permutation(M)[:self.max_fit])
+        log_sn2 = None
+        if noise_var is not None:
+            log_sn2 = np.clip(np.log(np.maximum(np.asarray(noise_var, dtype=float), 1e-300) / self.y_std ** 2), *self.LOG_BOUNDS["sn2"])
+        theta = self._optimize(X[sub], Z[:, sub], log_sn2)
+        self.log_ls, self.log_sf2, self.log_sn2 = theta[:, :d], theta[:, d], theta[:, d + 1]
+        _, K = self._kernels((X.T[:, :, None] - X.T[:, None, :]) ** 2, self.log_ls, self.log_sf2, self.log_sn2)
+        L = np.linalg.cholesky(K)
+        self.Kinv = np.linalg.inv(K)
+        self.alpha = np.einsum("omn,on->om", self.Kinv, Z)
+        self._Z = Z
+        self.log_marginal = (-0.5 * np.sum(Z * self.alpha, axis=1)
+                             - np.log(np.diagonal(L, axis1=1, axis2=2)).sum(axis=1) - 0.5 * M * np.log(2 * np.pi))
+        self._inv_ls2 = np.exp(-2.0 * self.log_ls)  # (O, d)
+        self._sf2 = np.exp(self.log_sf2)
+        return self
+
+    @property
+    def noise_sd(self) -> np.ndarray:
+        """Fitted noise SD of every output in output units."""
+        return np.sqrt(np.exp(self.log_sn2)) * self.y_std
+
+    @property
+    def lengthscales(self) -> np.ndarray:
+        return np.exp(self.log_ls)
+
+    def predict(self, X, noise: bool = False, sd: bool = True):
+        """Mean and SD (B, O) at the points ``X`` (B, d); ``noise=True`` adds the nugget variance.
+
+        The mean costs O(O·M·d) per point, the SD another O(O·M²); ``sd=False`` returns the mean only.
+        """
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        diff2 = (X[:, None, :] - self.X[None, :, :]) ** 2  # (B, M, d)
+        k = self._sf2[None, :, None] * np.exp(-0.5 * (diff2 @ self._inv_ls2.T).transpose(0, 2, 1))  # (B, O, M)
+        mean = (k * self.alpha).sum(axis=-1) * self.y_std + self.y_mean
+        if not sd:
+            return mean
+        v = np.matmul(k.transpose(1, 0, 2), self.Kinv).transpose(1, 0, 2)
+        var = self._sf2[None, :] - (v * k).sum(axis=-1)
+        if noise:
+            var = var + np.exp(self.log_sn2)[None, :]
+        return mean, np.sqrt(np.maximum(var, 0.0)) * self.y_std
+
+    def loo(self):
+        """Closed-form leave-one-out predictive mean and SD (M, O) of the training outputs (noise included)."""
+        diag = np.diagonal(self.Kinv, axis1=1, axis2=2)  # (O, M)
+        mean = self._Z - self.alpha / diag
+        return (mean * self.y_std[:, None] + self.y_mean[:, None]).T, (np.sqrt(1.0 / diag) * self.y_std[:, None]).T
+
+
+def accuracy(y, mean, sd) -> dict:
+    """RMSE, R² and share of ``y`` inside the 95% interval ``mean ± 1.96·sd`` (per column)."""
+    y, mean, sd = (np.asarray(a, dtype=float) for a in (y, mean, sd))
+    err = y - mean
+    sst = ((y - y.mean(axis=0)) ** 2).sum(axis=0)
+    r2 = np.where(sst > 1e-12, 1.0 - (err ** 2).sum(axis=0) / np.maximum(sst, 1e-300), np.nan)
+    return dict(rmse=np.sqrt((err ** 2).mean(axis=0)), r2=r2, coverage95=(np.abs(err) <= 1.96 * sd + 1e-12).mean(axis=0))
+
+
+# -------------------------------------------------------------------
+# شبیه‌ساز جایگزین
+# -------------------------------------------------------------------
+@dataclass
+class Emulator:
+    space: DesignSpace
+    outputs: list
+    gp: GaussianProcess
+    design: pd.DataFrame  # نقطه‌های طرح (پارامترها) + خروجی‌های شبیه‌سازی
+    diagnostics: pd.DataFrame  # برای هر خروجی: دقت LOO (و آزمون)، نویز و طول‌مقیاس‌ها
+    steps: int
+    replicas: int
+
+    def predict(self, X, noise: bool = False, sd: bool = True):
+        """Mean and SD (B, O) for parameter vectors ``X`` (B, dim) in parameter units."""
+        return self.gp.predict(self.space.scale(np.atleast_2d(X)), noise=noise, sd=sd)
+
+    def predict_frame(self, x, noise: bool = False) -> pd.DataFrame:
+        """One parameter vector → frame indexed by output with ``mean`` and ``sd``."""
+        mean, sd = self.predict(x, noise=noise)
+        return pd.DataFrame({"mean": mean[0], "sd": sd[0]}, index=pd.Index(self.outputs, name="output"))
+
+
+def train_emulator(world, names, bounds=None, n_design: int = 256, replicas: int = 4, steps: int = 70, t0: int = 0,
+                   seed=0, n_test: int = 0, batch_size: int = 128, executor=None, iters: int = 200) -> Emulator:
+    """Fit an :class:`Emulator` of ``world`` over the inputs ``names`` (see :class:`DesignSpace`).
+
+    ``n_design`` Latin-hypercube points (plus ``n_test`` held-out points) are simulated with
+    :func:`simulate_design` in chunks of ``batch_size`` (optionally on ``executor``; chunk k uses
+    seed ``(seed, k)``), then a :class:`GaussianProcess` is fitted to every
+    output, with the noise fixed at the replica-mean Monte Carlo variance. ``diagnostics`` has the
+    closed-form leave-one-out RMSE / R² / 95% coverage and, with ``n_test > 0``, the same scores
+    on the held-out points, plus ``run_sd``, the SD of a single run around the mean.
+    """
+    space = DesignSpace(world, names, bounds)
+    rng = np.random.default_rng(seed)
+    X = space.unscale(latin_hypercube(n_design, space.dim, rng))
+    X_test = space.unscale(rng.random((int(n_test), space.dim)))
+    allX = np.vstack([X, X_test])
+    jobs = [(world, space, allX[i:i + int(batch_size)], dict(steps=steps, replicas=replicas, t0=t0,
+                                                        seed=None if seed is None else (int(seed), k)))
+            for k, i in enumerate(range(0, len(allX), int(batch_size)))]
+    parts = executor.map(_simulate_chunk, jobs) if executor is not None else map(_simulate_chunk, jobs)
+    means, sds = zip(*parts)
+    Y_all = pd.concat(means, ignore_index=True)
+    outputs = list(Y_all.columns)
+    Y, Y_test = Y_all.iloc[:len(X)].to_numpy(), Y_all.iloc[len(X):].to_numpy()
+    # SD یک اجرای تکی (میانگین واریانس درون نقطه‌ها)؛ واریانس نویز میانگین R تکرار = run_sd² / R
+    run_sd = np.sqrt((pd.concat(sds, ignore_index=True).iloc[:len(X)].to_numpy() ** 2).mean(axis=0))
+
+    gp = GaussianProcess(iters=iters).fit(space.scale(X), Y, noise_var=run_sd ** 2 / int(replicas) if int(replicas) > 1 else None)
+    diag = {f"loo_{k}": v for k, v in accuracy(Y, *gp.loo()).items()}
+    if len(X_test):
+        diag.update({f"test_{k}": v for k, v in accuracy(Y_test, *gp.predict(space.scale(X_test), noise=True)).items()})
+    diag["noise_sd"] = gp.noise_sd
+    diag["run_sd"] = run_sd
+    diag["output_sd"] = Y.std(axis=0)
+    diag.update({f"lengthscale[{label}]": gp.lengthscales[:, j] for j, label in enumerate(space.labels)})
+    diagnostics = pd.DataFrame(diag, index=pd.Index(outputs, name="output"))
+    design = pd.concat([pd.DataFrame(X, columns=space.labels), Y_all.iloc[:len(X)].reset_index(drop=True)], axis=1)
+    return Emulator(space, outputs, gp, design, diagnostics, int(steps), int(replicas))
@@ -0,0 +1,128 @@
+# synthetic.py
+# -------------------------------------------------------------------
+# تولید سناریوی مصنوعی برای «جهان بزرگ» (صدها تا هزاران کشور):
+# - هر کشور یک «الگوی دکترین» (تهاجمی/نفوذمحور/متوازن) دارد و پارامترهایش
+#   از توزیع‌های حول آن الگو نمونه‌گیری می‌شود.
+# - شبکه رقابت تُنُک است: هر کشور k همسایه دارد (چند متحد از بلوک خودش،
+#   بقیه رقیب از بلوک‌های دیگر). حافظه O(N·k) است نه O(N²).
+# -------------------------------------------------------------------
+
+from dataclasses import dataclass
+
+import numpy as np
+
+from model5 import ActionBases, AgentArrays, InteractionGraph, MultiAgentWorld, StateDynamicsCoeffs, sigmoid
+
+# (پایین، بالا) برای نمونه‌گیری یکنواخت هر پارامتر، به تفکیک الگوی دکترین
+DOCTRINE_ARCHETYPES = {
+    "hawk": dict(rho=(0.50, 0.75), d=(0.35, 0.55), f=(0.55, 0.75), chi=(1.10, 1.30),
+                 pref=((0.8, 1.1), (0.6, 0.9), (1.2, 1.6))),
+    "influencer": dict(rho=(0.30, 0.45), d=(0.70, 0.90), f=(0.40, 0.55), chi=(0.90, 1.05),
+                       pref=((0.7, 1.0), (1.3, 1.7), (0.5, 0.8))),
+    "balancer": dict(rho=(0.35, 0.55), d=(0.50, 0.70), f=(0.50, 0.65), chi=(1.00, 1.15),
+                     pref=((1.0, 1.3), (0.9, 1.2), (0.7, 1.0))),
+}
+
+
+@dataclass
+class SyntheticScenario:
+    arrays: AgentArrays
+    interaction: InteractionGraph
+    bloc_labels: np.ndarray
+    archetypes: np.ndarray  # index into list(DOCTRINE_ARCHETYPES)
+    action_bases: ActionBases = None
+
+    @property
+    def n(self) -> int:
+        return self.arrays.n
+
+    def build_world(self, **kwargs) -> MultiAgentWorld:
+        """Vectorized world over a fresh copy of the generated state (the scenario stays reusable)."""
+        kwargs.setdefault("bloc_labels", self.bloc_labels)
+        if self.action_bases is not None:
+            kwargs.setdefault("action_bases", self.action_bases)
+        return MultiAgentWorld.from_arrays(self.arrays.copy(), self.interaction, **kwargs)
+
+
+def generate_scenario(n: int, seed=None, degree: int = 8, n_blocs: int = 4, ally_fraction: float = 0.25,
+                      archetype_mix=(0.3, 0.3, 0.4), dyn_coeffs: StateDynamicsCoeffs = None,
+                      action_bases: ActionBases = None) -> SyntheticScenario:
+    """Random large-world scenario with doctrine/parameter draws and a sparse bloc rivalry network.
+
+    Parameters
+    ----------
+    n : number of countries
+    degree : candidate targets per country (neighbours in the sparse W)
+    n_blocs : number of blocs; allies come from the own bloc, rivals from the others
+    ally_fraction : share of each country's neighbours that are allies (W > 0)
+    archetype_mix : probabilities of hawk / influencer / balancer doctrines
+    action_bases : action space; actions beyond P/S/R get a neutral tactical preference
+    """
+    rng = np.random.default_rng(seed)
+    n = int(n)
+    if n < 2:
+        raise ValueError("n must be at least 2")
+    degree = int(max(1, min(degree, n - 1)))
+    n_blocs = int(max(1, min(n_blocs, n)))
+
+    names = [f"C{i:04d}" for i in range(n)]
+    arche_keys = list(DOCTRINE_ARCHETYPES)
+    mix = np.asarray(archetype_mix, dtype=float)
+    arche = rng.choice(len(arche_keys), size=n, p=mix / mix.sum())
+
+    def draw(key):
+        lo = np.array([DOCTRINE_ARCHETYPES[arche_keys[a]][key][0] for a in arche])
+        hi = np.array([DOCTRINE_ARCHETYPES[arche_keys[a]][key][1] for a in arche])
+        return rng.uniform(lo, hi)
+
+    pref = np.stack([
+        rng.uniform([DOCTRINE_ARCHETYPES[arche_keys[a]]["pref"][k][0] for a in arche],
+                    [DOCTRINE_ARCHETYPES[arche_keys[a]]["pref"][k][1] for a in arche])
+        for k in range(3)
+    ], axis=1)
+    K = action_bases.n_actions if action_bases is not None else 3
+    if K > 3:
+        pref = np.concatenate([pref, rng.uniform(0.6, 1.0, size=(n, K - 3))], axis=1)
+    omega_S = rng.uniform([2.2, 1.2, 1.6], [3.8, 3.6, 2.6], size=(n, 3))
+    v_c = rng.uniform(0.45, 0.80, n)
+    lambda_v = (dyn_coeffs or StateDynamicsCoeffs()).lambda_v
+
+    arrays = AgentArrays(
+        names,
+        resource=rng.lognormal(np.log(1300.0), 0.2, n),
+        v_c=v_c,
+        tension=sigmoid(lambda_v * v_c),  # tension_0 = σ(lambda_v * v_c)، مثل HierarchicalAgent
+        rho_c=draw("rho"), d_c=draw("d"), f_c=draw("f"), chi_c=draw("chi"),
+        lambda_op=rng.uniform(0.40, 0.70, n), tau_c=rng.uniform(4.5, 6.2, n), eps_c=rng.uniform(0.52, 0.62, n),
+        income_c=rng.uniform(13.0, 20.0, n), eta_c=rng.uniform(1.0, 1.25, n), kappa_c=rng.uniform(0.9, 1.1, n),
+        beta_c=rng.uniform(1.8, 2.3, n),
+        omega_S=omega_S / omega_S.sum(axis=1, keepdims=True),
+        omega_C=np.ones((n, 3)), omega_R=np.ones((n, 3)),
+        omega_a=pref / pref.sum(axis=1, keepdims=True),
+        p_ab=rng.uniform([2.1, 1.9], [2.8, 2.6], size=(n, 2)),
+        r_ab=rng.uniform([2.0, 2.0], [2.7, 2.7], size=(n, 2)),
+        action_counts=np.zeros((n, K), dtype=int),
+    )
+
+    # bloc assignment + sparse neighbour lists (allies inside bloc, rivals outside)
+    blocs = rng.integers(0, n_blocs, size=n)
+    members = [np.nonzero(blocs == g)[0] for g in range(n_blocs)]
+    n_ally = int(round(degree * ally_fraction))
+    neighbors = -np.ones((n, degree), dtype=np.int64)
+    w = np.zeros((n, degree), dtype=float)
+    for i in range(n):
+        own = members[blocs[i]]
+        own = own[own != i]
+        k_a = min(n_ally, len(own))
+        allies = rng.choice(own, size=k_a, replace=False) if k_a else np.zeros(0, dtype=np.int64)
+        others = np.nonzero(blocs != blocs[i])[0] if n_blocs > 1 else own
+        others = np.setdiff1d(others, allies)
+        k_r = min(degree - k_a, len(others))
+        rivals = rng.choice(others, size=k_r, replace=False) if k_r else np.zeros(0, dtype=np.int64)
+        neighbors[i, :k_a] = allies
+        neighbors[i, k_a:k_a + k_r] = rivals
+        w[i, :k_a] = rng.uniform(0.2, 0.8, k_a)
+        w[i, k_a:k_a + k_r] = rng.uniform(-0.95, -0.3, k_r)
+
+    return SyntheticScenario(arrays=arrays, interaction=InteractionGraph(neighbors, w, n=n),
+                             bloc_labels=blocs, archetypes=arche, action_bases=action_bases)
@@ -0,0 +1,37 @@
+# tests/conftest.py
+# -------------------------------------------------------------------
+# ماژول‌های v5 با import تخت (from model5 import ...) بارگذاری می‌شوند؛
+# سازنده جهان‌های سناریوی برنامه (موتور loop) برای همه آزمون‌ها.
+# -------------------------------------------------------------------
+
+import os
+import sys
+import warnings
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+warnings.filterwarnings("ignore", message=".*ScriptRunContext.*")
+
+import app  # noqa: E402
+from model5 import EscalationCoeffs, MultiAgentWorld  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def scenarios():
+    return app.scenario_pack()
+
+
+@pytest.fixture
+def scenario_world(scenarios):
+    """Loop-engine world of an app scenario, built the way the app builds it."""
+
+    def make(name="scenario_1", seed=0, **kwargs):
+        np.random.seed(seed)
+        sc = scenarios[name]
+        kwargs.setdefault("bayes_update_every", 0)
+        return MultiAgentWorld(agents=app.build_agents_from_configs(sc["agents"]), interaction_W=sc["W"],
+                               esc_coeffs=EscalationCoeffs(), **kwargs)
+
+    return make
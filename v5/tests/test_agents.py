@@ -0,0 +1,27 @@
+import copy
+import pickle
+
+import numpy as np
+
+import app
+from model5 import AgentArrays, EscalationCoeffs, MultiAgentWorld
+
+
+def test_standalone_agent_matches_its_row_once_attached(scenarios):
+    sc = scenarios["scenario_1"]
+    agents = app.build_agents_from_configs(sc["agents"])
+    ag = agents[0]
+    assert ag._arr is None
+    ag.p_ab[0] += 1.0
+    before = {f: np.array(getattr(ag, f)) for f in AgentArrays.FIELDS}
+    beliefs = (ag.p_c, ag.r_c, ag.pr_c)
+    same = pickle.loads(pickle.dumps(ag))
+    assert all(np.array_equal(getattr(same, f), v) for f, v in before.items())
+    assert copy.deepcopy(ag).p_c == ag.p_c
+
+    world = MultiAgentWorld(agents=agents, interaction_W=sc["W"], esc_coeffs=EscalationCoeffs())
+    assert ag._arr is world.arrays and ag._own is None
+    assert all(np.array_equal(getattr(ag, f), v) for f, v in before.items())
+    assert (ag.p_c, ag.r_c, ag.pr_c) == beliefs
+    ag.rho_c = 0.9
+    assert world.arrays.rho_c[0] == 0.9
@@ -0,0 +1,77 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import app
+
+
+def test_concurrent_seeded_runs_are_reproducible(scenarios):
+    sc = scenarios["scenario_1"]
+
+    def run(seed):
+        return app.run_simulation(sc["agents"], sc["W"], 20, True, seed, 5)[0]
+
+    solo = [run(seed) for seed in (1, 2, 3, 4)]
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        together = list(pool.map(run, (1, 2, 3, 4)))
+    assert all(a.equals(b) for a, b in zip(solo, together))
+
+
+def test_checkpoints_stay_out_of_cache_and_registry(tmp_path, scenarios):
+    sc = scenarios["scenario_1"]
+    args = (sc["agents"], sc["W"], 20, True, 5, 5, 1)
+    registry = app.ExperimentRegistry(str(tmp_path / "registry"))
+    cache = app.ResultCache(directory=str(tmp_path / "cache"))
+    key = app.simulation_cache_key(*args)
+
+    df, meta, _ = app.cached_simulations(cache, key, lambda: app.registered_run_multiple_simulations(registry, True, "s", *args))
+    assert sorted(meta["checkpoints"]) == [0, 5, 10, 15]
+    assert "checkpoints" not in cache.get(key)[1]
+    assert "checkpoints" not in registry.load(key)[1]
+
+    rebuilt = app.rebuild_checkpoints(*args)
+    assert sorted(rebuilt) == sorted(meta["checkpoints"])
+    assert app.run_branch(rebuilt[10], 10, 20, {}).equals(df)
+
+
+def test_variance_reduced_replicas(scenarios):
+    sc = scenarios["scenario_1"]
+    args = (sc["agents"], sc["W"], 30, True, 7, 5, 6, None, {"engine": "vectorized", "antithetic": True, "pooled": False})
+    df, meta, dfs = app.run_multiple_simulations(*args)
+    assert len(dfs) == 6 and "Global_Escalation_RB" in df.columns
+    assert list(meta["variance_reduction"]["technique"]) == ["rao_blackwell", "antithetic"]
+    assert app.run_multiple_simulations(*args)[0].equals(df)
+    assert app.simulation_cache_key(*args) != app.simulation_cache_key(*args[:-1])
+
+
+def test_pooled_replicas_share_one_fit_per_update(scenarios):
+    sc = scenarios["scenario_1"]
+    for engine in ("loop", "vectorized"):
+        ensemble = {"engine": engine, "antithetic": False, "pooled": True}
+        df, meta, dfs = app.run_multiple_simulations(sc["agents"], sc["W"], 40, True, 3, 5, 4, None, ensemble)
+        assert len(dfs) == 4 and meta["pooled_fits"] > 0
+        assert meta["pooled_fits"] <= 40 // app.BAYES_SETTINGS["bayes_update_every"]
+
+
+def test_dyad_tensors_are_built_once_per_result(tmp_path, scenarios):
+    sc = scenarios["scenario_6"]
+    countries = [c["name"] for c in sc["agents"]]
+    registry = app.ExperimentRegistry(str(tmp_path / "registry"))
+    for num_runs in (1, 3):
+        args = (sc["agents"], sc["W"], 15, True, 2, 5, num_runs)
+        df, meta, _ = app.registered_run_multiple_simulations(registry, True, "s", *args)
+        for name in app.MultiAgentWorld.TENSOR_SERIES:
+            assert np.array_equal(meta["tensors"][name], app.dyad_tensor_from_df(df, countries, name))
+        stored = registry.load(app.simulation_cache_key(*args))[1]["tensors"]
+        assert app.result_tensors(df, {"tensors": stored}, countries) is stored
+    legacy = {}
+    assert app.result_tensors(df, legacy, countries) is legacy["tensors"]
+
+
+def test_mean_field_comparison_runs_only_on_request(scenarios):
+    sc = scenarios["scenario_1"]
+    _, meta, _ = app.run_multiple_simulations(sc["agents"], sc["W"], 20, True, 1, 5, 2)
+    assert "mean_field" not in meta
+    steady = {"tol": 0.05, "fast_forward": True}
+    fast = app.run_mean_field(sc["agents"], sc["W"], 150, 0, steady)
+    assert len(fast) == 150 and not fast.equals(app.run_mean_field(sc["agents"], sc["W"], 150, 0))
@@ -0,0 +1,50 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import model5
+
+
+class _GatedExecutor(ThreadPoolExecutor):
+    """Pool whose fits stay pending until ``release`` is set."""
+
+    def __init__(self):
+        super().__init__(max_workers=1)
+        self.release = threading.Event()
+
+    def submit(self, fn, *args, **kwargs):
+        def gated():
+            self.release.wait(10)
+            return fn(*args, **kwargs)
+        return super().submit(gated)
+
+
+def test_clone_shares_executor_and_does_not_wait_for_pending_fit(scenario_world):
+    pool = _GatedExecutor()
+    try:
+        world = scenario_world(engine="vectorized", bayes_update_every=5, bayes_min_samples=5,
+                               bayes_async="deterministic", bayes_staleness=3, bayes_executor=pool)
+        world.run(6)
+        assert world._bayes_job is not None and not world._bayes_job[1].done()
+        job = world._bayes_job
+
+        copy = world.clone()
+        branch = world.fork(seed=1)
+        assert copy.bayes_executor is pool and branch.bayes_executor is pool
+        assert world._bayes_job is job
+        assert copy._bayes_job[1] is not job[1]
+
+        pool.release.set()
+        world.run(4, t0=6)
+        copy.run(4, t0=6)
+        assert world._bayes_job is None and copy._bayes_job is None
+        assert np.allclose(world.esc.alpha_vector(), copy.esc.alpha_vector())
+        assert world.esc.alpha_vector() is not copy.esc.alpha_vector()
+    finally:
+        pool.release.set()
+        pool.shutdown()
+
+
+def test_default_fit_pool_is_created_lazily():
+    assert model5._fit_executor() is model5._fit_executor()
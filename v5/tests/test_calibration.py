@@ -0,0 +1,22 @@
+import numpy as np
+import pandas as pd
+
+from calibration import Panel, ParamSpace, calibrate, panel_loglik
+
+
+def test_calibrate_loop_engine_world(scenario_world):
+    # جهان‌های برنامه موتور loop دارند (interaction = None)
+    world = scenario_world("scenario_1", seed=3)
+    assert world.engine == "loop" and world.interaction is None
+    start = world.clone()
+    world.run(60)
+    panel = Panel.from_history(pd.DataFrame(world.history), world.names)
+
+    params = ["rho_c", "esc.psi_bias"]
+    space = ParamSpace(params, start)
+    ll0 = panel_loglik(start, space, space.initial(start)[None], panel)[0]
+    assert np.isfinite(ll0)
+
+    res = calibrate(start, panel, params, n_starts=1, seed=0, max_iter=20)
+    assert np.isfinite(res.estimates["estimate"]).all()
+    assert res.loglik >= ll0 - 1e-6
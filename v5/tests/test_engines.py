@@ -0,0 +1,69 @@
+import os
+
+import numpy as np
+import pytest
+
+import app
+from synthetic import generate_scenario
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "loop_baseline.npz")
+# خروجی موتور loop پیش از افزودن موتورهای vectorized/mean_field:
+# run_multiple_simulations(..., steps=60, test_mode=True, seed=7, doctrine_update_every=5, num_runs=2).
+# اختلاف مجاز در حد گرد کردن ممیز شناور است (Tension تا ۱ ULP جابه‌جا می‌شود)، نه رفتار.
+
+
+@pytest.fixture(scope="module")
+def baseline():
+    with np.load(BASELINE) as z:
+        return {k: z[k] for k in z.files}
+
+
+@pytest.mark.parametrize("name", ["scenario_1", "scenario_6"])
+def test_loop_engine_matches_stored_baseline(scenarios, baseline, name):
+    sc = scenarios[name]
+    df, meta, _ = app.run_multiple_simulations(sc["agents"], sc["W"], 60, True, 7, 5, 2)
+    columns = list(baseline[f"{name}.columns"])
+    assert set(columns) <= set(df.columns)
+    np.testing.assert_allclose(df[columns].to_numpy(dtype=float), baseline[f"{name}.values"],
+                               rtol=0, atol=1e-9, equal_nan=True)
+    final = {f"{c}.{f}": v for c, d in meta["final"].items() for f, v in d.items()}
+    got = np.array([final[k] for k in baseline[f"{name}.final_names"]], dtype=float)
+    np.testing.assert_allclose(got, baseline[f"{name}.final_values"], rtol=0, atol=1e-9)
+
+
+@pytest.fixture(scope="module")
+def synthetic_scenario():
+    return generate_scenario(60, seed=3)
+
+
+def run_summary(sc, steps=40, **kwargs):
+    world = sc.build_world(**kwargs)
+    world.run(steps)
+    return world.summary.to_frame()
+
+
+def test_vectorized_engine_invariants(synthetic_scenario):
+    df = run_summary(synthetic_scenario, seed=5)
+    assert df.equals(run_summary(synthetic_scenario, seed=5))
+    assert not df.equals(run_summary(synthetic_scenario, seed=6))
+    assert df["Time"].tolist() == list(range(40))
+    assert df["Mean_Tension"].between(0.0, 1.0).all() and (df["Mean_Resource"] >= 0).all()
+    assert df["Escalations"].between(0, synthetic_scenario.n).all()
+    shares = df.filter(like="Share_").sum(axis=1)
+    assert np.allclose(shares, 1.0)
+    assert df["Global_Escalation"].between(0.0, 1.0).all()
+    # برآورد Rao-Blackwell همان امید ریاضی شمار تشدیدهاست، با پراکندگی کمتر
+    assert abs(df["Escalations_RB"].mean() - df["Escalations"].mean()) < 0.1 * df["Escalations"].mean()
+    assert df["Escalations_RB"].std() < df["Escalations"].std()
+
+
+def test_mean_field_engine_invariants(synthetic_scenario):
+    df = run_summary(synthetic_scenario, seed=0, engine="mean_field")
+    assert df.equals(run_summary(synthetic_scenario, seed=1, engine="mean_field"))
+    assert df["Mean_Tension"].between(0.0, 1.0).all() and (df["Mean_Resource"] >= 0).all()
+    assert np.allclose(df.filter(like="Share_").sum(axis=1), 1.0)
+    # تقریب میانگین Monte Carlo: خطای بستار (closure) چند درصد است، نه بیشتر
+    mc = np.mean([run_summary(synthetic_scenario, seed=s)[["Mean_Tension", "Escalations"]].iloc[-10:].mean()
+                  for s in range(4)], axis=0)
+    mf = df[["Mean_Tension", "Escalations"]].iloc[-10:].mean().to_numpy()
+    np.testing.assert_allclose(mf, mc, rtol=0.15)
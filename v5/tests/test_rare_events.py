@@ -0,0 +1,30 @@
+import pytest
+
+from model5 import RecordingSpec
+from rare_events import CumulativeEscalations, EscalationStreak, PathScore, multilevel_splitting, naive_probability
+from synthetic import generate_scenario
+
+
+@pytest.fixture(scope="module")
+def scenario():
+    return generate_scenario(40, seed=1)
+
+
+def test_path_score_is_abstract():
+    with pytest.raises(TypeError):
+        PathScore()
+
+
+@pytest.mark.parametrize("recording", [RecordingSpec("summary", stride=3), RecordingSpec("none")])
+def test_splitting_needs_a_summary_row_every_step(scenario, recording):
+    world = scenario.build_world(seed=0, recording=recording)
+    with pytest.raises(ValueError, match="stride=1"):
+        multilevel_splitting(world, EscalationStreak, [1, 2], horizon=10, n_particles=4)
+    with pytest.raises(ValueError, match="stride=1"):
+        naive_probability(world, CumulativeEscalations, 5, horizon=10, n_runs=2)
+
+
+def test_splitting_runs_on_a_per_step_summary(scenario):
+    world = scenario.build_world(seed=0)
+    result = multilevel_splitting(world, lambda: EscalationStreak(min_dyads=10), [2, 4], horizon=20, n_particles=20, seed=0)
+    assert 0.0 <= result.estimate <= 1.0 and len(result.level_probs) == 2
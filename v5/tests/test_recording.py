@@ -0,0 +1,24 @@
+import numpy as np
+import pandas as pd
+
+from dyads import dyad_tensor_from_df
+from model5 import RecordingSpec
+
+
+def test_dyad_tensors_are_built_from_history(scenario_world):
+    world = scenario_world("scenario_6", seed=2, recording=RecordingSpec("full", stride=3))
+    world.run(30)
+    assert not hasattr(world, "_tensor_history")
+    tensors = world.history_tensors()
+    frame = pd.DataFrame(world.history)
+    names = world.arrays.names
+    for family in world.TENSOR_SERIES:
+        assert tensors[family].shape == (10, len(names), len(names))
+        assert np.array_equal(tensors[family], dyad_tensor_from_df(frame, names, family))
+
+
+def test_series_filter_drops_unkept_tensors(scenario_world):
+    world = scenario_world(recording=RecordingSpec("full", series=("Crisis",)))
+    world.run(5)
+    tensors = world.history_tensors()
+    assert tensors["Crisis"].shape[0] == 5 and tensors["DyadTension"].shape[0] == 0
@@ -0,0 +1,13 @@
+import app
+from registry import ExperimentRegistry
+
+
+def test_unseeded_runs_are_recorded_but_never_served_from_registry(tmp_path, scenarios):
+    registry = ExperimentRegistry(str(tmp_path))
+    sc = scenarios["scenario_1"]
+    args = (sc["agents"], sc["W"], 8, False, None, 5, 1)
+
+    a = app.registered_run_multiple_simulations(registry, True, "scenario_1", *args)[0]
+    b = app.registered_run_multiple_simulations(registry, True, "scenario_1", *args)[0]
+    assert len(registry) == 1 and registry.find()["seed"].isna().all()
+    assert not a.equals(b)
@@ -0,0 +1,37 @@
+import pandas as pd
+
+import app
+from registry import ExperimentRegistry
+from result_cache import ResultCache
+
+
+def test_get_returns_independent_copies(tmp_path):
+    cache = ResultCache(directory=str(tmp_path))
+    df = pd.DataFrame({"x": [1.0, 2.0]})
+    cache.put("k", (df, {"a": 1}))
+    df.loc[0, "x"] = -1.0
+
+    first, meta = cache.get("k")
+    first["y"] = 0.0
+    meta["a"] = 2
+    second, meta2 = cache.get("k")
+    assert list(second.columns) == ["x"] and second["x"].tolist() == [1.0, 2.0]
+    assert meta2 == {"a": 1}
+
+    disk = ResultCache(directory=str(tmp_path)).get("k")[0]
+    assert disk["x"].tolist() == [1.0, 2.0]
+
+
+def test_unseeded_runs_are_not_cached(tmp_path, monkeypatch, scenarios):
+    cache = ResultCache(directory=str(tmp_path / "cache"))
+    monkeypatch.setattr(app, "get_result_cache", lambda: cache)
+    monkeypatch.setattr(app, "get_registry", lambda: ExperimentRegistry(str(tmp_path / "registry")))
+    sc = scenarios["scenario_1"]
+
+    def run(test_mode, seed):
+        return app.cached_run_multiple_simulations(sc["agents"], sc["W"], 8, test_mode, seed, 5, 1)[0]
+
+    a, b = run(False, None), run(False, None)
+    assert len(cache._mem) == 0 and not a.equals(b)
+    c, d = run(True, 3), run(True, 3)
+    assert len(cache._mem) == 1 and c.equals(d)